@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Binary container for timestamp files. Layout, all integers little-endian:
+
+    header   magic "TMSB", version (uint16), flags (uint16), count (uint64)
+    starts   count x int64 start times in milliseconds
+    ends     count x int64 end times in milliseconds
+    offsets  (count + 1) x uint64 byte offsets of each description in blob
+    nulls    count x uint8, 1 where the description is null rather than ""
+    blob     UTF-8 descriptions, back to back
+"""
+from array import array
+import struct
+import sys
+
+MAGIC = b"TMSB"
+SQLITE_MAGIC = b"SQLite format 3\x00"
+VERSION = 1
+FLAG_SORTED = 0x1
+HEADER = struct.Struct("<4sHHQ")
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "binary"
+FORMAT_SQLITE = "sqlite"
+FORMATS = (FORMAT_JSON, FORMAT_BINARY, FORMAT_SQLITE)
+
+
+def detect_format(filename):
+    with open(filename, "rb") as input_file:
+        magic = input_file.read(len(SQLITE_MAGIC))
+    if magic == SQLITE_MAGIC:
+        return FORMAT_SQLITE
+    return FORMAT_BINARY if magic[:len(MAGIC)] == MAGIC else FORMAT_JSON
+
+
+def _little_endian(column):
+    if sys.byteorder == "big":
+        column = array(column.typecode, column)
+        column.byteswap()
+    return column.tobytes()
+
+
+def _native(typecode, data):
+    column = array(typecode)
+    column.frombytes(data)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def encode_binary(start_times, end_times, descriptions, is_sorted):
+    """
+    :param start_times: array('q') of start times in milliseconds
+    :param end_times: array('q') of end times in milliseconds
+    :param descriptions: list of str or None
+    :return: The file content as bytes
+    """
+    count = len(descriptions)
+    offsets = array("Q", [0])
+    nulls = bytearray(count)
+    chunks = []
+    position = 0
+    for row, description in enumerate(descriptions):
+        if description is None:
+            nulls[row] = 1
+        else:
+            chunk = description.encode("utf-8")
+            chunks.append(chunk)
+            position += len(chunk)
+        offsets.append(position)
+    return b"".join([
+        HEADER.pack(MAGIC, VERSION, FLAG_SORTED if is_sorted else 0, count),
+        _little_endian(start_times),
+        _little_endian(end_times),
+        _little_endian(offsets),
+        bytes(nulls),
+        b"".join(chunks)
+    ])
+
+
+def decode_binary(content):
+    """
+    :return: (start_times, end_times, descriptions, is_sorted)
+    :raise ValueError: If content is not a valid binary timestamp file
+    """
+    if len(content) < HEADER.size:
+        raise ValueError("Truncated header")
+    magic, version, flags, count = HEADER.unpack_from(content)
+    if magic != MAGIC:
+        raise ValueError("Not a binary timestamp file")
+    if version > VERSION:
+        raise ValueError("Unsupported binary timestamp file version " +
+                         str(version))
+    position = HEADER.size
+    sections = []
+    for size in (count * 8, count * 8, (count + 1) * 8, count):
+        sections.append(content[position:position + size])
+        position += size
+        if len(sections[-1]) != size:
+            raise ValueError("Truncated binary timestamp file")
+    start_times = _native("q", sections[0])
+    end_times = _native("q", sections[1])
+    offsets = _native("Q", sections[2])
+    nulls = sections[3]
+    blob = content[position:]
+    if offsets[count] != len(blob):
+        raise ValueError("Description blob does not match its offsets")
+    descriptions = [
+        None if nulls[row] else
+        blob[offsets[row]:offsets[row + 1]].decode("utf-8")
+        for row in range(count)
+    ]
+    return start_times, end_times, descriptions, bool(flags & FLAG_SORTED)
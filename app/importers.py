@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Importers turning subtitle, cue sheet, edit decision list and CSV files into
+timestamps. Each one is a generator over the lines of a file, so a file of
+any size is read with a fixed amount of memory. Malformed lines are passed to
+a report(line number, message) callback and skipped. More formats can be
+added with the importer() decorator.
+"""
+import csv
+import os
+import re
+import sys
+
+from app.model import Timestamp
+
+BATCH_SIZE = 10000
+
+IMPORTERS = {}
+
+
+def importer(name, *extensions):
+    """
+    Register a function parse(lines, report, **options) that yields
+    Timestamps, for files with the given extensions. Options an importer
+    has no use for are ignored.
+    """
+    def register(parse):
+        IMPORTERS[name] = (parse, extensions)
+        return parse
+    return register
+
+
+def format_for(filename):
+    """
+    :return: The name of the importer for filename's extension, or None
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    for name, (_, extensions) in IMPORTERS.items():
+        if extension in extensions:
+            return name
+    return None
+
+
+def import_file(filename, file_format=None, report=None, **options):
+    """
+    Yield the timestamps in filename, reading it line by line
+    :param file_format: An importer name; guessed from the extension if None
+    :param report: Called with (line number, message) for each line that
+    cannot be read
+    :raise ValueError: If the format is unknown
+    """
+    file_format = file_format or format_for(filename)
+    if file_format not in IMPORTERS:
+        raise ValueError("Unknown import format for " + filename)
+    parse = IMPORTERS[file_format][0]
+    with open(filename, "r", encoding="utf-8-sig", errors="replace",
+              newline="") as input_file:
+        for timestamp in parse(input_file, report or _ignore, **options):
+            yield timestamp
+
+
+def batches(timestamps, size=BATCH_SIZE):
+    """
+    Group timestamps into lists of up to size, for the batched insert path
+    """
+    batch = []
+    for timestamp in timestamps:
+        batch.append(timestamp)
+        if len(batch) == size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _ignore(line_number, message):
+    pass
+
+
+def parse_time(text):
+    """
+    [[H:]M:]S[.mmm] to milliseconds; a comma may stand for the dot
+    :raise ValueError: If text is not such a time
+    """
+    text = text.strip()
+    if not text:
+        return 0
+    parts = text.replace(",", ".").split(":")
+    if len(parts) > 3:
+        raise ValueError("Invalid time " + text)
+    seconds, _, fraction = parts[-1].partition(".")
+    if not seconds.isdigit() or fraction and not fraction.isdigit() or \
+       not all(part.isdigit() for part in parts[:-1]):
+        raise ValueError("Invalid time " + text)
+    milliseconds = int(seconds) * 1000 + int((fraction + "000")[:3])
+    if len(parts) > 1:
+        minutes = int(parts[-2])
+        if int(seconds) >= 60 or len(parts) == 3 and minutes >= 60:
+            raise ValueError("Invalid time " + text)
+        milliseconds += minutes * 60000
+    if len(parts) == 3:
+        milliseconds += int(parts[0]) * 3600000
+    return milliseconds
+
+
+def parse_timecode(text, fps):
+    """
+    HH:MM:SS:FF (or ;FF, for drop frame) at fps frames a second, to
+    milliseconds
+    """
+    parts = re.split(r"[:;.]", text.strip())
+    if len(parts) != 4 or not all(part.isdigit() for part in parts):
+        raise ValueError("Invalid timecode " + text)
+    hours, minutes, seconds, frames = map(int, parts)
+    if minutes >= 60 or seconds >= 60 or frames >= fps:
+        raise ValueError("Invalid timecode " + text)
+    return ((hours * 60 + minutes) * 60 + seconds) * 1000 + \
+        int(frames * 1000 / fps)
+
+
+def _timestamp(start, end, description):
+    if end and end < start:
+        raise ValueError("End time is earlier than start time")
+    # Interned as the list would, so repeated descriptions are kept once
+    # while a large file is collected
+    return Timestamp.from_milliseconds(
+        start, end, sys.intern(description) if description else None)
+
+
+def _blocks(lines):
+    """
+    Yield (first line number, lines) for each run of non-blank lines
+    """
+    block = []
+    first = 0
+    for line_number, line in enumerate(lines, 1):
+        line = line.rstrip("\r\n")
+        if line.strip():
+            if not block:
+                first = line_number
+            block.append(line)
+        elif block:
+            yield first, block
+            block = []
+    if block:
+        yield first, block
+
+
+_TAG = re.compile(r"<[^>]*>|\{\\[^}]*\}")
+
+
+def _parse_cues(lines, report, skipped=()):
+    for line_number, block in _blocks(lines):
+        timing = next((position for position, line in enumerate(block)
+                       if "-->" in line), None)
+        if timing is None:
+            if not block[0].startswith(skipped):
+                report(line_number, "Expecting a cue timing line")
+            continue
+        line_number += timing
+        start, _, end = block[timing].partition("-->")
+        try:
+            # WebVTT cue settings may follow the end time
+            end = end.split()[0] if end.strip() else ""
+            description = " ".join(_TAG.sub("", line).strip()
+                                   for line in block[timing + 1:])
+            yield _timestamp(parse_time(start), parse_time(end),
+                             description)
+        except ValueError as err:
+            report(line_number, str(err))
+
+
+@importer("srt", ".srt")
+def parse_srt(lines, report, **options):
+    return _parse_cues(lines, report)
+
+
+@importer("vtt", ".vtt")
+def parse_vtt(lines, report, **options):
+    return _parse_cues(lines, report,
+                       ("WEBVTT", "NOTE", "STYLE", "REGION"))
+
+
+_CUE_INDEX = re.compile(r"INDEX\s+01\s+(\d+):(\d\d):(\d\d)\s*$")
+
+
+@importer("cue", ".cue")
+def parse_cue(lines, report, **options):
+    """
+    A timestamp per track, from its INDEX 01 to the next track's (the last
+    one is left open), described by its title
+    """
+    previous = None
+    title = None
+    performer = None
+    in_track = False
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        command = line.split(None, 1)[0].upper() if line else ""
+        if command == "TRACK":
+            in_track = True
+            title = performer = None
+        elif command in ("TITLE", "PERFORMER") and in_track:
+            value = line.split(None, 1)[1].strip().strip('"') \
+                if " " in line else ""
+            if command == "TITLE":
+                title = value
+            else:
+                performer = value
+        elif command == "INDEX" and in_track:
+            if not line.split()[1:2] == ["01"]:
+                continue
+            found = _CUE_INDEX.match(line.upper())
+            if found is None:
+                report(line_number, "Invalid INDEX line")
+                continue
+            minutes, seconds, frames = map(int, found.groups())
+            start = (minutes * 60 + seconds) * 1000 + frames * 1000 // 75
+            if previous is not None:
+                try:
+                    yield _timestamp(previous[0], start, previous[1])
+                except ValueError as err:
+                    report(previous[2], str(err))
+            description = " - ".join(part for part in (performer, title)
+                                     if part)
+            previous = (start, description, line_number)
+    if previous is not None:
+        yield _timestamp(previous[0], 0, previous[1])
+
+
+_EDL_EVENT = re.compile(
+    r"^(\d+)\s+(\S+)\s+(\S+)\s+(\S+)(?:\s+\d+)?"
+    r"\s+(\S+)\s+(\S+)\s+(\S+)\s+(\S+)\s*$"
+)
+_EDL_COMMENT = re.compile(r"^\*\s*(?:FROM CLIP NAME|COMMENT|LOC)\s*:\s*(.*)$",
+                          re.IGNORECASE)
+
+
+@importer("edl", ".edl")
+def parse_edl(lines, report, fps=25, **options):
+    """
+    A timestamp per event of a CMX 3600 list, over its source in and out
+    points, described by its clip name or comment (or else its reel)
+    """
+    pending = None
+
+    def finish(event):
+        start, end, description, line_number = event
+        try:
+            return _timestamp(start, end, description)
+        except ValueError as err:
+            report(line_number, str(err))
+
+    for line_number, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line or line.upper().startswith(("TITLE:", "FCM:")):
+            continue
+        comment = _EDL_COMMENT.match(line)
+        if comment is not None:
+            if pending is not None and comment.group(1).strip():
+                # The first name or comment of an event describes it
+                if not pending[4]:
+                    pending[2] = comment.group(1).strip()
+                    pending[4] = True
+            continue
+        if line.startswith("*") or line.upper().startswith(("M2", "SPLIT")):
+            continue
+        event = _EDL_EVENT.match(line)
+        if event is None:
+            report(line_number, "Invalid event line")
+            continue
+        try:
+            start = parse_timecode(event.group(5), fps)
+            end = parse_timecode(event.group(6), fps)
+        except ValueError as err:
+            report(line_number, str(err))
+            continue
+        if pending is not None:
+            timestamp = finish(pending[:4])
+            if timestamp is not None:
+                yield timestamp
+        pending = [start, end, event.group(2), line_number, False]
+    if pending is not None:
+        timestamp = finish(pending[:4])
+        if timestamp is not None:
+            yield timestamp
+
+
+_CSV_COLUMNS = {
+    "start": ("start", "start_time", "start time", "begin", "in"),
+    "end": ("end", "end_time", "end time", "stop", "out"),
+    "description": ("description", "text", "title", "name", "label",
+                    "comment"),
+}
+
+
+@importer("csv", ".csv")
+def parse_csv(lines, report, **options):
+    """
+    Rows of start, end and description. Times are [[H:]M:]S[.mmm], so plain
+    seconds work too. A header row naming the columns is optional.
+    """
+    reader = csv.reader(lines)
+    columns = {"start": 0, "end": 1, "description": 2}
+    first = True
+    while True:
+        try:
+            row = next(reader)
+        except StopIteration:
+            break
+        except csv.Error as err:
+            # e.g. a field over the size limit; the reader carries on with
+            # the next line
+            report(reader.line_num, str(err))
+            continue
+        if not row or not any(cell.strip() for cell in row):
+            continue
+        if first:
+            first = False
+            names = [cell.strip().lower() for cell in row]
+            header = dict((column, names.index(name))
+                          for column, aliases in _CSV_COLUMNS.items()
+                          for name in aliases if name in names)
+            if "start" in header:
+                columns = header
+                continue
+        try:
+            start = parse_time(row[columns["start"]])
+            end = parse_time(row[columns["end"]]) \
+                if "end" in columns and columns["end"] < len(row) else 0
+            description = row[columns["description"]] \
+                if "description" in columns and \
+                columns["description"] < len(row) else None
+            yield _timestamp(start, end, description)
+        except (ValueError, IndexError) as err:
+            report(reader.line_num, str(err) or "Missing start time")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from array import array
+from bisect import bisect_left, bisect_right
+
+# End of an open interval, which runs until the end of the media
+_OPEN_END = 2 ** 62
+# End of a row that is not an interval, so no position is in it
+_NO_END = -1
+
+
+def _end_of(start, end):
+    return end if end else _OPEN_END if start else _NO_END
+
+
+class IntervalIndex():
+    """
+    Answers "which rows contain T" and "which row starts next" over a
+    TimestampList, whose rows are sorted by start time. Rows starting
+    after T are cut off with a bisection; among the rest, those ending no
+    earlier than T are found through a tree of the largest end under each
+    node (a segment tree over the rows), which only descends into subtrees
+    holding a match. A query takes logarithmic time per row found, however
+    long the intervals are. An end of 0 means the interval is open (runs
+    until the end of the media); a row with nothing marked is no interval.
+
+    The tree is built on the first query after rows were inserted, removed
+    or reordered, and updated in place when the times of a row change.
+    """
+    def __init__(self, timestamp_list):
+        self.list = timestamp_list
+        # levels[0] holds the end of each row, levels[i + 1] the larger of
+        # each pair in levels[i]; None until needed
+        self.levels = None
+
+    def invalidate(self):
+        """
+        Called once rows were inserted, removed or reordered
+        """
+        self.levels = None
+
+    def update(self, row):
+        """
+        Called once the times of row changed in place
+        """
+        if self.levels is None:
+            return
+        node = row
+        value = _end_of(self.list.start_times[row], self.list.end_times[row])
+        for level in self.levels:
+            level[node] = value
+            sibling = node ^ 1
+            if sibling < len(level):
+                value = max(value, level[sibling])
+            node //= 2
+
+    def _build(self):
+        level = array("q", map(_end_of, self.list.start_times,
+                               self.list.end_times))
+        levels = [level]
+        while len(level) > 1:
+            if len(level) % 2:
+                level = level + array("q", [_NO_END])
+            level = array("q", map(max, level[::2], level[1::2]))
+            levels.append(level)
+        self.levels = levels
+
+    def containing(self, position):
+        """
+        Rows whose interval contains position, latest start first
+        """
+        hi = bisect_right(self.list.start_times, position)
+        if not hi:
+            return []
+        if self.levels is None:
+            self._build()
+        levels = self.levels
+        rows = []
+        # Left child pushed first, so rows come out from the last one
+        pending = [(len(levels) - 1, 0)]
+        while pending:
+            depth, node = pending.pop()
+            if node << depth >= hi or levels[depth][node] < position:
+                continue
+            if not depth:
+                rows.append(node)
+                continue
+            child = node * 2
+            pending.append((depth - 1, child))
+            if child + 1 < len(levels[depth - 1]):
+                pending.append((depth - 1, child + 1))
+        return rows
+
+    def next_after(self, position):
+        """
+        First row starting strictly after position, or -1
+        """
+        row = bisect_right(self.list.start_times, position)
+        return row if row < len(self.list) else -1
+
+    def previous_before(self, position):
+        """
+        Last row starting strictly before position, or -1. Rows with nothing
+        marked are not intervals and are skipped.
+        """
+        starts = self.list.start_times
+        ends = self.list.end_times
+        row = bisect_left(starts, position) - 1
+        while row >= 0 and not starts[row] and not ends[row]:
+            row -= 1
+        return row
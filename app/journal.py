@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import hashlib
+import json
+import os
+import threading
+
+
+def write_atomically(filename, content):
+    """
+    Write content to filename through a temporary file and a rename, so a
+    crash halfway through never leaves a truncated file behind
+    """
+    tmp_filename = filename + ".tmp"
+    mode = "wb" if isinstance(content, bytes) else "w"
+    with open(tmp_filename, mode) as tmp_file:
+        tmp_file.write(content)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(tmp_filename, filename)
+
+
+class TimestampJournal():
+    """
+    Append-only log of the edits made to a timestamp file since it was last
+    written out in full. Each line is a compact JSON record; the first line is
+    a header holding the digest of the content the records apply to, so a
+    journal that outlived its base file (e.g. a crash right after compaction)
+    is recognised and ignored instead of being replayed twice.
+    """
+    SUFFIX = ".journal"
+    COMPACTING_SUFFIX = ".compacting"
+    COMPACT_THRESHOLD = 1000
+
+    def __init__(self, timestamp_filename):
+        self.filename = timestamp_filename + self.SUFFIX
+        self.compacting_filename = self.filename + self.COMPACTING_SUFFIX
+        self.records = 0
+        self._file = None
+        # rotate() runs on the saver's worker thread while edits keep being
+        # appended on the GUI thread
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def digest(content):
+        if not isinstance(content, bytes):
+            content = content.encode("utf-8")
+        return hashlib.sha1(content).hexdigest()
+
+    @staticmethod
+    def _dumps(record):
+        return json.dumps(record, separators=(",", ":"))
+
+    def exists(self):
+        return os.path.isfile(self.filename) or \
+            os.path.isfile(self.compacting_filename)
+
+    def replay(self, timestamp_list, content, serialize):
+        """
+        Apply the journaled edits to timestamp_list, which was just loaded
+        from content; serialize() gives the list's current content in the
+        same format. The segment handed to an unfinished background
+        compaction is replayed first, then the live journal; each only if it
+        was started from the content the list holds at that point.
+        :return: True if any record was applied
+        """
+        applied = False
+        base_digest = self.digest(content)
+        for filename in (self.compacting_filename, self.filename):
+            if self._replay_file(filename, timestamp_list, base_digest):
+                applied = True
+                base_digest = self.digest(serialize())
+        return applied
+
+    def _replay_file(self, filename, timestamp_list, base_digest):
+        if not os.path.isfile(filename):
+            return False
+        applied = False
+        with open(filename, "r") as journal_file:
+            try:
+                header = json.loads(journal_file.readline())
+            except ValueError:
+                return False
+            if header.get("base") != base_digest:
+                return False
+            for line in journal_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Torn write at the tail of the log, nothing after it
+                    # can be trusted
+                    break
+                timestamp_list.apply_record(record)
+                applied = True
+        return applied
+
+    def start(self, base_digest):
+        """
+        Truncate the journal and start logging edits on top of the content
+        with the given digest
+        """
+        self.close()
+        self._file = open(self.filename, "w")
+        self._file.write(self._dumps({"base": base_digest}))
+        self._file.write("\n")
+        self._file.flush()
+        self.records = 0
+
+    def rotate(self, base_content, records):
+        """
+        Hand the current journal over to a compaction that is about to write
+        base_content, and start a fresh journal on top of it. If an earlier
+        compaction never finished, its segment is extended instead so the
+        records still chain from the file on disk. base_content may hold
+        only the first records of the journal, the rest being edits made
+        while it was serialized; those move on to the fresh journal.
+        """
+        with self._lock:
+            self.close()
+            later = []
+            if os.path.isfile(self.filename):
+                with open(self.filename, "r") as journal_file:
+                    journal_file.readline()
+                    later = journal_file.readlines()[records:]
+                if os.path.isfile(self.compacting_filename):
+                    with open(self.filename, "r") as journal_file, \
+                            open(self.compacting_filename, "a") \
+                            as compacting_file:
+                        journal_file.readline()
+                        for line in journal_file:
+                            compacting_file.write(line)
+                    os.remove(self.filename)
+                else:
+                    os.replace(self.filename, self.compacting_filename)
+            self.start(self.digest(base_content))
+            if later:
+                self._file.writelines(later)
+                self._file.flush()
+                self.records = len(later)
+                # Only cut from the segment once the fresh journal has them
+                with open(self.compacting_filename, "r") as compacting_file:
+                    kept = compacting_file.readlines()[:-len(later)]
+                write_atomically(self.compacting_filename, "".join(kept))
+
+    def drop_compacting(self):
+        """
+        Called once the compaction started by rotate() has been written
+        """
+        if os.path.isfile(self.compacting_filename):
+            os.remove(self.compacting_filename)
+
+    def append(self, record):
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(self._dumps(record))
+            self._file.write("\n")
+            self._file.flush()
+            self.records += 1
+
+    def needs_compaction(self):
+        return self.records >= self.COMPACT_THRESHOLD
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def discard(self):
+        self.close()
+        self.drop_compacting()
+        if os.path.isfile(self.filename):
+            os.remove(self.filename)
@@ -0,0 +1,543 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Keyframe index of a video, read from the container's own metadata: the
+sync sample table of an MP4's video track, the cues of a Matroska or WebM
+file. A seek lands on the keyframe before its target and decodes forward
+from there, so the distance to that keyframe is what a seek costs.
+
+The index is cached next to the timestamp file, keyed by the size and
+mtime of the video. Layout of the cache, all integers little-endian:
+
+    header   magic "TMSK", version (uint16), padding, video size (int64),
+             video mtime in nanoseconds (int64), count (uint64)
+    times    count x int64 keyframe times in milliseconds
+"""
+from array import array
+from bisect import bisect_right
+import os
+import struct
+import sys
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+from app.journal import write_atomically
+
+CACHE_EXTENSION = ".keyframes"
+CACHE_MAGIC = b"TMSK"
+CACHE_VERSION = 1
+CACHE_HEADER = struct.Struct("<4sHxxqqQ")
+
+_BOX = struct.Struct(">I4s")
+_UINT32 = struct.Struct(">I")
+_UINT64 = struct.Struct(">Q")
+
+# Matroska element IDs, marker bits included
+_EBML = 0x1A45DFA3
+_SEGMENT = 0x18538067
+_SEEK_HEAD = 0x114D9B74
+_SEEK = 0x4DBB
+_SEEK_ID = 0x53AB
+_SEEK_POSITION = 0x53AC
+_INFO = 0x1549A966
+_TIMESTAMP_SCALE = 0x2AD7B1
+_TRACKS = 0x1654AE6B
+_TRACK_ENTRY = 0xAE
+_TRACK_NUMBER = 0xD7
+_TRACK_TYPE = 0x83
+_TRACK_TYPE_VIDEO = 1
+_CLUSTER = 0x1F43B675
+_CUES = 0x1C53BB6B
+_CUE_POINT = 0xBB
+_CUE_TIME = 0xB3
+_CUE_TRACK_POSITIONS = 0xB7
+_CUE_TRACK = 0xF7
+
+
+class KeyframeIndex():
+    """
+    Keyframe times of a video, in milliseconds, in order
+    """
+    def __init__(self, times):
+        self.times = times
+
+    def __len__(self):
+        return len(self.times)
+
+    def previous(self, time):
+        """
+        The keyframe a seek to time decodes from
+        """
+        row = bisect_right(self.times, time) - 1
+        return self.times[row] if row >= 0 else 0
+
+    def nearest(self, time):
+        row = bisect_right(self.times, time)
+        candidates = self.times[max(0, row - 1):row + 1]
+        return min(candidates, key=lambda keyframe: abs(keyframe - time)) \
+            if candidates else time
+
+    def seek_cost(self, time):
+        """
+        How much of the video, in milliseconds, a seek to time decodes
+        before it shows anything
+        """
+        return time - self.previous(time)
+
+
+def keyframe_times(filename):
+    """
+    Read the keyframe times of a video from its container
+    :return: array('q') of the times in milliseconds, in order
+    :raise ValueError: If the container is not MP4 or Matroska, or broken
+    """
+    with open(filename, "rb") as input_file:
+        magic = input_file.read(8)
+        input_file.seek(0)
+        try:
+            if magic[:4] == _EBML.to_bytes(4, "big"):
+                times = _matroska_keyframes(input_file)
+            elif magic[4:8] in (b"ftyp", b"moov", b"mdat", b"free",
+                                b"wide"):
+                times = _mp4_keyframes(input_file)
+            else:
+                raise ValueError("Not an MP4, Matroska or WebM file")
+        except (struct.error, IndexError) as err:
+            # A truncated or corrupt box or element ran past its data
+            raise ValueError("Broken container: " + str(err))
+    return array("q", sorted(times))
+
+
+def cache_filename(video_filename, timestamp_filename=None):
+    """
+    Where the keyframe index of a video is cached: next to the timestamp
+    file, or next to the video without one
+    """
+    directory = os.path.dirname(timestamp_filename or video_filename)
+    return os.path.join(directory,
+                        os.path.basename(video_filename) + CACHE_EXTENSION)
+
+
+def index_video(video_filename, cache_file=None):
+    """
+    The keyframe index of a video, from the cache if it is still current,
+    otherwise read from the video and cached
+    :raise ValueError: If the video's container cannot be read
+    """
+    stat = os.stat(video_filename)
+    if cache_file is not None:
+        times = _read_cache(cache_file, stat)
+        if times is not None:
+            return KeyframeIndex(times)
+    times = keyframe_times(video_filename)
+    if cache_file is not None:
+        try:
+            _write_cache(cache_file, stat, times)
+        except OSError:
+            # The index is still good without its cache
+            pass
+    return KeyframeIndex(times)
+
+
+def _read_cache(cache_file, stat):
+    try:
+        with open(cache_file, "rb") as input_file:
+            header = input_file.read(CACHE_HEADER.size)
+            if len(header) < CACHE_HEADER.size:
+                return None
+            magic, version, size, mtime, count = CACHE_HEADER.unpack(header)
+            if magic != CACHE_MAGIC or version != CACHE_VERSION or \
+               size != stat.st_size or mtime != stat.st_mtime_ns:
+                return None
+            times = array("q")
+            times.fromfile(input_file, count)
+    except (OSError, EOFError):
+        return None
+    if sys.byteorder == "big":
+        times.byteswap()
+    return times
+
+
+def _write_cache(cache_file, stat, times):
+    column = array("q", times)
+    if sys.byteorder == "big":
+        column.byteswap()
+    write_atomically(cache_file, CACHE_HEADER.pack(
+        CACHE_MAGIC, CACHE_VERSION, stat.st_size, stat.st_mtime_ns,
+        len(times)) + column.tobytes())
+
+
+def _mp4_boxes(data, start, end):
+    """
+    Yield (type, payload start, payload end) of the boxes in data[start:end]
+    """
+    while start + _BOX.size <= end:
+        size, kind = _BOX.unpack_from(data, start)
+        header = _BOX.size
+        if size == 1:
+            size, = _UINT64.unpack_from(data, start + header)
+            header += _UINT64.size
+        elif size == 0:
+            size = end - start
+        if size < header or start + size > end:
+            raise ValueError("Broken MP4 box " + repr(kind))
+        yield kind, start + header, start + size
+        start += size
+
+
+def _mp4_box(data, start, end, *path):
+    """
+    (payload start, payload end) of the first box down path, or None
+    """
+    for kind in path:
+        for child, child_start, child_end in _mp4_boxes(data, start, end):
+            if child == kind:
+                start, end = child_start, child_end
+                break
+        else:
+            return None
+    return start, end
+
+
+def _mp4_moov(input_file):
+    """
+    The movie box, wherever it is in the file; the media data before it is
+    skipped over, not read
+    """
+    file_size = os.fstat(input_file.fileno()).st_size
+    offset = 0
+    while offset + _BOX.size <= file_size:
+        input_file.seek(offset)
+        header = input_file.read(_BOX.size + _UINT64.size)
+        size, kind = _BOX.unpack_from(header)
+        header_size = _BOX.size
+        if size == 1:
+            size, = _UINT64.unpack_from(header, _BOX.size)
+            header_size += _UINT64.size
+        elif size == 0:
+            size = file_size - offset
+        if size < header_size:
+            raise ValueError("Broken MP4 box " + repr(kind))
+        if kind == b"moov":
+            input_file.seek(offset + header_size)
+            return input_file.read(size - header_size)
+        offset += size
+    raise ValueError("MP4 file has no movie box")
+
+
+def _mp4_table(data, box, entry):
+    """
+    The entries of a full box holding a counted table
+    """
+    if box is None:
+        return None
+    start, end = box
+    count, = _UINT32.unpack_from(data, start + 4)
+    entry = struct.Struct(">" + entry)
+    if start + 8 + count * entry.size > end:
+        raise ValueError("Broken MP4 sample table")
+    return [entry.unpack_from(data, start + 8 + i * entry.size)
+            for i in range(count)]
+
+
+def _mp4_keyframes(input_file):
+    moov = _mp4_moov(input_file)
+    for kind, start, end in _mp4_boxes(moov, 0, len(moov)):
+        if kind != b"trak":
+            continue
+        handler = _mp4_box(moov, start, end, b"mdia", b"hdlr")
+        if handler is None or moov[handler[0] + 8:handler[0] + 12] != b"vide":
+            continue
+        header = _mp4_box(moov, start, end, b"mdia", b"mdhd")
+        if header is None:
+            raise ValueError("MP4 video track has no media header")
+        # The time scale follows the creation and modification times, 64
+        # bits each in version 1
+        version = moov[header[0]]
+        timescale, = _UINT32.unpack_from(
+            moov, header[0] + (20 if version == 1 else 12))
+        if not timescale:
+            raise ValueError("MP4 video track has no time scale")
+        table = _mp4_box(moov, start, end, b"mdia", b"minf", b"stbl")
+        if table is None:
+            raise ValueError("MP4 video track has no sample table")
+        return _mp4_track_keyframes(moov, start, end, table, timescale)
+    raise ValueError("MP4 file has no video track")
+
+
+def _mp4_track_keyframes(moov, start, end, table, timescale):
+    durations = _mp4_table(moov, _mp4_box(moov, table[0], table[1], b"stts"),
+                           "II") or []
+    sync = _mp4_table(moov, _mp4_box(moov, table[0], table[1], b"stss"), "I")
+    offsets = _mp4_box(moov, table[0], table[1], b"ctts")
+    if offsets is not None:
+        # Version 1 offsets are signed
+        offsets = _mp4_table(moov, offsets,
+                             "Ii" if moov[offsets[0]] == 1 else "II")
+    # Without a sync sample table, every sample is a keyframe
+    samples = [number for number, in sync] if sync is not None else \
+        range(1, sum(count for count, _ in durations) + 1)
+    decode_times = _mp4_sample_values(durations, samples, True)
+    composition_offsets = _mp4_sample_values(offsets, samples, False) \
+        if offsets is not None else [0] * len(decode_times)
+    shift = _mp4_edit_shift(moov, start, end)
+    return [(decode_time + offset - shift) * 1000 // timescale
+            for decode_time, offset in zip(decode_times,
+                                           composition_offsets)]
+
+
+def _mp4_sample_values(runs, samples, accumulate):
+    """
+    The value of each of samples (numbers from 1, in order) in a table of
+    (count, value) runs: the value itself, or the sum of the values before
+    the sample for a table of durations
+    """
+    values = []
+    samples = iter(samples)
+    sample = next(samples, None)
+    first = 1
+    total = 0
+    for count, value in runs:
+        while sample is not None and sample < first + count:
+            values.append(total + (sample - first) * value if accumulate
+                          else value)
+            sample = next(samples, None)
+        first += count
+        total += count * value
+    return values
+
+
+def _mp4_edit_shift(moov, start, end):
+    """
+    Where the presentation starts in the media, from the first edit that
+    is not an empty one
+    """
+    edits = _mp4_box(moov, start, end, b"edts", b"elst")
+    if edits is None:
+        return 0
+    entries = _mp4_table(moov, edits,
+                         "Qq" if moov[edits[0]] == 1 else "Ii")
+    for _, media_time in entries:
+        if media_time != -1:
+            return media_time
+    return 0
+
+
+def _ebml_id(data, position):
+    """
+    (element ID, length) of the ID at position; IDs keep their marker bits
+    """
+    first = data[position]
+    length = 9 - first.bit_length()
+    if not first or length > 4:
+        raise ValueError("Broken Matroska element ID")
+    return int.from_bytes(data[position:position + length], "big"), length
+
+
+def _ebml_size(data, position):
+    """
+    (element size, length) of the size at position; the size is None if
+    it is unknown
+    """
+    first = data[position]
+    length = 9 - first.bit_length()
+    if not first:
+        raise ValueError("Broken Matroska element size")
+    size = int.from_bytes(data[position:position + length], "big") & \
+        ((1 << (7 * length)) - 1)
+    return (None if size == (1 << (7 * length)) - 1 else size), length
+
+
+def _ebml_header(data, position):
+    """
+    (element ID, data start, size) of the element at position in data
+    """
+    element_id, id_length = _ebml_id(data, position)
+    size, size_length = _ebml_size(data, position + id_length)
+    return element_id, position + id_length + size_length, size
+
+
+def _ebml_children(data, start, end):
+    """
+    Yield (element ID, data start, data end) of the elements in
+    data[start:end]
+    """
+    while start < end:
+        element_id, data_start, size = _ebml_header(data, start)
+        data_end = end if size is None else data_start + size
+        if data_end > end:
+            raise ValueError("Broken Matroska element")
+        yield element_id, data_start, data_end
+        start = data_end
+
+
+def _ebml_uint(data, start, end):
+    return int.from_bytes(data[start:end], "big")
+
+
+def _matroska_element(input_file, position):
+    """
+    (element ID, data start, size) of the element at position in the file
+    """
+    input_file.seek(position)
+    header = input_file.read(12)
+    if len(header) < 2:
+        raise EOFError
+    try:
+        element_id, data_start, size = _ebml_header(header, 0)
+    except IndexError:
+        raise EOFError
+    return element_id, position + data_start, size
+
+
+def _matroska_keyframes(input_file):
+    file_size = os.fstat(input_file.fileno()).st_size
+    try:
+        _, data_start, size = _matroska_element(input_file, 0)
+        element_id, segment_start, segment_size = _matroska_element(
+            input_file, data_start + size)
+    except EOFError:
+        raise ValueError("Truncated Matroska file")
+    if element_id != _SEGMENT:
+        raise ValueError("Matroska file has no segment")
+    segment_end = file_size if segment_size is None else \
+        min(file_size, segment_start + segment_size)
+    # Top level elements found so far, by ID: (data start, size)
+    found = {}
+    seek_positions = {}
+    position = segment_start
+    while position < segment_end and _CUES not in found:
+        try:
+            element_id, data_start, size = _matroska_element(input_file,
+                                                             position)
+        except EOFError:
+            break
+        if element_id == _CLUSTER:
+            if _CUES in seek_positions or size is None:
+                # Cues, if any, are where the seek head says; clusters
+                # are not read through to find them
+                break
+        elif element_id in (_SEEK_HEAD, _INFO, _TRACKS, _CUES):
+            found[element_id] = _read_element(input_file, data_start, size,
+                                              segment_end)
+            if element_id == _SEEK_HEAD:
+                seek_positions.update(_matroska_seek_head(
+                    found[element_id]))
+        if size is None:
+            break
+        position = data_start + size
+    for element_id in (_INFO, _TRACKS, _CUES):
+        if element_id not in found and element_id in seek_positions:
+            try:
+                found_id, data_start, size = _matroska_element(
+                    input_file, segment_start + seek_positions[element_id])
+            except EOFError:
+                continue
+            if found_id == element_id:
+                found[element_id] = _read_element(input_file, data_start,
+                                                  size, segment_end)
+    if _CUES not in found:
+        raise ValueError("Matroska file has no cues")
+    timestamp_scale = 1000000
+    info = found.get(_INFO)
+    if info is not None:
+        for element_id, start, end in _ebml_children(info, 0, len(info)):
+            if element_id == _TIMESTAMP_SCALE:
+                timestamp_scale = _ebml_uint(info, start, end)
+    video_track = _matroska_video_track(found.get(_TRACKS))
+    cues = found[_CUES]
+    times = []
+    for element_id, start, end in _ebml_children(cues, 0, len(cues)):
+        if element_id != _CUE_POINT:
+            continue
+        cue_time = None
+        tracks = []
+        for child_id, child_start, child_end in _ebml_children(cues, start,
+                                                                end):
+            if child_id == _CUE_TIME:
+                cue_time = _ebml_uint(cues, child_start, child_end)
+            elif child_id == _CUE_TRACK_POSITIONS:
+                tracks.extend(
+                    _ebml_uint(cues, track_start, track_end)
+                    for track_id, track_start, track_end in _ebml_children(
+                        cues, child_start, child_end)
+                    if track_id == _CUE_TRACK)
+        if cue_time is not None and \
+           (video_track is None or video_track in tracks):
+            times.append(cue_time * timestamp_scale // 1000000)
+    return times
+
+
+def _read_element(input_file, data_start, size, segment_end):
+    input_file.seek(data_start)
+    return input_file.read((segment_end if size is None
+                            else data_start + size) - data_start)
+
+
+def _matroska_seek_head(seek_head):
+    """
+    Positions of the top level elements the seek head points to, by ID,
+    relative to the start of the segment's data
+    """
+    positions = {}
+    for element_id, start, end in _ebml_children(seek_head, 0,
+                                                 len(seek_head)):
+        if element_id != _SEEK:
+            continue
+        seek_id = position = None
+        for child_id, child_start, child_end in _ebml_children(
+                seek_head, start, end):
+            if child_id == _SEEK_ID:
+                seek_id = _ebml_uint(seek_head, child_start, child_end)
+            elif child_id == _SEEK_POSITION:
+                position = _ebml_uint(seek_head, child_start, child_end)
+        if seek_id is not None and position is not None:
+            positions.setdefault(seek_id, position)
+    return positions
+
+
+def _matroska_video_track(tracks):
+    """
+    Number of the first video track, None if it is not known
+    """
+    if tracks is None:
+        return None
+    for element_id, start, end in _ebml_children(tracks, 0, len(tracks)):
+        if element_id != _TRACK_ENTRY:
+            continue
+        number = track_type = None
+        for child_id, child_start, child_end in _ebml_children(tracks, start,
+                                                                end):
+            if child_id == _TRACK_NUMBER:
+                number = _ebml_uint(tracks, child_start, child_end)
+            elif child_id == _TRACK_TYPE:
+                track_type = _ebml_uint(tracks, child_start, child_end)
+        if track_type == _TRACK_TYPE_VIDEO:
+            return number
+    return None
+
+
+class KeyframeIndexer(QObject):
+    """
+    Runs index_video() on a worker thread. A video indexed while another is
+    still being indexed gets a thread of its own; the results carry the
+    video's file name to tell them apart.
+    """
+    indexed = pyqtSignal(str, object)
+    indexFailed = pyqtSignal(str, str)
+
+    def start(self, video_filename, cache_file=None):
+        worker = threading.Thread(target=self._index,
+                                  args=(video_filename, cache_file))
+        worker.daemon = True
+        worker.start()
+
+    def _index(self, video_filename, cache_file):
+        try:
+            index = index_video(video_filename, cache_file)
+        except (OSError, ValueError) as err:
+            self.indexFailed.emit(video_filename, str(err))
+            return
+        self.indexed.emit(video_filename, index)
@@ -0,0 +1,332 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+import os
+import sqlite3
+import threading
+
+from PyQt5.QtCore import QObject, pyqtSignal
+
+TIMESTAMP_EXTENSION = ".tmsp"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roots (
+    path TEXT PRIMARY KEY,
+    recursive INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    stem TEXT NOT NULL,
+    extension TEXT NOT NULL,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS files_directory_stem ON files (directory, stem);
+CREATE INDEX IF NOT EXISTS files_extension ON files (extension);
+CREATE TABLE IF NOT EXISTS media (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    duration INTEGER NOT NULL,
+    tracks TEXT NOT NULL
+);
+"""
+
+
+def default_filename():
+    """
+    Where the library index lives unless told otherwise
+    """
+    directory = os.path.join(os.path.expanduser("~"), ".looper")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, "library.db")
+
+
+class MediaLibrary():
+    """
+    Persistent index of the files under some root directories, so the video
+    that goes with a timestamp file (the other file of the same name in the
+    same directory) is found with an index lookup instead of listing the
+    directory. Files are keyed by path and carry their mtime and size.
+    scan() brings the index up to date; a directory whose mtime has not
+    changed since the last scan is not listed again. What parsing a video
+    found out about it is kept too, so it is not parsed again until it
+    changes.
+    """
+    def __init__(self, filename):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+
+    def add_root(self, path, recursive=False):
+        """
+        Index path from now on. A root that is already recursive stays so.
+        """
+        path = os.path.abspath(path)
+        self.connection.execute(
+            "INSERT OR IGNORE INTO roots (path, recursive) VALUES (?, ?)",
+            (path, int(recursive))
+        )
+        if recursive:
+            self.connection.execute(
+                "UPDATE roots SET recursive = 1 WHERE path = ?", (path,))
+
+    def covers(self, directory):
+        """
+        Whether directory is a root, or below a recursive one
+        """
+        directory = os.path.abspath(directory)
+        return any(path == directory or recursive and
+                   directory.startswith(path.rstrip(os.sep) + os.sep)
+                   for path, recursive in self.roots())
+
+    def remove_root(self, path):
+        self.connection.execute("DELETE FROM roots WHERE path = ?",
+                                (os.path.abspath(path),))
+
+    def roots(self):
+        """
+        :return: List of (path, recursive)
+        """
+        return [(path, bool(recursive)) for path, recursive in
+                self.connection.execute(
+                    "SELECT path, recursive FROM roots ORDER BY path")]
+
+    def video_for(self, timestamp_filename):
+        """
+        The video next to timestamp_filename, looked up in the index only;
+        None if the directory was not indexed or has no such file
+        """
+        timestamp_filename = os.path.abspath(timestamp_filename)
+        directory, basename = os.path.split(timestamp_filename)
+        found = self.connection.execute(
+            "SELECT path FROM files WHERE directory = ? AND stem = ? AND "
+            "path != ? ORDER BY path LIMIT 1",
+            (directory, os.path.splitext(basename)[0], timestamp_filename)
+        ).fetchone()
+        return found[0] if found else None
+
+    def media_info(self, path):
+        """
+        What parsing the video at path found, if it has not changed since
+        :return: (duration in milliseconds, list of track dicts), or None
+        """
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        found = self.connection.execute(
+            "SELECT duration, tracks FROM media "
+            "WHERE path = ? AND mtime = ? AND size = ?",
+            (path, stat.st_mtime_ns, stat.st_size)).fetchone()
+        return (found[0], json.loads(found[1])) if found else None
+
+    def store_media_info(self, path, duration, tracks):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO media (path, mtime, size, duration, "
+            "tracks) VALUES (?, ?, ?, ?, ?)",
+            (path, stat.st_mtime_ns, stat.st_size, duration,
+             json.dumps(tracks)))
+
+    def annotated_videos(self):
+        """
+        Every timestamp file in the index that has a video next to it
+        :return: List of (timestamp file, video)
+        """
+        return self.connection.execute(
+            "SELECT timestamps.path, MIN(videos.path) "
+            "FROM files AS timestamps JOIN files AS videos "
+            "ON videos.directory = timestamps.directory AND "
+            "videos.stem = timestamps.stem AND "
+            "videos.path != timestamps.path "
+            "WHERE timestamps.extension = ? "
+            "GROUP BY timestamps.path ORDER BY timestamps.path",
+            (TIMESTAMP_EXTENSION,)
+        ).fetchall()
+
+    def scan(self, roots=None):
+        """
+        Bring the index up to date with the disk
+        :param roots: List of (path, recursive); defaults to all roots
+        :return: The number of files added, changed or removed
+        """
+        changed = 0
+        for root, recursive in roots if roots is not None else self.roots():
+            pending = [root]
+            while pending:
+                directory = pending.pop()
+                changed += self._scan_directory(directory)
+                if recursive:
+                    pending.extend(path for path, in self.connection.execute(
+                        "SELECT path FROM directories WHERE parent = ?",
+                        (directory,)))
+        return changed
+
+    def scan_directory(self, directory):
+        """
+        Index a single directory, without its subdirectories. Only a stat
+        of the directory is needed if it did not change since it was
+        indexed; the files themselves are not looked at again.
+        """
+        return self._scan_directory(os.path.abspath(directory), False)
+
+    def _scan_directory(self, directory, restat=True):
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            return self._forget_directory(directory)
+        stored = self.connection.execute(
+            "SELECT mtime FROM directories WHERE path = ?", (directory,)
+        ).fetchone()
+        if stored is not None and stored[0] == mtime:
+            # No file was added, removed or renamed; only the stats of
+            # existing files may have changed
+            return self._restat(directory) if restat else 0
+        known = dict(
+            (path, (file_mtime, size)) for path, file_mtime, size in
+            self.connection.execute(
+                "SELECT path, mtime, size FROM files WHERE directory = ?",
+                (directory,)))
+        known_directories = set(path for path, in self.connection.execute(
+            "SELECT path FROM directories WHERE parent = ?", (directory,)))
+        files = []
+        directories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir():
+                            directories.append(entry.path)
+                        elif entry.is_file():
+                            stat = entry.stat()
+                            files.append((entry.path, stat.st_mtime_ns,
+                                          stat.st_size))
+                    except OSError:
+                        continue
+        except OSError:
+            return self._forget_directory(directory)
+        changed = 0
+        self.connection.execute("BEGIN")
+        try:
+            for path, file_mtime, size in files:
+                if known.pop(path, None) != (file_mtime, size):
+                    self._store_file(directory, path, file_mtime, size)
+                    changed += 1
+            for path in known:
+                self.connection.execute("DELETE FROM files WHERE path = ?",
+                                        (path,))
+                changed += 1
+            for path in known_directories.difference(directories):
+                changed += self._forget_directory(path, commit=False)
+            for path in set(directories).difference(known_directories):
+                # Listed on their own turn of a recursive scan; -1 marks
+                # them as not listed yet
+                self.connection.execute(
+                    "INSERT OR IGNORE INTO directories (path, parent, mtime) "
+                    "VALUES (?, ?, -1)", (path, directory))
+            self.connection.execute(
+                "INSERT OR REPLACE INTO directories (path, parent, mtime) "
+                "VALUES (?, ?, ?)",
+                (directory, os.path.dirname(directory), mtime))
+            self.connection.execute("COMMIT")
+        except sqlite3.Error:
+            self.connection.execute("ROLLBACK")
+            raise
+        return changed
+
+    def _store_file(self, directory, path, mtime, size):
+        stem, extension = os.path.splitext(os.path.basename(path))
+        self.connection.execute(
+            "INSERT OR REPLACE INTO files "
+            "(path, directory, stem, extension, mtime, size) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (path, directory, stem, extension.lower(), mtime, size))
+
+    def _restat(self, directory):
+        changed = 0
+        for path, mtime, size in self.connection.execute(
+                "SELECT path, mtime, size FROM files WHERE directory = ?",
+                (directory,)).fetchall():
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if (stat.st_mtime_ns, stat.st_size) != (mtime, size):
+                self.connection.execute(
+                    "UPDATE files SET mtime = ?, size = ? WHERE path = ?",
+                    (stat.st_mtime_ns, stat.st_size, path))
+                changed += 1
+        return changed
+
+    def _forget_directory(self, directory, commit=True):
+        """
+        Drop a directory that is gone, and everything below it
+        """
+        if commit:
+            self.connection.execute("BEGIN")
+        prefix = directory.rstrip(os.sep) + os.sep
+        changed = self.connection.execute(
+            "DELETE FROM files WHERE directory = ? OR "
+            "substr(directory, 1, ?) = ?",
+            (directory, len(prefix), prefix)).rowcount
+        self.connection.execute(
+            "DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?",
+            (directory, len(prefix), prefix))
+        if commit:
+            self.connection.execute("COMMIT")
+        return changed
+
+    def close(self):
+        self.connection.close()
+
+
+class LibraryScanner(QObject):
+    """
+    Runs MediaLibrary.scan() on a worker thread, with its own connection to
+    the index
+    """
+    scanFinished = pyqtSignal(int)
+    scanFailed = pyqtSignal(str)
+
+    def __init__(self, filename, parent=None):
+        super(LibraryScanner, self).__init__(parent)
+        self.filename = filename
+        self._worker = None
+
+    def scanning(self):
+        return self._worker is not None and self._worker.is_alive()
+
+    def start(self, roots=None):
+        """
+        Scan in the background, unless a scan is already running
+        """
+        if self.scanning():
+            return
+        self._worker = threading.Thread(target=self._scan, args=(roots,))
+        self._worker.daemon = True
+        self._worker.start()
+
+    def _scan(self, roots):
+        try:
+            library = MediaLibrary(self.filename)
+            try:
+                changed = library.scan(roots)
+            finally:
+                library.close()
+        except (OSError, sqlite3.Error) as err:
+            self.scanFailed.emit(str(err))
+            return
+        self.scanFinished.emit(changed)
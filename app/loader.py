@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import json
+
+CHUNK_SIZE = 64 * 1024
+_WHITESPACE = " \t\n\r"
+
+
+def iter_json_array(input_file, digest=None, chunk_size=CHUNK_SIZE):
+    """
+    Yield the elements of the top-level JSON array in input_file one at a
+    time, reading the file a chunk at a time instead of all at once.
+    :param digest: Optional hashlib object fed with the text as it is read
+    :raise ValueError: If the content is not a JSON array
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    pos = 0
+    eof = False
+
+    def read_more():
+        chunk = input_file.read(chunk_size)
+        if digest is not None:
+            digest.update(chunk.encode("utf-8"))
+        return chunk
+
+    def next_char():
+        # Skip whitespace, refilling the buffer as needed; "" at the end
+        nonlocal buffer, pos, eof
+        while True:
+            while pos < len(buffer) and buffer[pos] in _WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos:pos + 1]
+            chunk = read_more()
+            buffer, pos, eof = chunk, 0, not chunk
+
+    if next_char() != "[":
+        raise ValueError("Expecting a JSON array")
+    pos += 1
+    if next_char() == "]":
+        pos += 1
+    else:
+        while True:
+            next_char()
+            try:
+                element, end = decoder.raw_decode(buffer, pos)
+                # A value running up to the end of the buffer may continue
+                # in the next chunk
+                complete = end < len(buffer) or eof
+            except ValueError:
+                if eof:
+                    raise
+                complete = False
+            if not complete:
+                chunk = read_more()
+                buffer, pos, eof = buffer[pos:] + chunk, 0, not chunk
+                continue
+            yield element
+            pos = end
+            separator = next_char()
+            pos += 1
+            if separator == "]":
+                break
+            if separator != ",":
+                raise ValueError("Expecting ',' or ']' in JSON array")
+    if next_char():
+        raise ValueError("Extra data after JSON array")
+    # Drain the rest of the file so the digest covers all of it
+    while not eof:
+        eof = not read_more()
@@ -0,0 +1,398 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+The loop engine, free of Qt and of VLC, so it can be driven by a fake
+player to time and tune it without a GUI.
+"""
+from collections import deque
+import time
+
+
+def _monotonic_milliseconds():
+    return time.monotonic() * 1000
+
+
+class Callbacks(list):
+    """
+    A Qt-free stand-in for a signal: calling it calls everything connected
+    to it, with the same arguments
+    """
+    def connect(self, callback):
+        self.append(callback)
+
+    def disconnect(self, callback):
+        self.remove(callback)
+
+    def __call__(self, *args):
+        for callback in list(self):
+            callback(*args)
+
+
+class LoopController():
+    """
+    Plays a range of a video over and over. It owns the player, which only
+    needs the few methods of vlc.MediaPlayer used here: play(), pause(),
+    get_time(), set_time(), set_position(), get_rate(), set_rate(),
+    get_media() and set_media().
+
+    The player reports its time only every so often, through
+    time_changed(). From the last report, the clock and the rate, the
+    controller predicts the moment the end of the range is reached and arms
+    a one-shot timer for it, less the time a seek takes to land, which it
+    learns as it goes. The timer is anything with start(milliseconds) and
+    stop() that calls boundary() when it fires; the owner creates it in its
+    own thread and calls tick() from there after each report (or every TICK
+    milliseconds), which re-arms it with the latest prediction.
+
+    Without a timer, or should the prediction miss, passing the end only
+    marks a restart as needed and the next tick() seeks, so time_changed()
+    may also be called from the player's thread, where seeking stalls VLC.
+
+    Seeking back to the start stalls the picture and the sound while the
+    decoder catches up from the keyframe before it. Given a second player
+    on the same media, the gapless mode avoids that: the standby player is
+    paused at the start of the range ahead of time and, instead of
+    seeking, the loop resumes it and pauses the other; the two then swap
+    roles. Both players also need set_pause(), audio_get_mute() and
+    audio_set_mute(), and the standby one reports its time through
+    standby_time_changed(). It only counts as ready once it reports being
+    at the start; until then, as when the loop is too short for its seek
+    to land, the loop falls back to seeking. How long each restart took,
+    seek or swap, is measured from the first report after it.
+    """
+    TICK = 100
+    # States of the standby player in gapless mode
+    IDLE = "idle"
+    PREROLLING = "prerolling"
+    CUEING = "cueing"
+    READY = "ready"
+    # Overshoots kept, for the statistics
+    HISTORY = 100
+    # How far ahead of the clock the player's reports may run, milliseconds
+    SEEK_SLACK = 5
+    # How close to the start the paused standby player must report being
+    CUE_SLACK = 20
+
+    def __init__(self, player, timer=None, clock=_monotonic_milliseconds,
+                 standby=None):
+        """
+        :param timer: One-shot timer for the predicted end of the range
+        :param clock: Returns the time in milliseconds, for the predictions
+        :param standby: Second player, for the gapless mode
+        """
+        self.player = player
+        self.standby = standby
+        self.gapless = False
+        self._standby_state = self.IDLE
+        self.timer = timer
+        self.clock = clock
+        # Length of the media in milliseconds, 0 if there is none
+        self.duration = 0
+        # Range being looped; end is -1 while not looping
+        self.start = 0
+        self.end = -1
+        self.started = False
+        self.playing = False
+        self.restart_needed = False
+        self.restarts = 0
+        # Last media time reported by the player, and the clock then
+        self._anchor = (0, clock())
+        # Set while a restart has not shown up in the reports yet: (clock
+        # when asked for, estimated overshoot then)
+        self._seek = None
+        # How long a seek takes to land, in milliseconds of wall time
+        self.seek_latency = 0.0
+        # How far past the end each pass went, in milliseconds of media
+        self.overshoots = deque(maxlen=self.HISTORY)
+        # How long each restart took to play from the start, milliseconds
+        self.gaps = deque(maxlen=self.HISTORY)
+        # Called with whether the media is playing
+        self.playing_changed = Callbacks()
+        # Called with the start of the range, each time it starts over
+        self.restarted = Callbacks()
+        # Called with the player now playing, after the players swapped
+        self.swapped = Callbacks()
+        # Called with how long a restart took, once it is known
+        self.gap_measured = Callbacks()
+
+    def players(self):
+        """
+        The players, the one playing first
+        """
+        return [player for player in (self.player, self.standby)
+                if player is not None]
+
+    def set_media(self, media, duration):
+        for player in self.players():
+            player.set_media(media)
+        self._standby_state = self.IDLE
+        self.duration = duration if media is not None else 0
+        self.restart_needed = False
+        self._seek = None
+        self._set_playing(False, started=False)
+
+    def set_range(self, start, end):
+        """
+        Loop between start and end, in milliseconds; an end of 0 means the
+        end of the media
+        :raise ValueError: If the range does not fit in the media
+        """
+        end = end if end != 0 else self.duration
+        if start > end:
+            raise ValueError("Start time cannot be later than end time")
+        if start > self.duration:
+            raise ValueError("Start time not within video duration")
+        if end > self.duration:
+            raise ValueError("End time not within video duration")
+        self.start = start
+        self.end = end
+        self._preroll()
+        self._schedule()
+
+    def clear_range(self):
+        """
+        Play on from wherever the player is, without looping
+        """
+        self.start = 0
+        self.end = -1
+        self.restart_needed = False
+        self._disarm()
+
+    def looping(self):
+        return self.end != -1
+
+    def run(self):
+        """
+        Play the range from its start
+        """
+        self.player.play()
+        self.player.set_time(self.start)
+        self._anchor = (self.start, self.clock())
+        self._seek = None
+        self._set_playing(True, started=True)
+        self._preroll()
+        self._schedule()
+
+    def set_gapless(self, gapless):
+        """
+        Turn the gapless mode on or off
+        :raise ValueError: If there is no standby player to turn it on with
+        """
+        if gapless and self.standby is None:
+            raise ValueError("Gapless looping needs a second player")
+        self.gapless = gapless
+        if gapless:
+            self._preroll()
+        elif self._standby_state != self.IDLE:
+            self.standby.stop()
+            self._standby_state = self.IDLE
+
+    def _preroll(self):
+        """
+        Get the standby player ready to play from the start of the range.
+        One that never played has to be opened first: it plays, muted,
+        until it reports in standby_time_changed(). One that is open seeks
+        while paused, and is ready once it reports the start.
+        """
+        if not (self.gapless and self.started and self.looping()):
+            return
+        if self._standby_state == self.IDLE:
+            self.standby.audio_set_mute(True)
+            self.standby.set_rate(self.player.get_rate())
+            self.standby.play()
+            self._standby_state = self.PREROLLING
+        elif self._standby_state in (self.CUEING, self.READY):
+            self.standby.set_time(self.start)
+            self._standby_state = self.CUEING
+
+    def standby_time_changed(self, media_time=None, reported_at=None):
+        """
+        Called as the standby player reports its time, like time_changed()
+        """
+        if media_time is None:
+            media_time = self.standby.get_time()
+        if self._standby_state == self.PREROLLING:
+            # It is open now; wait at the start, the seek done while paused
+            self.standby.set_pause(1)
+            self.standby.set_time(self.start)
+            self._standby_state = self.CUEING
+        elif self._standby_state == self.CUEING and \
+                abs(media_time - self.start) <= self.CUE_SLACK:
+            self._standby_state = self.READY
+
+    def play_pause(self):
+        if not self.started:
+            self.run()
+        elif self.playing:
+            self.player.pause()
+            # The player's own time may be from before its last seek
+            self._anchor = (self.position(), self.clock())
+            self._set_playing(False)
+            self._disarm()
+        else:
+            self.player.play()
+            self._anchor = (self._anchor[0], self.clock())
+            self._set_playing(True)
+            self._schedule()
+
+    def _set_playing(self, playing, started=None):
+        if started is not None:
+            self.started = started
+        if playing != self.playing:
+            self.playing = playing
+            self.playing_changed(playing)
+
+    def seek(self, fraction):
+        """
+        Jump to a fraction of the media's length. Jumping past the end of
+        the range stops looping it.
+        """
+        self.player.set_position(fraction)
+        position = fraction * self.duration
+        self._anchor = (position, self.clock())
+        if self.looping() and position > self.end:
+            self.end = -1
+            self._disarm()
+        else:
+            self._schedule()
+
+    def set_rate(self, rate):
+        # The time played so far counts at the old rate
+        self._anchor = (self.position(), self.clock())
+        for player in self.players():
+            player.set_rate(rate)
+        self._schedule()
+
+    def time(self):
+        return self.player.get_time()
+
+    def position(self):
+        """
+        Where the player should be now, from its last report; finer than
+        its own get_time(), which only changes with the reports
+        """
+        time_reported, reported_at = self._anchor
+        if not self.playing:
+            return time_reported
+        return time_reported + \
+            (self.clock() - reported_at) * self.player.get_rate()
+
+    def previous_position(self):
+        """
+        Where "previous loop" counts from: the start of the loop while one
+        runs, so it means the one before it rather than its own start
+        """
+        return self.start if self.looping() else self.player.get_time()
+
+    def time_changed(self, media_time=None, reported_at=None):
+        """
+        Called as the player reports its time, either straight from the
+        player's thread or later, from the owner's thread, with the time
+        reported and the clock when it was
+        """
+        now = self.clock() if reported_at is None else reported_at
+        if media_time is None:
+            media_time = self.player.get_time()
+        if self._seek is not None:
+            # Until the seek lands, the player still reports times from
+            # before it; no later than the time since it was asked allows
+            played = (now - self._seek[0]) * self.player.get_rate()
+            if not self.start <= media_time <= self.start + played + \
+                    self.SEEK_SLACK:
+                return
+            self._seek_landed(media_time, now)
+        self._anchor = (media_time, now)
+        if self.looping() and media_time > self.end:
+            self.restart_needed = True
+
+    def _seek_landed(self, media_time, now):
+        """
+        Work out from the first report after a restart when the seek
+        landed, hence how long it took and how far past the end the media
+        really played
+        """
+        asked_at, overshoot = self._seek
+        self._seek = None
+        rate = self.player.get_rate()
+        landed_at = now - (media_time - self.start) / rate
+        latency = max(0.0, landed_at - asked_at)
+        # Follow changes in latency, without jumping on every outlier
+        self.seek_latency = latency if not self.overshoots else \
+            self.seek_latency + (latency - self.seek_latency) / 4
+        # The media plays on until the seek lands, or the paused player
+        # takes over
+        self.overshoots.append(overshoot + latency * rate)
+        self.gaps.append(latency)
+        self.gap_measured(latency)
+
+    def _schedule(self):
+        """
+        Arm the timer for the predicted end of the range
+        """
+        if self.timer is None:
+            return
+        if not (self.playing and self.looping()) or self._seek is not None:
+            self._disarm()
+            return
+        delay = (self.end - self.position()) / self.player.get_rate() - \
+            self.seek_latency
+        self.timer.start(max(0, int(delay)))
+
+    def _disarm(self):
+        if self.timer is not None:
+            self.timer.stop()
+
+    def boundary(self):
+        """
+        Called by the timer at the predicted end of the range
+        """
+        if not (self.playing and self.looping()) or self._seek is not None:
+            return
+        delay = (self.end - self.position()) / self.player.get_rate() - \
+            self.seek_latency
+        if delay >= 1:
+            # A report since arming moved the prediction
+            self.timer.start(int(delay))
+            return
+        self._restart()
+
+    def tick(self):
+        if self.restart_needed:
+            self._restart()
+        elif self._seek is not None and \
+                self.clock() - self._seek[0] > 10 * self.TICK:
+            # The player never reported the seek; stop waiting for it
+            self._seek = None
+        self._schedule()
+
+    def _restart(self):
+        self.restart_needed = False
+        overshoot = self.position() - self.end
+        swap = self.gapless and self._standby_state == self.READY
+        if swap:
+            self.standby.audio_set_mute(self.player.audio_get_mute())
+            self.standby.play()
+            self.player.audio_set_mute(True)
+            self.player.set_pause(1)
+            self.player, self.standby = self.standby, self.player
+        else:
+            self.player.set_time(self.start)
+        self._seek = (self.clock(), overshoot)
+        self._anchor = (self.start, self.clock())
+        self._disarm()
+        self.restarts += 1
+        if swap:
+            self.swapped(self.player)
+            # Paused and open already, it only needs to seek back
+            self._preroll()
+        self.restarted(self.start)
+
+    def media_ended(self):
+        """
+        Called once the player reached the end of the media. VLC will not
+        play it again until it is set anew; the loop then starts over.
+        """
+        self.player.set_media(self.player.get_media())
+        self._set_playing(False, started=False)
+        self.run()
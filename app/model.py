@@ -1,43 +1,93 @@
 #!/usr/bin/env python
 # -*- coding: utf-8 -*-
 
-from datetime import timedelta
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+import hashlib
+from itertools import compress, groupby, islice
 import json
+from operator import itemgetter
+import os
+import re
+import sys
 
+from app.formats import FORMAT_BINARY, FORMAT_JSON, FORMAT_SQLITE, \
+    decode_binary, detect_format, encode_binary
+from app.index import IntervalIndex
+from app.journal import TimestampJournal, write_atomically
+from app.loader import iter_json_array
+from app.saver import SaveScheduler
+from app.search import SearchIndex
+from app.undo import CELL, INSERT, REMOVE, UndoStack
 from PyQt5.QtCore import Qt, QAbstractTableModel, QVariant, QObject, pyqtSignal, \
-    QModelIndex
+    QModelIndex, QPersistentModelIndex, QTimer, QFileSystemWatcher, \
+    QAbstractProxyModel
+from PyQt5.QtGui import QColor
 
 
-class TimestampDelta(timedelta):
-    def __new__(cls, *args, **kwargs):
-        return super(TimestampDelta, cls).__new__(cls, *args, **kwargs)
+# The form timestamps are written in; anything else goes through the
+# slower but more lenient TimestampDelta.from_string()
+_CANONICAL_TIME = re.compile(r"[0-9]+:[0-5][0-9]:[0-5][0-9]\.[0-9]{3}\Z")
+_FORMAT_CACHE_SIZE = 65536
+_formatted = {}
+
+
+def _format_milliseconds(milliseconds):
+    if milliseconds == 0:
+        return ""
+    ss, ms = divmod(milliseconds, 1000)
+    mm, ss = divmod(ss, 60)
+    hh, mm = divmod(mm, 60)
+    return "%d:%02d:%02d.%03d" % (hh, mm, ss, ms)
+
+
+def _cached_format(milliseconds):
+    try:
+        return _formatted[milliseconds]
+    except KeyError:
+        if len(_formatted) >= _FORMAT_CACHE_SIZE:
+            _formatted.clear()
+        formatted = _formatted[milliseconds] = \
+            _format_milliseconds(milliseconds)
+        return formatted
+
+
+class TimestampDelta(int):
+    """
+    A position in a video, stored as a plain number of milliseconds. It
+    compares and hashes like an int; str() gives the "H:MM:SS.mmm" form
+    used in timestamp files (empty for 0). Formatted values are cached,
+    since the same few are asked for on every repaint; parse_many() and
+    format_many() handle whole columns at once.
+    """
+    __slots__ = ()
+
+    def __new__(cls, hours=0, minutes=0, seconds=0, milliseconds=0):
+        return super(TimestampDelta, cls).__new__(
+            cls, ((hours * 60 + minutes) * 60 + seconds) * 1000 + milliseconds)
 
     def __str__(self):
-        if self.milliseconds == 0:
-            return ""
-        mm, ss = divmod(self.seconds, 60)
-        hh, mm = divmod(mm, 60)
-        if self.days:
-            hh += self.days * 24
-        ms, _ = divmod(self.microseconds, 1000)
-        s = "%d:%02d:%02d.%03d" % (hh, mm, ss, ms)
-        return s
+        return _cached_format(int(self))
+
+    def __repr__(self):
+        return "TimestampDelta(milliseconds=%d)" % self
 
     @property
     def milliseconds(self):
-        ms = self.seconds * 1000000
-        if self.microseconds:
-            ms += self.microseconds
-        if self.days:
-            ms += self.days * 24 * 60 * 60 * 100000
-        return int(ms/1000)
+        return int(self)
 
     @staticmethod
     def from_string(time_string):
         if not time_string:
             return TimestampDelta(milliseconds=0)
         split_time = time_string.split(':', 2)
+        if len(split_time) < 3:
+            raise ValueError("Invalid time: %s" % time_string)
         split_secs = split_time[2].split('.', 1)
+        if len(split_secs) < 2:
+            raise ValueError("Invalid time: %s" % time_string)
         hours = int(split_time[0])
         if hours < 0:
             raise ValueError
@@ -53,16 +103,46 @@ class TimestampDelta(timedelta):
         return TimestampDelta(hours=hours, minutes=minutes, seconds=seconds,
                               milliseconds=milliseconds)
 
+    @staticmethod
+    def parse_many(time_strings):
+        """
+        Parse a whole list of time strings at once, with the same rules as
+        from_string()
+        :return: array('q') of milliseconds
+        """
+        match = _CANONICAL_TIME.match
+        parsed = array("q")
+        append = parsed.append
+        for time_string in time_strings:
+            if not time_string or match(time_string) is None:
+                append(TimestampDelta.from_string(time_string))
+                continue
+            # All digits once the separators are gone: HMMSSmmm
+            digits = int(time_string.replace(":", "").replace(".", ""))
+            hours, rest = divmod(digits, 10000000)
+            minutes, rest = divmod(rest, 100000)
+            # What is left, SSmmm, is already the milliseconds into the minute
+            append((hours * 60 + minutes) * 60000 + rest)
+        return parsed
+
+    @staticmethod
+    def format_many(milliseconds):
+        """
+        Format a whole column of milliseconds, bypassing the cache
+        """
+        return [_format_milliseconds(value) for value in milliseconds]
+
     @staticmethod
     def string_from_int(milliseconds):
-        return str(TimestampDelta(milliseconds=milliseconds))
+        return _cached_format(int(milliseconds))
 
 
-class Timestamp():
-    def __init__(self, start_time, end_time, description=None):
-        self.start_time = TimestampDelta.from_string(start_time)
-        self.end_time = TimestampDelta.from_string(end_time)
-        self.description = description
+class _TimestampFields():
+    """
+    Accessors shared by detached timestamps and rows of a TimestampList.
+    Subclasses provide start_time, end_time and description.
+    """
+    __slots__ = ()
 
     def get_displayed_start_time(self):
         return str(self.start_time)
@@ -87,81 +167,1050 @@ class Timestamp():
         elif index == 2:
             self.description = value
 
-    def __repr__(self):
-        return json.dumps({
+    def to_dict(self):
+        return {
             "start_time": str(self.start_time),
             "end_time": str(self.end_time),
             "description": self.description
-        }, indent=2)
+        }
+
+    def __repr__(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+
+class Timestamp(_TimestampFields):
+    """
+    A timestamp that does not belong to any list
+    """
+    __slots__ = ("start_time", "end_time", "description")
+
+    def __init__(self, start_time, end_time, description=None):
+        self.start_time = TimestampDelta.from_string(start_time)
+        self.end_time = TimestampDelta.from_string(end_time)
+        self.description = description
+
+    @classmethod
+    def from_milliseconds(cls, start_time, end_time, description=None):
+        timestamp = cls.__new__(cls)
+        timestamp.start_time = TimestampDelta(milliseconds=start_time)
+        timestamp.end_time = TimestampDelta(milliseconds=end_time)
+        timestamp.description = description
+        return timestamp
+
+
+class TimestampRow(_TimestampFields):
+    """
+    Lightweight view over one row of a TimestampList. Reads and writes go
+    straight to the list's columns; the view is only valid until rows are
+    inserted or removed before it.
+    """
+    __slots__ = ("_list", "_row")
+
+    def __init__(self, timestamp_list, row):
+        self._list = timestamp_list
+        self._row = row
+
+    @property
+    def start_time(self):
+        return TimestampDelta(milliseconds=self._list.start_times[self._row])
+
+    @start_time.setter
+    def start_time(self, value):
+        self._list.set_times(self._row, value.milliseconds,
+                             self._list.end_times[self._row])
+
+    @property
+    def end_time(self):
+        return TimestampDelta(milliseconds=self._list.end_times[self._row])
+
+    @end_time.setter
+    def end_time(self, value):
+        self._list.set_times(self._row, self._list.start_times[self._row],
+                             value.milliseconds)
+
+    @property
+    def description(self):
+        return self._list.descriptions[self._row]
+
+    @description.setter
+    def description(self, value):
+        self._list.set_description(self._row, value)
+
+
+def _intern(description):
+    return sys.intern(description) if isinstance(description, str) \
+        else description
+
+
+def _rows_of(rows, counts):
+    """
+    Rows holding the values in counts, as many of each as counted
+    """
+    found = []
+    for row, values in enumerate(rows):
+        if values in counts:
+            found.append(row)
+            counts[values] -= 1
+            if not counts[values]:
+                del counts[values]
+    return found
 
 
 class TimestampList():
+    """
+    Column-oriented storage for timestamps: start and end times live in
+    typed arrays of milliseconds and descriptions in a list of interned
+    strings, so a row costs a few dozen bytes instead of three objects.
+    Indexing returns a TimestampRow view. Every row also gets an id that
+    stays the same while other rows come and go, which is what the interval
+    index refers to.
+
+    Rows are kept ordered by (start time, id). Whoever changes a start time
+    is expected to call target_row() and move_row() afterwards to restore
+    that order.
+
+    Blank rows (nothing marked and no description) are tracked as they are
+    created, edited and removed, so finding the one to fill in does not
+    require a scan.
+    """
     HEADERS = [
         "Start Time",
         "End Time",
         "Description"
     ]
+    # Most rows that resort_rows() moves one at a time
+    RESORT_LIMIT = 1000
 
     def __init__(self, data=[]):
-        self.list = []
-        for timestamp in data:
-            self.list.append(
-                Timestamp(
-                    timestamp['start_time'],
-                    timestamp['end_time'],
-                    timestamp['description']
-                )
-            )
+        self.start_times = array("q")
+        self.end_times = array("q")
+        self.descriptions = []
+        self.ids = array("q")
+        self.next_id = 0
+        self.index = IntervalIndex(self)
+        self.blank_ids = set()
+        # Row of the first blank row, -1 if there is none, None if it needs
+        # to be looked up again
+        self.blank_row = -1
+        # Built on the first search
+        self.search_index = None
+        self.extend_columns(*self.sorted_columns(
+            TimestampDelta.parse_many([entry['start_time'] for entry in data]),
+            TimestampDelta.parse_many([entry['end_time'] for entry in data]),
+            [entry['description'] for entry in data]
+        ))
+
+    @classmethod
+    def from_columns(cls, start_times, end_times, descriptions,
+                     is_sorted=False):
+        """
+        Build a list straight from columns of milliseconds and descriptions,
+        without going through time strings
+        """
+        timestamp_list = cls()
+        if not is_sorted:
+            start_times, end_times, descriptions = cls.sorted_columns(
+                start_times, end_times, descriptions)
+        timestamp_list.extend_columns(start_times, end_times, descriptions)
+        return timestamp_list
+
+    @staticmethod
+    def sorted_columns(start_times, end_times, descriptions):
+        """
+        Reorder the columns of some rows by start time
+        """
+        order = sorted(range(len(descriptions)), key=start_times.__getitem__)
+        return (array("q", [start_times[row] for row in order]),
+                array("q", [end_times[row] for row in order]),
+                [descriptions[row] for row in order])
+
+    def extend_columns(self, start_times, end_times, descriptions):
+        """
+        Append rows, given as columns, that are sorted and start no earlier
+        than the last row
+        """
+        first = len(self)
+        ids = range(self.next_id, self.next_id + len(descriptions))
+        self.start_times.extend(start_times)
+        self.end_times.extend(end_times)
+        self.descriptions.extend(_intern(description)
+                                 for description in descriptions)
+        self.ids.extend(ids)
+        self.next_id += len(descriptions)
+        self.index.invalidate()
+        if self.search_index is not None:
+            self.search_index.add_many(ids, descriptions)
+        for row in range(first, len(self)):
+            if self._is_blank(row):
+                self.blank_ids.add(self.ids[row])
+                if self.blank_row == -1:
+                    self.blank_row = row
+
+    def _insert_at(self, row, timestamp):
+        start = timestamp.start_time.milliseconds
+        end = timestamp.end_time.milliseconds
+        self.start_times.insert(row, start)
+        self.end_times.insert(row, end)
+        self.descriptions.insert(row, _intern(timestamp.description))
+        self.ids.insert(row, self.next_id)
+        self.index.invalidate()
+        if self.search_index is not None:
+            self.search_index.add(self.next_id, timestamp.description)
+        self.next_id += 1
+        if self.blank_row is not None and row <= self.blank_row:
+            self.blank_row += 1
+        self._update_blank(row)
+        return row
+
+    def _is_blank(self, row):
+        return not self.start_times[row] and not self.end_times[row] \
+            and not self.descriptions[row]
+
+    def _update_blank(self, row):
+        """
+        Record whether row is blank after it was inserted or changed
+        """
+        row_id = self.ids[row]
+        if self._is_blank(row):
+            if row_id in self.blank_ids:
+                return
+            self.blank_ids.add(row_id)
+            if self.blank_row == -1:
+                self.blank_row = row
+            elif self.blank_row is not None and row < self.blank_row:
+                self.blank_row = row
+        elif row_id in self.blank_ids:
+            self.blank_ids.discard(row_id)
+            if self.blank_row == row:
+                self.blank_row = None if self.blank_ids else -1
+
+    def _bisect(self, start, row_id, skip=-1):
+        """
+        Number of rows, not counting skip, that sort before (start, row_id)
+        """
+        lo, hi = 0, len(self) - (1 if skip != -1 else 0)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            row = mid if skip == -1 or mid < skip else mid + 1
+            if (self.start_times[row], self.ids[row]) < (start, row_id):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def insertion_row(self, timestamp):
+        """
+        Row that insert() will put timestamp at
+        """
+        return self._bisect(timestamp.start_time.milliseconds, self.next_id)
+
+    def insert(self, timestamp):
+        """
+        Insert timestamp at its sorted position and return that row
+        """
+        return self._insert_at(self.insertion_row(timestamp), timestamp)
 
     def append(self, timestamp):
-        self.list.append(timestamp)
+        self.insert(timestamp)
 
-    def blank_row_index(self):
-        for index, entry in enumerate(self.list):
-            if not entry.start_time and not entry.end_time and \
-               not entry.description:
-                return index
+    def extend_sorted(self, timestamps):
+        """
+        Append timestamps that are sorted and start no earlier than the
+        last row, skipping the search for their positions
+        """
+        self.extend_columns(
+            array("q", [timestamp.start_time.milliseconds
+                        for timestamp in timestamps]),
+            array("q", [timestamp.end_time.milliseconds
+                        for timestamp in timestamps]),
+            [timestamp.description for timestamp in timestamps]
+        )
+
+    def set_times(self, row, start, end):
+        self.start_times[row] = start
+        self.end_times[row] = end
+        self.index.update(row)
+        self._update_blank(row)
+
+    def set_description(self, row, description):
+        self._reindex(row, description)
+        self.descriptions[row] = _intern(description)
+        self._update_blank(row)
+
+    def set_row(self, row, timestamp):
+        self._reindex(row, timestamp.description)
+        self.descriptions[row] = _intern(timestamp.description)
+        self.set_times(row, timestamp.start_time.milliseconds,
+                       timestamp.end_time.milliseconds)
+
+    def target_row(self, row):
+        """
+        Where row belongs once it's taken out of the list, given its current
+        start time
+        """
+        return self._bisect(self.start_times[row], self.ids[row], skip=row)
+
+    def move_row(self, row, target):
+        if row == target:
+            return
+        for column in (self.start_times, self.end_times, self.descriptions,
+                       self.ids):
+            column.insert(target, column.pop(row))
+        self.index.invalidate()
+        if self.ids[target] in self.blank_ids:
+            # The order among blank rows may have changed
+            self.blank_row = None if len(self.blank_ids) > 1 else target
+        elif self.blank_row is None:
+            return
+        elif row < self.blank_row <= target:
+            self.blank_row -= 1
+        elif target <= self.blank_row < row:
+            self.blank_row += 1
+
+    def find_row(self, start, row_id):
+        """
+        Row holding row_id, given its start time, or -1
+        """
+        row = self._bisect(start, row_id)
+        if row < len(self) and self.ids[row] == row_id:
+            return row
         return -1
 
+    def _reindex(self, row, description):
+        if self.search_index is not None:
+            row_id = self.ids[row]
+            self.search_index.remove(row_id, self.descriptions[row])
+            self.search_index.add(row_id, description)
+
+    def matching_rows(self, text):
+        """
+        Rows whose description holds every word of text, the last one
+        possibly unfinished
+        :return: Ascending list of rows, None if text has no words
+        """
+        if self.search_index is None:
+            self.search_index = SearchIndex()
+            self.search_index.add_many(self.ids, self.descriptions)
+        row_ids = self.search_index.search(text)
+        if row_ids is None:
+            return None
+        return list(compress(range(len(self)),
+                            map(row_ids.__contains__, self.ids)))
+
+    def rows_containing(self, position):
+        """
+        Rows whose interval contains position (in milliseconds), innermost
+        loop first
+        """
+        return self.index.containing(position)
+
+    def row_after(self, position):
+        return self.index.next_after(position)
+
+    def row_before(self, position):
+        return self.index.previous_before(position)
+
+    def blank_row_index(self):
+        if self.blank_row is None:
+            # Blank rows all start at 0, so they sort by id
+            self.blank_row = self.find_row(0, min(self.blank_ids)) \
+                if self.blank_ids else -1
+        return self.blank_row
+
     def add_blank_row(self):
-        self.list.append(Timestamp('', '', ''))
+        return self.insert(Timestamp('', '', ''))
 
     def remove_row(self, row):
-        self.list.pop(row)
+        row_id = self.ids.pop(row)
+        del self.start_times[row]
+        del self.end_times[row]
+        self.index.invalidate()
+        description = self.descriptions.pop(row)
+        if self.search_index is not None:
+            self.search_index.remove(row_id, description)
+        self.blank_ids.discard(row_id)
+        if self.blank_row == row:
+            self.blank_row = None if self.blank_ids else -1
+        elif self.blank_row is not None and row < self.blank_row:
+            self.blank_row -= 1
+
+    def remove_range(self, first, last):
+        """
+        Remove the rows from first to last, shifting each column once
+        """
+        for row in range(first, last + 1):
+            row_id = self.ids[row]
+            self.blank_ids.discard(row_id)
+            if self.search_index is not None:
+                self.search_index.remove(row_id, self.descriptions[row])
+        for column in (self.start_times, self.end_times, self.descriptions,
+                       self.ids):
+            del column[first:last + 1]
+        self.index.invalidate()
+        if self.blank_row is None:
+            return
+        if first <= self.blank_row <= last:
+            self.blank_row = None if self.blank_ids else -1
+        elif self.blank_row > last:
+            self.blank_row -= last - first + 1
+
+    def insert_many(self, timestamps):
+        """
+        Insert timestamps at their sorted positions, merging them into the
+        columns in one pass instead of shifting the columns for each one
+        :return: The ids given to the timestamps, in the order passed
+        """
+        start_times = array("q", [timestamp.start_time.milliseconds
+                                  for timestamp in timestamps])
+        # Ids are handed out in sorted order, as sorted_columns() puts them
+        order = sorted(range(len(start_times)), key=start_times.__getitem__)
+        given_ids = array("q", [0]) * len(order)
+        for position, row in enumerate(order):
+            given_ids[row] = self.next_id + position
+        start_times, end_times, descriptions = self.sorted_columns(
+            start_times,
+            array("q", [timestamp.end_time.milliseconds
+                        for timestamp in timestamps]),
+            [timestamp.description for timestamp in timestamps]
+        )
+        if not len(self) or not descriptions or \
+           start_times[0] >= self.start_times[-1]:
+            self.extend_columns(start_times, end_times, descriptions)
+            return given_ids
+        ids = array("q", range(self.next_id,
+                               self.next_id + len(descriptions)))
+        self.next_id += len(descriptions)
+        if self.search_index is not None:
+            self.search_index.add_many(ids, descriptions)
+        for row_id, start, end, description in zip(ids, start_times,
+                                                   end_times, descriptions):
+            if not start and not end and not description:
+                self.blank_ids.add(row_id)
+        # Both parts are sorted by (start time, id) and the new ids are the
+        # largest, so a stable sort on start time alone merges them
+        starts = self.start_times + start_times
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        self._reorder(order, starts, self.end_times + end_times,
+                      self.descriptions + [_intern(description)
+                                           for description in descriptions],
+                      self.ids + ids)
+        return given_ids
+
+    def _reorder(self, order, starts, ends, descriptions, ids):
+        """
+        Rebuild the columns from the rows listed in order
+        """
+        self.start_times = array("q", [starts[row] for row in order])
+        self.end_times = array("q", [ends[row] for row in order])
+        self.descriptions = [descriptions[row] for row in order]
+        self.ids = array("q", [ids[row] for row in order])
+        self.index.invalidate()
+        self.blank_row = None if self.blank_ids else -1
+
+    def remove_rows(self, rows):
+        """
+        Remove a set of rows, compacting the columns in one pass
+        """
+        removed = set(rows)
+        if len(removed) == 1:
+            self.remove_row(removed.pop())
+            return
+        if not removed:
+            return
+        for row in removed:
+            self.blank_ids.discard(self.ids[row])
+            if self.search_index is not None:
+                self.search_index.remove(self.ids[row],
+                                         self.descriptions[row])
+        self._reorder([row for row in range(len(self)) if row not in removed],
+                      self.start_times, self.end_times, self.descriptions,
+                      self.ids)
+
+    def resort(self):
+        """
+        Put rows back in order after several were changed in place
+        """
+        starts = self.start_times
+        ids = self.ids
+        order = sorted(range(len(self)),
+                       key=lambda row: (starts[row], ids[row]))
+        self._reorder(order, starts, self.end_times, self.descriptions, ids)
+
+    def resort_rows(self, rows):
+        """
+        Put the given rows back in order after they were changed in place,
+        moving only them; the other rows must still be in order. Beyond
+        RESORT_LIMIT rows, sorting everything again is cheaper.
+        """
+        rows = sorted(set(rows), reverse=True)
+        if len(rows) > self.RESORT_LIMIT:
+            self.resort()
+            return
+        columns = (self.start_times, self.end_times, self.descriptions,
+                   self.ids)
+        moved = sorted((tuple(column.pop(row) for column in columns)
+                        for row in rows), key=itemgetter(0, 3))
+        for values in moved:
+            target = self._bisect(values[0], values[3])
+            for column, value in zip(columns, values):
+                column.insert(target, value)
+        self.index.invalidate()
+        self.blank_row = None if self.blank_ids else -1
+
+    @contextmanager
+    def bulk(self):
+        """
+        Group changes that the storage can apply more cheaply together
+        """
+        yield
+
+    def diff(self, other):
+        """
+        Compare the rows with those of another list
+        :return: (changed, removed, added): pairs of (row, other row) that
+        start at the same time but differ otherwise, rows only in this list
+        and rows only in other, each in ascending order
+        """
+        old = list(zip(self.start_times, self.end_times, self.descriptions))
+        new = list(zip(other.start_times, other.end_times,
+                       other.descriptions))
+        if old == new:
+            return [], [], []
+        old_counts = Counter(old)
+        new_counts = Counter(new)
+        removed = _rows_of(old, old_counts - new_counts)
+        added = _rows_of(new, new_counts - old_counts)
+        # Both lists are sorted by start time; a removed and an added row
+        # that start at the same time are taken as one row being edited
+        changed = []
+        unpaired_removed, unpaired_added = [], []
+        position, other_position = 0, 0
+        while position < len(removed) and other_position < len(added):
+            row, other_row = removed[position], added[other_position]
+            if old[row][0] == new[other_row][0]:
+                changed.append((row, other_row))
+                position += 1
+                other_position += 1
+            elif old[row][0] < new[other_row][0]:
+                unpaired_removed.append(row)
+                position += 1
+            else:
+                unpaired_added.append(other_row)
+                other_position += 1
+        unpaired_removed.extend(removed[position:])
+        unpaired_added.extend(added[other_position:])
+        return changed, unpaired_removed, unpaired_added
+
+    def record_for_row(self, row):
+        """
+        Journal record that sets the given row to its current value
+        """
+        record = {"op": "set", "row": row}
+        record.update(self[row].to_dict())
+        return record
+
+    def apply_record(self, record):
+        """
+        Replay a journal record produced by this class
+        """
+        op = record["op"]
+        if op == "set":
+            row = record["row"]
+            self.set_row(row, Timestamp(
+                record["start_time"],
+                record["end_time"],
+                record["description"]
+            ))
+            self.move_row(row, self.target_row(row))
+        elif op == "add_blank":
+            self.add_blank_row()
+        elif op == "remove":
+            self.remove_row(record["row"])
+        elif op == "insert_many":
+            self.insert_many([
+                Timestamp(entry["start_time"], entry["end_time"],
+                          entry["description"])
+                for entry in record["timestamps"]
+            ])
+        elif op == "remove_many":
+            self.remove_rows(record["rows"])
+        elif op == "update_many":
+            for entry in record["rows"]:
+                self.set_row(entry["row"], Timestamp(
+                    entry["start_time"],
+                    entry["end_time"],
+                    entry["description"]
+                ))
+            self.resort()
+        elif op == "batch":
+            for batched in record["records"]:
+                self.apply_record(batched)
+        else:
+            raise ValueError("Unknown journal record " + op)
 
     @staticmethod
     def header_at_index(index):
         return TimestampList.HEADERS[index]
 
     def to_json(self):
-        return '[{}]'.format(
-            ",\n".join([timestamp.__repr__() for timestamp in self.list]))
+        return self.serialize_columns(FORMAT_JSON, self.start_times,
+                                      self.end_times, self.descriptions)
+
+    def to_binary(self):
+        return self.serialize_columns(FORMAT_BINARY, self.start_times,
+                                      self.end_times, self.descriptions)
+
+    def serialize(self, file_format):
+        return self.serialize_columns(file_format, self.start_times,
+                                      self.end_times, self.descriptions)
+
+    def copy_columns(self):
+        """
+        Copy the columns, for serialize_columns() to work on while the list
+        keeps changing
+        """
+        return (array("q", self.start_times), array("q", self.end_times),
+                list(self.descriptions))
+
+    @staticmethod
+    def serialize_columns(file_format, start_times, end_times, descriptions):
+        """
+        Give the content of a file holding the given sorted columns
+        """
+        if file_format == FORMAT_BINARY:
+            return encode_binary(start_times, end_times, descriptions, True)
+        start_strings = TimestampDelta.format_many(start_times)
+        end_strings = TimestampDelta.format_many(end_times)
+        return '[{}]'.format(",\n".join([
+            json.dumps({
+                "start_time": start_strings[row],
+                "end_time": end_strings[row],
+                "description": descriptions[row]
+            }, indent=2)
+            for row in range(len(descriptions))
+        ]))
 
     def __len__(self):
-        return len(self.list)
+        return len(self.descriptions)
 
     def __getitem__(self, item):
-        return self.list[item]
+        if item < 0:
+            item += len(self)
+        if not 0 <= item < len(self):
+            raise IndexError("TimestampList index out of range")
+        return TimestampRow(self, item)
 
     def __str__(self):
-        return str(self.list)
+        return str([self[row] for row in range(len(self))])
 
     def __repr__(self):
-        return repr(self.list)
+        return repr([self[row] for row in range(len(self))])
+
+
+
+def read_timestamp_file(filename, video=None):
+    """
+    Load a timestamp file in any format, ignoring any journal
+    :param video: The video to read from an SQLite database
+    :return: (TimestampList, raw content, format)
+    """
+    file_format = detect_format(filename)
+    if file_format == FORMAT_SQLITE:
+        # Imported here since the store builds on TimestampList
+        from app.sqlite_store import SqliteTimestampList
+        store = SqliteTimestampList(filename, video)
+        try:
+            return store.to_timestamp_list(), None, file_format
+        finally:
+            store.close()
+    if file_format == FORMAT_BINARY:
+        with open(filename, "rb") as input_file:
+            content = input_file.read()
+        return TimestampList.from_columns(*decode_binary(content)), content, \
+            file_format
+    with open(filename, "r") as input_file:
+        content = input_file.read()
+    return TimestampList(json.loads(content)), content, file_format
 
 
+def _runs(rows):
+    """
+    Split ascending rows into runs of consecutive ones
+    :return: List of (first, last)
+    """
+    runs = []
+    for row in rows:
+        if runs and runs[-1][1] == row - 1:
+            runs[-1][1] = row
+        else:
+            runs.append([row, row])
+    return runs
+
 
 class TimestampModel(QAbstractTableModel):
+    """
+    Table model over a timestamp file. Large files are streamed in: the
+    first FIRST_FETCH_SIZE entries are read when the model is created and
+    the rest in batches of FETCH_SIZE, either when the view asks for them
+    through fetchMore() or from an idle timer.
+    """
     timeParseError = pyqtSignal(str)
+    loadFailed = pyqtSignal(str)
+    savingStarted = pyqtSignal(QObject)
+    fileReloaded = pyqtSignal()
+    ACTIVE_ROW_COLOR = QColor(0, 152, 116, 60)
+    FIRST_FETCH_SIZE = 200
+    FETCH_SIZE = 5000
+    DISPLAY_CACHE_SIZE = 20000
+    RELOAD_DELAY = 200
+    # Beyond this many new rows (or runs of removed rows) in a reloaded
+    # file, they are changed as one batch rather than signalled one at a
+    # time
+    INCREMENTAL_LIMIT = 1000
+    IMPORT_BATCH_SIZE = 10000
+    # Read only; what seeking to the start of the loop costs, once the
+    # video's keyframes are known
+    SEEK_COST_COLUMN = 3
+    SEEK_COST_HEADER = "Seek Cost"
 
-    def __init__(self, input_file_location=None, parent=None):
+    def __init__(self, input_file_location=None, parent=None, video=None):
+        """
+        :param video: For an SQLite database, the video whose timestamps to
+        show; defaults to the only video in it
+        """
         super(TimestampModel, self).__init__(parent)
         self.input_file_location = input_file_location
         self.list = TimestampList()
+        self.active_key = None
+        self.keyframes = None
+        self.journal = None
+        self.saver = None
+        # Displayed strings of recently painted rows, by row id; only
+        # setData() and removeRows() change what a row displays
+        self._displayed = OrderedDict()
+        self.display_cache_hits = 0
+        self.display_cache_misses = 0
+        self._transaction_depth = 0
+        self._batched_records = []
+        self.undo_stack = UndoStack()
+        self._undoing = False
+        self._watcher = None
+        # Digests of what we wrote, to tell our own writes apart from
+        # changes made by other programs
+        self._written_digests = deque(maxlen=4)
+        self._reload_timer = QTimer(self)
+        self._reload_timer.setSingleShot(True)
+        self._reload_timer.timeout.connect(self._reload_if_changed)
+
+        self._input_file = None
+        self._entries = None
+        self._digest = None
+        self._fetch_timer = QTimer(self)
+        self._fetch_timer.timeout.connect(self._fetch_in_background)
+
+        self.file_format = FORMAT_JSON
 
         if input_file_location:
-            with open(self.input_file_location, "r+") as input_file:
-                self.list = TimestampList(json.load(input_file))
+            self.file_format = detect_format(self.input_file_location)
+            if self.file_format == FORMAT_SQLITE:
+                # The database commits each edit itself, there is nothing to
+                # journal or save
+                from app.sqlite_store import SqliteTimestampList
+                self.list = SqliteTimestampList(self.input_file_location,
+                                                video)
+                return
+            self.journal = TimestampJournal(self.input_file_location)
+            if self.file_format == FORMAT_BINARY or self.journal.exists():
+                self._load_and_replay()
+            else:
+                self._start_streaming()
+            self._watcher = QFileSystemWatcher([self.input_file_location],
+                                               self)
+            self._watcher.fileChanged.connect(self._file_changed)
+
+    def _load_and_replay(self):
+        """
+        Load the whole file at once; needed to replay a journal on top of it.
+        Binary files are always loaded this way, they are quick to decode.
+        """
+        self.list, content, _ = read_timestamp_file(self.input_file_location)
+        if self.journal.replay(self.list, content, self._serialize):
+            # Fold whatever the last session left in the journal back into
+            # the timestamp file straight away
+            self._start_saving(TimestampJournal.digest(content))
+            self.compact()
+        else:
+            self._start_saving(TimestampJournal.digest(content))
+
+    def _start_streaming(self):
+        """
+        Read the first screenful of entries now and the rest in the
+        background. Edits are only persisted once everything is loaded, so a
+        partially read file is never written back.
+        """
+        self._input_file = open(self.input_file_location, "r")
+        self._digest = hashlib.sha1()
+        self._entries = iter_json_array(self._input_file, self._digest)
+        try:
+            self._append_batch(self.FIRST_FETCH_SIZE)
+        except (ValueError, KeyError, TypeError):
+            self._stop_streaming()
+            raise
+        if self._entries is not None:
+            self._fetch_timer.start(0)
+
+    def _stop_streaming(self):
+        self._fetch_timer.stop()
+        self._entries = None
+        if self._input_file is not None:
+            self._input_file.close()
+            self._input_file = None
+
+    def _append_batch(self, size):
+        """
+        Parse up to size more entries and insert them. Files written by this
+        model are already sorted, so a batch usually lands at the end of the
+        list in one block. Saving only starts once the last batch is in, so a
+        file that turns out to be broken halfway is never written back.
+        """
+        batch = []
+        finished = False
+        for entry in self._entries:
+            batch.append(entry)
+            if len(batch) == size:
+                break
+        else:
+            finished = True
+        if batch:
+            self._insert_batch(batch)
+        if finished:
+            digest = self._digest.hexdigest()
+            self._stop_streaming()
+            self._start_saving(digest)
+
+    def _insert_batch(self, batch):
+        parse = TimestampDelta.parse_many
+        start_times, end_times, descriptions = self.list.sorted_columns(
+            parse([entry['start_time'] for entry in batch]),
+            parse([entry['end_time'] for entry in batch]),
+            [entry['description'] for entry in batch]
+        )
+        first = len(self.list)
+        if not first or start_times[0] >= self.list.start_times[first - 1]:
+            self.beginInsertRows(QModelIndex(), first, first + len(batch) - 1)
+            self.list.extend_columns(start_times, end_times, descriptions)
+            self.endInsertRows()
+        else:
+            # Merged in with one layout change rather than row by row
+            self._insert_rows([
+                Timestamp.from_milliseconds(start, end, description)
+                for start, end, description in zip(start_times, end_times,
+                                                    descriptions)
+            ])
+
+    def _fetch_in_background(self):
+        if self._entries is None:
+            return
+        try:
+            self._append_batch(self.FETCH_SIZE)
+        except (ValueError, KeyError, TypeError) as err:
+            self._stop_streaming()
+            self.loadFailed.emit(str(err))
+
+    def _ensure_loaded(self):
+        """
+        Read whatever is left of the file; called before the first edit
+        """
+        while self._entries is not None:
+            self._fetch_in_background()
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return self._entries is not None
+
+    def fetchMore(self, parent=QModelIndex()):
+        self._fetch_in_background()
+
+    def _start_saving(self, base_digest):
+        self.journal.start(base_digest)
+        self._written_digests.append(base_digest)
+        self.saver = SaveScheduler(
+            self.input_file_location,
+            self._snapshot,
+            self.journal.drop_compacting,
+            self
+        )
+        self.savingStarted.emit(self.saver)
+
+    def _log(self, record):
+        """
+        Persist a single edit. Only a small record is appended to the journal
+        right away; the full file is rewritten in the background once the
+        edits settle down, or sooner if the journal grows too long
+        """
+        if self.saver is None:
+            return
+        if self._transaction_depth:
+            self._batched_records.append(record)
+            return
+        self.journal.append(record)
+        self.saver.schedule(immediately=self.journal.needs_compaction())
+
+    @contextmanager
+    def transaction(self):
+        """
+        Group edits so that they are journaled as a single record and saved
+        with a single write
+        """
+        self._transaction_depth += 1
+        self.undo_stack.begin()
+        try:
+            with self.list.bulk():
+                yield
+        finally:
+            self._transaction_depth -= 1
+            self.undo_stack.end()
+            if not self._transaction_depth and self._batched_records:
+                records, self._batched_records = self._batched_records, []
+                self._log(records[0] if len(records) == 1 else
+                          {"op": "batch", "records": records})
+
+    def _serialize(self):
+        return self.list.serialize(self.file_format)
+
+    def _snapshot(self):
+        """
+        Copy the columns on the GUI thread; the saver's worker thread then
+        serializes them and starts a new journal segment on the result
+        """
+        columns = self.list.copy_columns()
+        file_format = self.file_format
+        records = self.journal.records
+
+        def serialize():
+            content = TimestampList.serialize_columns(file_format, *columns)
+            self.journal.rotate(content, records)
+            self._written_digests.append(TimestampJournal.digest(content))
+            return content
+        return serialize
+
+    def compact(self):
+        """
+        Write the whole list to the timestamp file and restart the journal
+        """
+        if self.journal is None:
+            return
+        content = self._serialize()
+        write_atomically(self.input_file_location, content)
+        self.journal.start(TimestampJournal.digest(content))
+        self.journal.drop_compacting()
+        self._written_digests.append(TimestampJournal.digest(content))
+
+    def _file_changed(self, path):
+        self._reload_timer.start(self.RELOAD_DELAY)
+
+    def _reload_if_changed(self):
+        """
+        Bring in the changes another program made to the timestamp file,
+        signalling only the rows that differ so that the selection, the
+        scroll position and the active loop stay put
+        """
+        if self.journal is None:
+            return
+        if not os.path.isfile(self.input_file_location):
+            # Probably in the middle of being replaced
+            self._reload_timer.start(self.RELOAD_DELAY)
+            return
+        # A file replaced through a rename is no longer watched
+        if self.input_file_location not in self._watcher.files():
+            self._watcher.addPath(self.input_file_location)
+        if self.saver is not None and self.saver.pending():
+            # Our own write is on its way and will win; look again after it
+            self._reload_timer.start(self.RELOAD_DELAY)
+            return
+        try:
+            other, content, file_format = \
+                read_timestamp_file(self.input_file_location)
+        except (OSError, ValueError, KeyError, TypeError):
+            # Most likely caught halfway through being written, in which case
+            # another change follows
+            return
+        if file_format == FORMAT_SQLITE:
+            return
+        digest = TimestampJournal.digest(content)
+        if digest in self._written_digests:
+            return
+        self._stop_streaming()
+        self.file_format = file_format
+        self._merge(other)
+        # The history refers to rows that may be gone
+        self.undo_stack.clear()
+        self._written_digests.clear()
+        if self.saver is None:
+            self._start_saving(digest)
+        else:
+            self.journal.start(digest)
+            self.journal.drop_compacting()
+            self._written_digests.append(digest)
+        self.fileReloaded.emit()
+
+    def _merge(self, other):
+        """
+        Make the list hold the same rows as other, a row at a time
+        """
+        changed, removed, added = self.list.diff(other)
+        for row, other_row in changed:
+            self._displayed.pop(self.list.ids[row], None)
+            self.list.set_times(row, self.list.start_times[row],
+                                other.end_times[other_row])
+            self.list.set_description(row, other.descriptions[other_row])
+        for first, last in _runs([row for row, _ in changed]):
+            self.dataChanged.emit(self.index(first, 0),
+                                  self.index(last, self.SEEK_COST_COLUMN))
+        for row in removed:
+            self._displayed.pop(self.list.ids[row], None)
+        runs = _runs(removed)
+        if len(runs) > self.INCREMENTAL_LIMIT:
+            with self._layout_change():
+                self.list.remove_rows(removed)
+        else:
+            for first, last in reversed(runs):
+                self.beginRemoveRows(QModelIndex(), first, last)
+                self.list.remove_range(first, last)
+                self.endRemoveRows()
+        timestamps = [Timestamp.from_milliseconds(other.start_times[row],
+                                                  other.end_times[row],
+                                                  other.descriptions[row])
+                      for row in added]
+        if len(timestamps) > self.INCREMENTAL_LIMIT:
+            self._insert_rows(timestamps)
+            return
+        for timestamp in timestamps:
+            row = self.list.insertion_row(timestamp)
+            self.beginInsertRows(QModelIndex(), row, row)
+            self.list.insert(timestamp)
+            self.endInsertRows()
+
+    def close(self):
+        """
+        Flush pending writes into the timestamp file and stop logging edits
+        """
+        self._stop_streaming()
+        self._reload_timer.stop()
+        if self._watcher is not None:
+            self._watcher.removePaths(self._watcher.files())
+        if self.file_format == FORMAT_SQLITE:
+            self.list.close()
+            self.list = TimestampList()
+            return
+        if self.journal is None:
+            return
+        if self.saver is None or self.saver.flush():
+            self.journal.discard()
+        else:
+            # The journal holds the only copy of the edits that could not be
+            # written; the next load replays it
+            self.journal.close()
+        self.journal = None
 
     def rowCount(self, parent=None, *args, **kwargs):
         if parent and parent.isValid():
@@ -171,76 +1220,660 @@ class TimestampModel(QAbstractTableModel):
     def columnCount(self, parent=None, *args, **kwargs):
         if parent and parent.isValid():
             return 0
-        return 3
+        return self.SEEK_COST_COLUMN + 1
 
     def data(self, index, role=None):
         if not index.isValid():
             return QVariant()
         if role == Qt.UserRole:
+            if index.column() == self.SEEK_COST_COLUMN:
+                return self.seekCost(index.row())
             return self.list[index.row()].get_value_from_index(index.column())
+        if role == Qt.BackgroundRole:
+            if self.active_key and \
+               self.list.ids[index.row()] == self.active_key[1]:
+                return self.ACTIVE_ROW_COLOR
+            return QVariant()
         if role != Qt.DisplayRole and role != Qt.EditRole:
             return QVariant()
-        return self.list[index.row()].get_string_value_from_index(
-            index.column())
+        if index.column() == self.SEEK_COST_COLUMN:
+            cost = self.seekCost(index.row())
+            return "{:.2f} s".format(cost / 1000) if cost is not None else ""
+        return self._displayed_row(index.row())[index.column()]
+
+    def seekCost(self, row):
+        """
+        How many milliseconds of video a seek to the start of the row's loop
+        decodes before showing it, None until the keyframes are known
+        """
+        if self.keyframes is None or not len(self.keyframes):
+            return None
+        return self.keyframes.seek_cost(self.list.start_times[row])
+
+    def setKeyframes(self, keyframes):
+        """
+        Use the keyframe index of the video (an app.keyframes.KeyframeIndex),
+        or None, for the seek cost column
+        """
+        if keyframes is self.keyframes:
+            return
+        self.keyframes = keyframes
+        if self.rowCount():
+            self.dataChanged.emit(
+                self.index(0, self.SEEK_COST_COLUMN),
+                self.index(self.rowCount() - 1, self.SEEK_COST_COLUMN))
+
+    def _displayed_row(self, row):
+        row_id = self.list.ids[row]
+        displayed = self._displayed.get(row_id)
+        if displayed is not None:
+            self.display_cache_hits += 1
+            self._displayed.move_to_end(row_id)
+            return displayed
+        self.display_cache_misses += 1
+        timestamp = self.list[row]
+        displayed = self._displayed[row_id] = tuple(
+            timestamp.get_string_value_from_index(column)
+            for column in range(3))
+        if len(self._displayed) > self.DISPLAY_CACHE_SIZE:
+            self._displayed.popitem(last=False)
+        return displayed
 
     def headerData(self, col, orientation, role=None):
         if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            if col == self.SEEK_COST_COLUMN:
+                return self.SEEK_COST_HEADER
             return self.list.header_at_index(col)
         return QVariant()
 
     def flags(self, index):
         if not index.isValid():
             return None
+        if index.column() == self.SEEK_COST_COLUMN:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
         return Qt.ItemIsEditable | Qt.ItemIsEnabled | Qt.ItemIsSelectable
 
     def setData(self, index, content, role=Qt.EditRole):
         if not index.isValid() or role != Qt.EditRole:
             return False
-        column = index.column()
-        try:
-            if column == 0 or column == 1:
-                content = TimestampDelta.from_string(content)
-            self.list[index.row()].set_value_from_index(index.column(), content)
-            # In case new values are not valid (e.g. start time that is later
-            # than end time), we'll change the *other* value to accommodate
-            # the new time
-            if column == 0 and self.list[index.row()].end_time < content:
-                self.list[index.row()].set_value_from_index(
-                    1,
-                    TimestampDelta.from_string("")
-                )
-            if column == 1 and self.list[index.row()].start_time > content:
-                self.list[index.row()].set_value_from_index(
-                    0,
-                    TimestampDelta.from_string("")
-                )
-            with open(self.input_file_location, "w") as input_file:
-                input_file.write(self.list.to_json())
-            self.dataChanged.emit(index, index)
+        if self._entries is not None:
+            persistent_index = QPersistentModelIndex(index)
+            self._ensure_loaded()
+            index = QModelIndex(persistent_index)
+        row = index.row()
+        with self.transaction():
+            try:
+                self._set_cell(row, index.column(), content)
+            except (ValueError, IndexError) as err:
+                self.timeParseError.emit(
+                    'Time invalid in row {}: {}'.format(row + 1, content))
+                return False
+            self._log(self.list.record_for_row(row))
+        row = self._relocate(row)
+        self.dataChanged.emit(self.index(row, 0),
+                              self.index(row, self.SEEK_COST_COLUMN))
+        return True
+
+    def _set_cell(self, row, column, content):
+        """
+        Change one cell in place, without moving its row
+        :raise ValueError: If content is not a valid time
+        """
+        if column == 0 or column == 1:
+            content = TimestampDelta.from_string(content)
+        before = self._values(row)
+        self._displayed.pop(self.list.ids[row], None)
+        self.list[row].set_value_from_index(column, content)
+        # In case new values are not valid (e.g. start time that is later
+        # than end time), we'll change the *other* value to accommodate
+        # the new time
+        if column == 0 and self.list[row].end_time < content:
+            self.list[row].set_value_from_index(
+                1,
+                TimestampDelta.from_string("")
+            )
+        if column == 1 and self.list[row].start_time > content:
+            self.list[row].set_value_from_index(
+                0,
+                TimestampDelta.from_string("")
+            )
+        row_id = self.list.ids[row]
+        start = self.list.start_times[row]
+        for changed_column, (old, new) in enumerate(zip(before,
+                                                        self._values(row))):
+            if old != new:
+                self._record((CELL, row_id, changed_column, old, new, start))
+
+    def _values(self, row):
+        return (self.list.start_times[row], self.list.end_times[row],
+                self.list.descriptions[row])
+
+    def _record(self, delta):
+        if not self._undoing:
+            self.undo_stack.record(delta)
+
+    def updateCells(self, changes):
+        """
+        Change many cells at once, as one edit: a single layout change is
+        signalled and a single record journaled. Rows are put back in order
+        once all changes are made.
+        :param changes: Iterable of (row, column, content) as for setData()
+        :return: False if any content was invalid, in which case nothing is
+        changed
+        """
+        changes = list(changes)
+        if not changes:
             return True
-        except (ValueError, IndexError) as err:
-            self.timeParseError.emit('Time invalid: ' + content)
-            return False
+        with self._loaded_rows([row for row, _, _ in changes]) as rows:
+            for row, (_, column, content) in zip(rows, changes):
+                if (column == 0 or column == 1) and content:
+                    try:
+                        TimestampDelta.from_string(content)
+                    except (ValueError, IndexError):
+                        self.timeParseError.emit(
+                            'Time invalid in row {}: {}'.format(row + 1,
+                                                                content))
+                        return False
+            with self._updating_rows(rows):
+                for row, (_, column, content) in zip(rows, changes):
+                    self._set_cell(row, column, content)
+        return True
+
+    @contextmanager
+    def _updating_rows(self, rows):
+        """
+        Change the given rows in place inside; they are then journaled and
+        put back in order, with one layout change signalled
+        """
+        rows = sorted(set(rows))
+        with self._layout_change(), self.transaction():
+            yield
+            self._log({
+                "op": "update_many",
+                "rows": [self.list.record_for_row(row) for row in rows]
+            })
+            keys = [(self.list.start_times[row], self.list.ids[row])
+                    for row in rows]
+            self.list.resort_rows(rows)
+        # Let whatever shows the values of a row (e.g. the slider) know
+        changed = sorted(self.list.find_row(*key) for key in keys)
+        if changed:
+            self.dataChanged.emit(self.index(changed[0], 0),
+                                  self.index(changed[-1],
+                                             self.SEEK_COST_COLUMN))
 
-    def insertRows(self, row, count, parent=None, *args, **kwargs):
+    @contextmanager
+    def _loaded_rows(self, rows):
+        """
+        Finish streaming the file in, and give the rows where the given rows
+        are once it's done
+        """
+        if self._entries is not None:
+            persistent_indexes = [QPersistentModelIndex(self.index(row, 0))
+                                  for row in rows]
+            self._ensure_loaded()
+            rows = [index.row() for index in persistent_indexes]
+        yield rows
+
+    @contextmanager
+    def _layout_change(self):
+        """
+        Signal a change that may add, remove and reorder rows anywhere,
+        keeping persistent indexes (selection, current row) on the rows they
+        pointed to
+        """
+        self.layoutAboutToBeChanged.emit()
+        persistent_indexes = self.persistentIndexList()
+        ids = [self.list.ids[index.row()] for index in persistent_indexes]
+        try:
+            yield
+        finally:
+            if persistent_indexes:
+                rows = {row_id: row
+                        for row, row_id in enumerate(self.list.ids)}
+                self.changePersistentIndexList(persistent_indexes, [
+                    self.index(rows[row_id], index.column())
+                    if row_id in rows else QModelIndex()
+                    for row_id, index in zip(ids, persistent_indexes)
+                ])
+            self.layoutChanged.emit()
+
+    def _relocate(self, row):
+        """
+        Move an edited row to where its start time belongs, so the view
+        never has to re-sort the whole table
+        :return: The new row
+        """
+        target = self.list.target_row(row)
+        if target == row:
+            return row
+        # Qt wants the destination as it is before the move
+        self.beginMoveRows(QModelIndex(), row, row, QModelIndex(),
+                           target + 1 if target > row else target)
+        self.list.move_row(row, target)
+        self.endMoveRows()
+        return target
+
+    def insertRows(self, row, count, parent=QModelIndex(), *args, **kwargs):
+        """
+        Add a blank row. It goes where its (empty) start time sorts, which is
+        not necessarily at the requested row
+        """
+        self._ensure_loaded()
         if self.list.blank_row_index() != -1:
             return False
-        self.beginInsertRows(parent, row, row + count - 1)
+        row = self.list.insertion_row(Timestamp('', '', ''))
+        self.beginInsertRows(parent, row, row)
         self.list.add_blank_row()
+        self._log({"op": "add_blank"})
+        self._record((INSERT, self.list.ids[row], self._values(row)))
         self.endInsertRows()
         return True
 
-    def removeRows(self, row, count, parent=None, *args, **kwargs):
+    def insertTimestamps(self, timestamps):
+        """
+        Add many timestamps at once, each where its start time sorts, with
+        one insertion signalled, one record journaled and one edit to undo
+        """
+        self._insert_timestamps(list(timestamps))
+        return True
+
+    def importTimestamps(self, timestamps, batch_size=IMPORT_BATCH_SIZE):
+        """
+        Insert timestamps from any iterable, such as an importer reading a
+        file, batch_size at a time, so only a batch is held besides the
+        list. Each batch is journaled on its own (a transaction would hold
+        them all), but the whole import is a single edit to undo, unless it
+        is too large for the undo history to keep.
+        :return: The number of timestamps inserted
+        """
+        timestamps = iter(timestamps)
+        count = 0
+        self.undo_stack.begin()
+        try:
+            while True:
+                batch = list(islice(timestamps, batch_size))
+                if not batch:
+                    break
+                self._insert_timestamps(batch)
+                count += len(batch)
+        finally:
+            self.undo_stack.end()
+        return count
+
+    def _insert_timestamps(self, timestamps):
+        """
+        :return: The ids given to the timestamps
+        """
+        if not timestamps:
+            return []
+        self._ensure_loaded()
+        row_ids = self._insert_rows(timestamps)
+        self._log({
+            "op": "insert_many",
+            "timestamps": [timestamp.to_dict() for timestamp in timestamps]
+        })
+        # Undone as a single edit, like the single record journaled
+        self.undo_stack.begin()
+        try:
+            for row_id, timestamp in zip(row_ids, timestamps):
+                self._record((INSERT, row_id, (
+                    timestamp.start_time.milliseconds,
+                    timestamp.end_time.milliseconds,
+                    timestamp.description
+                )))
+        finally:
+            self.undo_stack.end()
+        return row_ids
+
+    def _insert_rows(self, timestamps):
+        first = len(self.list)
+        if not first or min(timestamp.start_time for timestamp in timestamps) \
+           >= self.list.start_times[first - 1]:
+            # They all go after the last row
+            self.beginInsertRows(QModelIndex(), first,
+                                 first + len(timestamps) - 1)
+            row_ids = self.list.insert_many(timestamps)
+            self.endInsertRows()
+        else:
+            with self._layout_change():
+                row_ids = self.list.insert_many(timestamps)
+        return row_ids
+
+    def removeRows(self, row, count, parent=QModelIndex(), *args, **kwargs):
+        with self._loaded_rows([row]) as rows:
+            row = rows[0]
         self.beginRemoveRows(parent, row, row + count - 1)
-        for _ in range(count):
-            self.list.remove_row(row)
+        self._remove(range(row, row + count))
         self.endRemoveRows()
         return True
 
+    def removeRowsAt(self, rows):
+        """
+        Remove any set of rows, in one pass over the list, with one removal
+        (or layout change, if they are not next to each other) signalled
+        """
+        with self._loaded_rows(sorted(set(rows))) as rows:
+            if not rows:
+                return True
+            if rows[-1] - rows[0] == len(rows) - 1:
+                return self.removeRows(rows[0], len(rows))
+            with self._layout_change():
+                self._remove(rows)
+        return True
+
+    def _remove(self, rows):
+        rows = list(rows)
+        with self.transaction():
+            for row in rows:
+                row_id = self.list.ids[row]
+                self._displayed.pop(row_id, None)
+                self._record((REMOVE, row_id, self._values(row)))
+            self.list.remove_rows(rows)
+            self._log({"op": "remove", "row": rows[0]} if len(rows) == 1
+                      else {"op": "remove_many", "rows": rows})
+
+    def undo(self):
+        """
+        Revert the last edit
+        :return: False if there was nothing to undo
+        """
+        if not self.undo_stack.can_undo():
+            return False
+        self._replay(reversed(self.undo_stack.pop_undo()), True)
+        return True
+
+    def redo(self):
+        if not self.undo_stack.can_redo():
+            return False
+        self._replay(self.undo_stack.pop_redo(), False)
+        return True
+
+    def _replay(self, deltas, undo):
+        """
+        Apply deltas, or revert them, a batch of the same kind at a time
+        """
+        self._undoing = True
+        try:
+            with self.transaction():
+                for kind, batch in groupby(deltas, itemgetter(0)):
+                    batch = list(batch)
+                    if kind == CELL:
+                        self._restore_cells(batch, undo)
+                    elif (kind == INSERT) != undo:
+                        self._restore_rows(batch)
+                    else:
+                        rows = [self.list.find_row(values[0], row_id)
+                                for _, row_id, values in batch]
+                        self.removeRowsAt([row for row in rows if row != -1])
+        finally:
+            self._undoing = False
+
+    def _restore_cells(self, deltas, undo):
+        """
+        Set cells back to their old values, or again to their new ones. A
+        single row is moved into place on its own, as setData() does;
+        several are changed with one layout change, as updateCells() does.
+        Deltas whose row is gone are skipped.
+        """
+        # Rows are found before any is changed, while the list is in order;
+        # the first delta of a row tells where it starts now
+        rows = {}
+        for _, row_id, column, old, _, start in deltas:
+            if row_id not in rows:
+                rows[row_id] = self.list.find_row(
+                    old if not undo and column == 0 else start, row_id)
+        changes = [(rows[delta[1]], delta[2], delta[3] if undo else delta[4])
+                   for delta in deltas if rows[delta[1]] != -1]
+        changed_rows = set(row for row, _, _ in changes)
+        if len(changed_rows) > 1:
+            with self._updating_rows(changed_rows):
+                for row, column, value in changes:
+                    self._restore_cell(row, column, value)
+            return
+        if not changed_rows:
+            return
+        row = changed_rows.pop()
+        for _, column, value in changes:
+            self._restore_cell(row, column, value)
+        self._log(self.list.record_for_row(row))
+        row = self._relocate(row)
+        self.dataChanged.emit(self.index(row, 0),
+                              self.index(row, self.SEEK_COST_COLUMN))
+
+    def _restore_cell(self, row, column, value):
+        """
+        Change one cell in place, without recording it
+        """
+        self._displayed.pop(self.list.ids[row], None)
+        if column == 0:
+            self.list.set_times(row, value, self.list.end_times[row])
+        elif column == 1:
+            self.list.set_times(row, self.list.start_times[row], value)
+        else:
+            self.list.set_description(row, value)
+
+    def _restore_rows(self, deltas):
+        """
+        Put removed rows back. They get new ids, which the history is told
+        about.
+        """
+        row_ids = self._insert_timestamps([
+            Timestamp.from_milliseconds(*values) for _, _, values in deltas
+        ])
+        self.undo_stack.rename({
+            delta[1]: row_id for delta, row_id in zip(deltas, row_ids)
+        })
+
+    def matchingRows(self, text):
+        """
+        Rows whose description holds every word of text, the last one
+        possibly unfinished; None if text has no words
+        """
+        return self.list.matching_rows(text)
+
     def blankRowIndex(self):
         index = self.list.blank_row_index()
         return self.index(index, 0) if index != -1 else QModelIndex()
 
+    def loopRowsAt(self, position):
+        """
+        Rows whose loop contains position (in milliseconds), innermost first
+        """
+        return self.list.rows_containing(position)
+
+    def nextLoopRow(self, position):
+        return self.list.row_after(position)
+
+    def previousLoopRow(self, position):
+        return self.list.row_before(position)
+
+    def setActiveRow(self, row):
+        """
+        Mark the row of the loop under the playhead, -1 to clear it
+        """
+        active_key = (self.list.start_times[row], self.list.ids[row]) \
+            if row != -1 else None
+        if active_key == self.active_key:
+            return
+        changed_keys = [self.active_key, active_key]
+        self.active_key = active_key
+        for key in changed_keys:
+            changed_row = self.list.find_row(*key) if key else -1
+            if changed_row != -1:
+                self.dataChanged.emit(self.index(changed_row, 0),
+                                      self.index(changed_row,
+                                                 self.SEEK_COST_COLUMN))
+
+
+class SearchProxyModel(QAbstractProxyModel):
+    """
+    Shows the rows of a TimestampModel whose description matches a search.
+    The matching rows come from the model's inverted index in one lookup,
+    rather than from asking about every row the way QSortFilterProxyModel
+    does. With no search, rows map one to one and the model's signals are
+    passed on as they are; while searching, any change to the rows is
+    passed on as a layout change.
+    """
+    def __init__(self, parent=None):
+        super(SearchProxyModel, self).__init__(parent)
+        self.text = ""
+        # Source rows shown, ascending; None while not searching
+        self.rows = None
+        self._saved_indexes = None
+        self._connections = []
+
+    def setSourceModel(self, model):
+        self.beginResetModel()
+        for signal, slot in self._connections:
+            signal.disconnect(slot)
+        super(SearchProxyModel, self).setSourceModel(model)
+        self._connections = [
+            (model.dataChanged, self._source_data_changed),
+            (model.headerDataChanged, self.headerDataChanged),
+            (model.rowsAboutToBeInserted, self._source_rows_inserting),
+            (model.rowsInserted, self._source_rows_inserted),
+            (model.rowsAboutToBeRemoved, self._source_rows_removing),
+            (model.rowsRemoved, self._source_rows_removed),
+            (model.rowsAboutToBeMoved, self._source_rows_moving),
+            (model.rowsMoved, self._source_rows_moved),
+            (model.layoutAboutToBeChanged, self._begin_layout_change),
+            (model.layoutChanged, self._end_layout_change),
+            (model.modelAboutToBeReset, self.beginResetModel),
+            (model.modelReset, self._source_reset),
+        ]
+        for signal, slot in self._connections:
+            signal.connect(slot)
+        self.rows = model.matchingRows(self.text)
+        self.endResetModel()
+
+    def setSearchText(self, text):
+        if text == self.text:
+            return
+        if self.sourceModel() is None:
+            self.text = text
+            return
+        self._begin_layout_change()
+        self.text = text
+        self._end_layout_change()
+
+    def _begin_layout_change(self):
+        self.layoutAboutToBeChanged.emit()
+        # Remember the source rows our persistent indexes point to; the
+        # source updates its own persistent indexes through the change
+        indexes = self.persistentIndexList()
+        self._saved_indexes = (indexes, [
+            QPersistentModelIndex(self.mapToSource(index))
+            for index in indexes
+        ])
+
+    def _end_layout_change(self):
+        if self.sourceModel() is None:
+            return
+        self.rows = self.sourceModel().matchingRows(self.text)
+        indexes, source_indexes = self._saved_indexes
+        self._saved_indexes = None
+        self.changePersistentIndexList(indexes, [
+            self.mapFromSource(QModelIndex(source_index))
+            for source_index in source_indexes
+        ])
+        self.layoutChanged.emit()
+
+    def _source_reset(self):
+        if self.sourceModel() is not None:
+            self.rows = self.sourceModel().matchingRows(self.text)
+        self.endResetModel()
+
+    def _source_rows_inserting(self, parent, first, last):
+        if self.rows is None:
+            self.beginInsertRows(QModelIndex(), first, last)
+        else:
+            self._begin_layout_change()
+
+    def _source_rows_inserted(self):
+        if self._saved_indexes is None:
+            self.endInsertRows()
+        else:
+            self._end_layout_change()
+
+    def _source_rows_removing(self, parent, first, last):
+        if self.rows is None:
+            self.beginRemoveRows(QModelIndex(), first, last)
+        else:
+            self._begin_layout_change()
+
+    def _source_rows_removed(self):
+        if self._saved_indexes is None:
+            self.endRemoveRows()
+        else:
+            self._end_layout_change()
+
+    def _source_rows_moving(self, parent, first, last, destination_parent,
+                            destination):
+        if self.rows is None:
+            self.beginMoveRows(QModelIndex(), first, last, QModelIndex(),
+                               destination)
+        else:
+            self._begin_layout_change()
+
+    def _source_rows_moved(self):
+        if self._saved_indexes is None:
+            self.endMoveRows()
+        else:
+            self._end_layout_change()
+
+    def _source_data_changed(self, top_left, bottom_right, roles=[]):
+        first, last = top_left.row(), bottom_right.row()
+        if self.rows is not None:
+            if self.sourceModel().matchingRows(self.text) != self.rows:
+                # Edited rows started or stopped matching
+                self._begin_layout_change()
+                self._end_layout_change()
+                return
+            first = bisect_left(self.rows, first)
+            last = bisect_right(self.rows, last) - 1
+            if first > last:
+                return
+        self.dataChanged.emit(self.index(first, top_left.column()),
+                              self.index(last, bottom_right.column()), roles)
+
+    def mapToSource(self, index):
+        if not index.isValid() or self.sourceModel() is None:
+            return QModelIndex()
+        row = index.row() if self.rows is None else self.rows[index.row()]
+        return self.sourceModel().index(row, index.column())
+
+    def mapFromSource(self, index):
+        if not index.isValid():
+            return QModelIndex()
+        row = index.row()
+        if self.rows is not None:
+            position = bisect_left(self.rows, row)
+            if position == len(self.rows) or self.rows[position] != row:
+                return QModelIndex()
+            row = position
+        return self.index(row, index.column())
+
+    def index(self, row, column, parent=QModelIndex()):
+        if parent.isValid() or not 0 <= row < self.rowCount() or \
+           not 0 <= column < self.columnCount():
+            return QModelIndex()
+        return self.createIndex(row, column)
+
+    def parent(self, index=None):
+        return QModelIndex()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().rowCount() if self.rows is None \
+            else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid() or self.sourceModel() is None:
+            return 0
+        return self.sourceModel().columnCount()
+
 
 class ToggleButtonModel(QObject):
     """
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+import threading
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+from app.journal import write_atomically
+
+
+class SaveScheduler(QObject):
+    """
+    Coalesces bursts of edits into a single write of a file. The content is
+    snapshotted on the GUI thread once the edits settle down, then
+    serialized and written on a worker thread through a temporary file and
+    an atomic rename.
+    """
+    pendingWritesChanged = pyqtSignal(int)
+    saveFailed = pyqtSignal(str)
+    _writeFinished = pyqtSignal()
+
+    DELAY = 500
+
+    def __init__(self, filename, snapshot, committed=None, parent=None):
+        """
+        :param filename: The file to write
+        :param snapshot: Called on the GUI thread, returns a function that
+        gives the content to write when called on the worker thread
+        :param committed: Called on the GUI thread after a successful write
+        """
+        super(SaveScheduler, self).__init__(parent)
+        self.filename = filename
+        self.snapshot = snapshot
+        self.committed = committed
+        self.dirty = 0
+        self.writing = 0
+        self._worker = None
+        self._error = None
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self._start_write)
+        self._writeFinished.connect(self._write_finished)
+
+    def pending(self):
+        return self.dirty + self.writing
+
+    def schedule(self, immediately=False):
+        """
+        Note that an edit happened; the write starts once no further edit
+        arrives for DELAY milliseconds
+        """
+        self.dirty += 1
+        self.pendingWritesChanged.emit(self.pending())
+        self.timer.start(0 if immediately else self.DELAY)
+
+    def _start_write(self):
+        if self._worker is not None or not self.dirty:
+            # An in-flight write reschedules us when it finishes
+            return
+        serialize = self.snapshot()
+        self.writing, self.dirty = self.dirty, 0
+        self._worker = threading.Thread(target=self._write, args=(serialize,))
+        self._worker.start()
+
+    def _write(self, serialize):
+        try:
+            write_atomically(self.filename, serialize())
+            self._error = None
+        except (IOError, OSError) as err:
+            self._error = str(err)
+        self._writeFinished.emit()
+
+    def _write_finished(self):
+        if self._worker is None:
+            # Already handled by flush()
+            return
+        self._worker = None
+        if self._error:
+            self.dirty += self.writing
+            self.saveFailed.emit(self._error)
+        elif self.committed:
+            self.committed()
+        self.writing = 0
+        self.pendingWritesChanged.emit(self.pending())
+        if self.dirty and not self._error:
+            self.timer.start(self.DELAY)
+
+    def flush(self):
+        """
+        Block until every edit so far is on disk. Meant to be called on exit
+        :return: False if the last write failed, in which case saveFailed
+        was emitted and the edits are not on disk
+        """
+        self.timer.stop()
+        if self._worker is not None:
+            self._worker.join()
+            self._write_finished()
+        if self.dirty:
+            serialize = self.snapshot()
+            self.writing, self.dirty = self.dirty, 0
+            self._worker = threading.current_thread()
+            self._write(serialize)
+            self._write_finished()
+        return not self.dirty
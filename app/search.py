@@ -0,0 +1,88 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from bisect import bisect_left, insort
+import re
+
+_WORD = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Lowercase words of text
+    """
+    return _WORD.findall(text.lower()) if text else []
+
+
+class SearchIndex():
+    """
+    Inverted index from the words of descriptions to the ids of the rows
+    holding them. A search matches the rows that hold every word given, the
+    last one possibly unfinished (a prefix), as it is while being typed.
+    The words are also kept sorted, so a prefix is a range of them.
+    """
+    def __init__(self):
+        self.postings = {}
+        self.words = []
+
+    def add(self, row_id, description):
+        for word in set(tokenize(description)):
+            row_ids = self.postings.get(word)
+            if row_ids is None:
+                row_ids = self.postings[word] = set()
+                insort(self.words, word)
+            row_ids.add(row_id)
+
+    def add_many(self, row_ids, descriptions):
+        """
+        Add a batch of rows, sorting the words once instead of once per new
+        word. Descriptions repeat a lot, so each is split only once.
+        """
+        postings = self.postings
+        known = len(postings)
+        words_of = {}
+        for row_id, description in zip(row_ids, descriptions):
+            words = words_of.get(description)
+            if words is None:
+                words = words_of[description] = set(tokenize(description))
+            for word in words:
+                row_ids_of_word = postings.get(word)
+                if row_ids_of_word is None:
+                    row_ids_of_word = postings[word] = set()
+                row_ids_of_word.add(row_id)
+        if len(postings) != known:
+            self.words = sorted(postings)
+
+    def remove(self, row_id, description):
+        for word in set(tokenize(description)):
+            row_ids = self.postings.get(word)
+            if row_ids is None:
+                continue
+            row_ids.discard(row_id)
+            if not row_ids:
+                del self.postings[word]
+                del self.words[bisect_left(self.words, word)]
+
+    def search(self, text):
+        """
+        :return: Set of the ids of matching rows, None if text has no words
+        (everything matches)
+        """
+        words = tokenize(text)
+        if not words:
+            return None
+        prefix = words.pop()
+        # The words starting with prefix are a range of the sorted words
+        first = bisect_left(self.words, prefix)
+        last = bisect_left(self.words, prefix + "\U0010ffff", first)
+        prefixed = [self.postings[word] for word in self.words[first:last]]
+        if not words:
+            return set().union(*prefixed)
+        # Start from the rarest word to keep the intersections small
+        words.sort(key=lambda word: len(self.postings.get(word, ())))
+        matches = self.postings.get(words[0], set())
+        for word in words[1:]:
+            if not matches:
+                break
+            matches = matches & self.postings.get(word, set())
+        return set().union(*[matches & row_ids for row_ids in prefixed])
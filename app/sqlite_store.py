@@ -0,0 +1,386 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import OrderedDict
+from contextlib import contextmanager
+import sqlite3
+
+from app.model import TimestampList
+from app.search import tokenize
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS timestamps (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    video TEXT NOT NULL,
+    start_ms INTEGER NOT NULL,
+    end_ms INTEGER NOT NULL,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS timestamps_video_start
+    ON timestamps (video, start_ms, id);
+CREATE INDEX IF NOT EXISTS timestamps_video_end
+    ON timestamps (video, end_ms, start_ms);
+CREATE INDEX IF NOT EXISTS timestamps_description
+    ON timestamps (description);
+"""
+
+# Position of each field in a cached row
+_START, _END, _DESCRIPTION, _ID = range(4)
+
+
+class _Column():
+    """
+    Read-only sequence over one field of the rows, paged in on demand
+    """
+    def __init__(self, store, field):
+        self.store = store
+        self.field = field
+
+    def __getitem__(self, row):
+        return self.store.row_at(row)[self.field]
+
+    def __len__(self):
+        return len(self.store)
+
+
+class SqliteTimestampList(TimestampList):
+    """
+    Timestamps of one video in an SQLite database shared by many videos.
+    Rows are not held in memory: they are read a page at a time, ordered by
+    (start time, id) like TimestampList, and only the most recently used
+    pages are cached. Every change is a single-row statement, committed
+    right away. The database runs in WAL mode so other readers are not
+    blocked while we write.
+    """
+    PAGE_SIZE = 256
+    CACHED_PAGES = 64
+
+    def __init__(self, filename, video=None):
+        self.filename = filename
+        self.connection = sqlite3.connect(filename, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.executescript(SCHEMA)
+        if video is None:
+            videos = self.videos()
+            video = videos[0] if len(videos) == 1 else ""
+        self.video = video
+        self.start_times = _Column(self, _START)
+        self.end_times = _Column(self, _END)
+        self.descriptions = _Column(self, _DESCRIPTION)
+        self.ids = _Column(self, _ID)
+        self._pages = OrderedDict()
+        self._count = None
+        self._max_length = None
+        self._bulk_depth = 0
+
+    def _query(self, sql, *parameters):
+        return self.connection.execute(sql, (self.video,) + parameters)
+
+    def _scalar(self, sql, *parameters):
+        return self._query(sql, *parameters).fetchone()[0]
+
+    def _invalidate(self):
+        self._pages.clear()
+
+    def videos(self):
+        return [video for video, in self.connection.execute(
+            "SELECT DISTINCT video FROM timestamps ORDER BY video")]
+
+    def search(self, text):
+        """
+        Timestamps of every video whose description contains text
+        :return: List of (video, start ms, end ms, description)
+        """
+        return self.connection.execute(
+            "SELECT video, start_ms, end_ms, description FROM timestamps "
+            "WHERE description LIKE ? ORDER BY video, start_ms",
+            ("%" + text + "%",)
+        ).fetchall()
+
+    def matching_rows(self, text):
+        # Matched by substring in SQL rather than through a word index, which
+        # would have to be loaded from the database first
+        words = tokenize(text)
+        if not words:
+            return None
+        return [row for row, in self._query(
+            "SELECT row FROM (SELECT ROW_NUMBER() OVER "
+            "(ORDER BY start_ms, id) - 1 AS row, lower(description) AS text "
+            "FROM timestamps WHERE video = ?) WHERE " +
+            " AND ".join(["instr(text, ?)"] * len(words)) + " ORDER BY row",
+            *words
+        )]
+
+    def row_at(self, row):
+        if not 0 <= row < len(self):
+            raise IndexError("TimestampList index out of range")
+        page_number, offset = divmod(row, self.PAGE_SIZE)
+        page = self._pages.get(page_number)
+        if page is None:
+            page = self._query(
+                "SELECT start_ms, end_ms, description, id FROM timestamps "
+                "WHERE video = ? ORDER BY start_ms, id LIMIT ? OFFSET ?",
+                self.PAGE_SIZE, page_number * self.PAGE_SIZE
+            ).fetchall()
+            self._pages[page_number] = page
+            if len(self._pages) > self.CACHED_PAGES:
+                self._pages.popitem(last=False)
+        else:
+            self._pages.move_to_end(page_number)
+        return page[offset]
+
+    def _update_cached(self, row, start, end, description):
+        page = self._pages.get(row // self.PAGE_SIZE)
+        if page is not None:
+            cached = page[row % self.PAGE_SIZE]
+            page[row % self.PAGE_SIZE] = (start, end, description,
+                                          cached[_ID])
+
+    def _rows_before(self, start, row_id):
+        return self._scalar(
+            "SELECT COUNT(*) FROM timestamps WHERE video = ? AND "
+            "(start_ms < ? OR (start_ms = ? AND id < ?))",
+            start, start, row_id
+        )
+
+    def insertion_row(self, timestamp):
+        return self._scalar(
+            "SELECT COUNT(*) FROM timestamps WHERE video = ? AND "
+            "start_ms <= ?",
+            timestamp.start_time.milliseconds
+        )
+
+    def insert(self, timestamp):
+        start = timestamp.start_time.milliseconds
+        end = timestamp.end_time.milliseconds
+        cursor = self.connection.execute(
+            "INSERT INTO timestamps (video, start_ms, end_ms, description) "
+            "VALUES (?, ?, ?, ?)",
+            (self.video, start, end, timestamp.description)
+        )
+        self._invalidate()
+        self._count = len(self) + 1
+        self._grow_max_length(start, end)
+        return self._rows_before(start, cursor.lastrowid)
+
+    @contextmanager
+    def bulk(self):
+        """
+        Run the statements made inside as a single transaction, instead of
+        committing each one
+        """
+        if self._bulk_depth:
+            self._bulk_depth += 1
+            try:
+                yield
+            finally:
+                self._bulk_depth -= 1
+            return
+        self.connection.execute("BEGIN")
+        self._bulk_depth = 1
+        try:
+            yield
+        except BaseException:
+            self.connection.execute("ROLLBACK")
+            self._invalidate()
+            self._count = None
+            self._max_length = None
+            raise
+        else:
+            self.connection.execute("COMMIT")
+        finally:
+            self._bulk_depth = 0
+
+    def extend_sorted(self, timestamps):
+        with self.bulk():
+            self.connection.executemany(
+                "INSERT INTO timestamps (video, start_ms, end_ms, "
+                "description) VALUES (?, ?, ?, ?)",
+                [(self.video, timestamp.start_time.milliseconds,
+                  timestamp.end_time.milliseconds, timestamp.description)
+                 for timestamp in timestamps]
+            )
+        self._invalidate()
+        self._count = None
+        self._max_length = None
+
+    def insert_many(self, timestamps):
+        # The database keeps them in order by itself. Inside one transaction
+        # AUTOINCREMENT hands out consecutive ids, so they follow from the
+        # last one.
+        timestamps = list(timestamps)
+        if not timestamps:
+            return []
+        with self.bulk():
+            self.connection.executemany(
+                "INSERT INTO timestamps (video, start_ms, end_ms, "
+                "description) VALUES (?, ?, ?, ?)",
+                [(self.video, timestamp.start_time.milliseconds,
+                  timestamp.end_time.milliseconds, timestamp.description)
+                 for timestamp in timestamps]
+            )
+            last_id = self.connection.execute(
+                "SELECT last_insert_rowid()").fetchone()[0]
+        self._invalidate()
+        self._count = None
+        self._max_length = None
+        return list(range(last_id - len(timestamps) + 1, last_id + 1))
+
+    def set_times(self, row, start, end):
+        old_start, old_end, description, row_id = self.row_at(row)
+        self.connection.execute(
+            "UPDATE timestamps SET start_ms = ?, end_ms = ? WHERE id = ?",
+            (start, end, row_id)
+        )
+        self._update_cached(row, start, end, description)
+        self._shrink_max_length(old_start, old_end)
+        self._grow_max_length(start, end)
+
+    def set_description(self, row, description):
+        start, end, _, row_id = self.row_at(row)
+        self.connection.execute(
+            "UPDATE timestamps SET description = ? WHERE id = ?",
+            (description, row_id)
+        )
+        self._update_cached(row, start, end, description)
+
+    def set_row(self, row, timestamp):
+        self.set_description(row, timestamp.description)
+        self.set_times(row, timestamp.start_time.milliseconds,
+                       timestamp.end_time.milliseconds)
+
+    def target_row(self, row):
+        start, _, _, row_id = self.row_at(row)
+        return self._rows_before(start, row_id)
+
+    def move_row(self, row, target):
+        # The database already orders rows by start time; only the cached
+        # pages are stale
+        if row != target:
+            self._invalidate()
+
+    def find_row(self, start, row_id):
+        found = self.connection.execute(
+            "SELECT 1 FROM timestamps WHERE id = ? AND start_ms = ?",
+            (row_id, start)
+        ).fetchone()
+        return self._rows_before(start, row_id) if found else -1
+
+    def remove_row(self, row):
+        start, end, _, row_id = self.row_at(row)
+        self.connection.execute("DELETE FROM timestamps WHERE id = ?",
+                                (row_id,))
+        self._invalidate()
+        self._count = len(self) - 1
+        self._shrink_max_length(start, end)
+
+    def remove_rows(self, rows):
+        row_ids = [(self.row_at(row)[_ID],) for row in set(rows)]
+        with self.bulk():
+            self.connection.executemany(
+                "DELETE FROM timestamps WHERE id = ?", row_ids)
+        self._invalidate()
+        self._count = None
+        self._max_length = None
+
+    def remove_range(self, first, last):
+        self.remove_rows(range(first, last + 1))
+
+    def resort(self):
+        self._invalidate()
+
+    def resort_rows(self, rows):
+        self._invalidate()
+
+    def blank_row_index(self):
+        found = self._query(
+            "SELECT start_ms, id FROM timestamps WHERE video = ? AND "
+            "start_ms = 0 AND end_ms = 0 AND "
+            "(description IS NULL OR description = '') ORDER BY id LIMIT 1"
+        ).fetchone()
+        return self.find_row(*found) if found else -1
+
+    def _grow_max_length(self, start, end):
+        if end and self._max_length is not None:
+            self._max_length = max(self._max_length, end - start)
+
+    def _shrink_max_length(self, start, end):
+        if end and self._max_length is not None and \
+           end - start >= self._max_length:
+            # That was the longest loop, look it up again when needed
+            self._max_length = None
+
+    def max_length(self):
+        if self._max_length is None:
+            self._max_length = self._scalar(
+                "SELECT IFNULL(MAX(end_ms - start_ms), 0) FROM timestamps "
+                "WHERE video = ? AND end_ms != 0"
+            )
+        return self._max_length
+
+    def rows_containing(self, position):
+        found = self._query(
+            "SELECT start_ms, id FROM timestamps WHERE video = ? AND "
+            "start_ms BETWEEN ? AND ? AND end_ms >= ? AND end_ms != 0",
+            position - self.max_length(), position, position
+        ).fetchall()
+        found.extend(self._query(
+            "SELECT start_ms, id FROM timestamps WHERE video = ? AND "
+            "end_ms = 0 AND start_ms BETWEEN 1 AND ?",
+            position
+        ).fetchall())
+        found.sort(reverse=True)
+        return [self._rows_before(start, row_id) for start, row_id in found]
+
+    def row_after(self, position):
+        row = self._scalar(
+            "SELECT COUNT(*) FROM timestamps WHERE video = ? AND "
+            "start_ms <= ?",
+            position
+        )
+        return row if row < len(self) else -1
+
+    def row_before(self, position):
+        found = self._query(
+            "SELECT start_ms, id FROM timestamps WHERE video = ? AND "
+            "start_ms < ? AND (start_ms != 0 OR end_ms != 0) "
+            "ORDER BY start_ms DESC, id DESC LIMIT 1",
+            position
+        ).fetchone()
+        return self._rows_before(*found) if found else -1
+
+    def replace_all(self, timestamp_list):
+        """
+        Replace every timestamp of this video with those in timestamp_list,
+        in one transaction so the old ones are never lost on their own
+        """
+        with self.bulk():
+            self.connection.execute("DELETE FROM timestamps WHERE video = ?",
+                                    (self.video,))
+            self.extend_sorted(timestamp_list[row]
+                               for row in range(len(timestamp_list)))
+
+    def to_timestamp_list(self):
+        """
+        Copy every timestamp of this video into an in-memory TimestampList
+        """
+        rows = self._query(
+            "SELECT start_ms, end_ms, description FROM timestamps "
+            "WHERE video = ? ORDER BY start_ms, id"
+        ).fetchall()
+        return TimestampList.from_columns(
+            [start for start, _, _ in rows],
+            [end for _, end, _ in rows],
+            [description for _, _, description in rows],
+            True
+        )
+
+    def close(self):
+        self.connection.close()
+
+    def __len__(self):
+        if self._count is None:
+            self._count = self._scalar(
+                "SELECT COUNT(*) FROM timestamps WHERE video = ?")
+        return self._count
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from collections import deque
+
+# Kinds of delta
+CELL = "cell"
+INSERT = "insert"
+REMOVE = "remove"
+
+
+class UndoStack():
+    """
+    Undo/redo history of a TimestampModel, kept as deltas instead of copies
+    of the list. Each edit is a list of deltas, one of:
+
+        (CELL, row id, column, old value, new value, start)
+        (INSERT, row id, (start, end, description))
+        (REMOVE, row id, (start, end, description))
+
+    Times are in milliseconds. Rows are referred to by id, since their
+    position changes as other rows are edited, along with their start time
+    (for a cell, the one the row has once the delta is applied) so that
+    they can be looked up without a scan. Only the last depth edits are
+    kept, and an edit of more than max_edit_size deltas (such as importing
+    a huge file) is not kept at all: it clears the history instead, since
+    the edits before it may no longer apply.
+    """
+    DEPTH = 100
+    MAX_EDIT_SIZE = 100000
+
+    def __init__(self, depth=DEPTH, max_edit_size=MAX_EDIT_SIZE):
+        self.done = deque(maxlen=depth)
+        self.undone = []
+        self.max_edit_size = max_edit_size
+        self._group = []
+        self._group_depth = 0
+        self._overflowed = False
+
+    def begin(self):
+        """
+        Start collecting deltas into a single edit, until the matching end()
+        """
+        self._group_depth += 1
+
+    def end(self):
+        self._group_depth -= 1
+        if self._group_depth:
+            return
+        edit, self._group = self._group, []
+        if self._overflowed:
+            self._overflowed = False
+            self.clear()
+        elif edit:
+            self._push(edit)
+
+    def record(self, delta):
+        if not self._group_depth:
+            self._push([delta])
+        elif self._overflowed:
+            return
+        elif len(self._group) < self.max_edit_size:
+            self._group.append(delta)
+        else:
+            self._overflowed = True
+            self._group = []
+
+    def _push(self, edit):
+        self.done.append(edit)
+        self.undone = []
+
+    def can_undo(self):
+        return bool(self.done)
+
+    def can_redo(self):
+        return bool(self.undone)
+
+    def pop_undo(self):
+        """
+        The last edit, which moves to the redo side
+        """
+        edit = self.done.pop()
+        self.undone.append(edit)
+        return edit
+
+    def pop_redo(self):
+        edit = self.undone.pop()
+        self.done.append(edit)
+        return edit
+
+    def rename(self, renamed):
+        """
+        Point deltas at the new ids of rows that were removed and put back
+        :param renamed: Dict of old id to new id
+        """
+        for edits in (self.done, self.undone):
+            for edit in edits:
+                for position, delta in enumerate(edit):
+                    if delta[1] in renamed:
+                        edit[position] = \
+                            (delta[0], renamed[delta[1]]) + delta[2:]
+
+    def clear(self):
+        self.done.clear()
+        self.undone = []
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Checks every entry of a timestamp file in one pass and reports all that is
+wrong with it, instead of stopping at the first bad entry like loading
+does. The file is streamed; only the start and end times of the entries are
+kept, to find overlaps once the pass is done.
+"""
+from array import array
+from collections import namedtuple
+import sys
+
+from app.formats import FORMAT_BINARY, FORMAT_SQLITE, HEADER, MAGIC, \
+    VERSION, detect_format
+from app.loader import iter_json_array
+from app.model import TimestampDelta
+
+# Kinds of problem
+PARSE_ERROR = "parse error"
+INVERTED = "inverted"
+OVERLAP = "overlap"
+PAST_END = "past end"
+KINDS = (PARSE_ERROR, INVERTED, OVERLAP, PAST_END)
+
+# index is the position of the entry in the file, from 0 (in start time
+# order for an SQLite database), None for problems with the file as a
+# whole. Entries are shown to users counting from 1, like the rows of the
+# table.
+Problem = namedtuple("Problem", "index kind message")
+
+
+def validate(filename, video=None, duration=None):
+    """
+    Yield a Problem for each thing wrong with the timestamp file: entries
+    that cannot be read, that end before they start or after duration, and
+    that overlap an earlier one. Open ended entries (end time 0) never end
+    too early or too late.
+    :param video: The video whose timestamps to check in an SQLite database
+    :param duration: Length of the video in milliseconds, if known
+    """
+    file_format = detect_format(filename)
+    if file_format == FORMAT_SQLITE:
+        entries = _sqlite_entries(filename, video)
+    elif file_format == FORMAT_BINARY:
+        entries = _binary_entries(filename)
+    else:
+        entries = _json_entries(filename)
+    start_times = array("q")
+    end_times = array("q")
+    indexes = array("q")
+    is_sorted = True
+    for entry in entries:
+        if isinstance(entry, Problem):
+            yield entry
+            continue
+        index, start, end = entry
+        if end and end < start:
+            yield Problem(index, INVERTED, "Ends at {} before it starts at {}"
+                          .format(_time(end), _time(start)))
+        if duration is not None:
+            if start > duration:
+                yield Problem(index, PAST_END, "Starts at {}, after the "
+                              "video ends at {}".format(_time(start),
+                                                        _time(duration)))
+            elif end > duration:
+                yield Problem(index, PAST_END, "Ends at {}, after the video "
+                              "ends at {}".format(_time(end),
+                                                  _time(duration)))
+        if start_times and start < start_times[-1]:
+            is_sorted = False
+        start_times.append(start)
+        end_times.append(end)
+        indexes.append(index)
+    for problem in _overlaps(start_times, end_times, indexes, is_sorted):
+        yield problem
+
+
+def _time(milliseconds):
+    return TimestampDelta.string_from_int(milliseconds) or "0:00:00.000"
+
+
+def _overlaps(start_times, end_times, indexes, is_sorted):
+    """
+    Sweep the entries in start time order, keeping the one that reaches
+    furthest so far; an entry starting before that one ends overlaps it
+    """
+    order = range(len(start_times)) if is_sorted else \
+        sorted(range(len(start_times)), key=start_times.__getitem__)
+    furthest = None
+    for position in order:
+        start = start_times[position]
+        if furthest is not None and start < end_times[furthest]:
+            yield Problem(indexes[position], OVERLAP,
+                          "Overlaps entry {} ({} to {})".format(
+                              indexes[furthest] + 1,
+                              _time(start_times[furthest]),
+                              _time(end_times[furthest])))
+        end = end_times[position]
+        if end > start and (furthest is None or end > end_times[furthest]):
+            furthest = position
+
+
+def _json_entries(filename):
+    """
+    Yield (index, start, end) for each entry, or a Problem if it is invalid
+    """
+    parse = TimestampDelta.from_string
+    index = -1
+    with open(filename, "r") as input_file:
+        try:
+            for index, entry in enumerate(iter_json_array(input_file)):
+                if not isinstance(entry, dict):
+                    yield Problem(index, PARSE_ERROR,
+                                  "Expecting an object, not " +
+                                  type(entry).__name__)
+                    continue
+                missing = [key for key in ("start_time", "end_time",
+                                           "description")
+                           if key not in entry]
+                if missing:
+                    yield Problem(index, PARSE_ERROR,
+                                  "Missing " + ", ".join(missing))
+                    continue
+                times = []
+                for key in ("start_time", "end_time"):
+                    try:
+                        times.append(parse(entry[key]))
+                    except (ValueError, IndexError, TypeError,
+                            AttributeError):
+                        yield Problem(index, PARSE_ERROR, "Invalid {} {!r}"
+                                      .format(key, entry[key]))
+                description = entry["description"]
+                if description is not None and \
+                   not isinstance(description, str):
+                    yield Problem(index, PARSE_ERROR,
+                                  "Description is not a string")
+                if len(times) == 2:
+                    yield index, times[0], times[1]
+        except (ValueError, UnicodeDecodeError) as err:
+            # Nothing after broken JSON can be made sense of
+            yield Problem(index + 1, PARSE_ERROR, "Invalid JSON: " + str(err))
+
+
+def _read_column(input_file, typecode, count):
+    column = array(typecode)
+    column.fromfile(input_file, count)
+    if sys.byteorder == "big":
+        column.byteswap()
+    return column
+
+
+def _binary_entries(filename):
+    with open(filename, "rb") as input_file:
+        header = input_file.read(HEADER.size)
+        if len(header) < HEADER.size:
+            yield Problem(None, PARSE_ERROR, "Truncated header")
+            return
+        magic, version, _, count = HEADER.unpack(header)
+        if magic != MAGIC or version > VERSION:
+            yield Problem(None, PARSE_ERROR,
+                          "Unsupported binary timestamp file version " +
+                          str(version))
+            return
+        try:
+            start_times = _read_column(input_file, "q", count)
+            end_times = _read_column(input_file, "q", count)
+            offsets = _read_column(input_file, "Q", count + 1)
+            nulls = input_file.read(count)
+        except EOFError:
+            yield Problem(None, PARSE_ERROR,
+                          "Truncated binary timestamp file")
+            return
+        if len(nulls) != count:
+            yield Problem(None, PARSE_ERROR,
+                          "Truncated binary timestamp file")
+            return
+        for index in range(count):
+            size = offsets[index + 1] - offsets[index]
+            if size < 0:
+                yield Problem(index, PARSE_ERROR,
+                              "Invalid description offsets")
+                return
+            data = input_file.read(size)
+            if len(data) != size:
+                yield Problem(index, PARSE_ERROR,
+                              "Description blob is truncated")
+                return
+            try:
+                data.decode("utf-8")
+            except UnicodeDecodeError:
+                yield Problem(index, PARSE_ERROR,
+                              "Description is not valid UTF-8")
+            yield index, start_times[index], end_times[index]
+        if input_file.read(1):
+            yield Problem(None, PARSE_ERROR,
+                          "Extra data after the description blob")
+
+
+def _sqlite_entries(filename, video):
+    # Imported here since the store builds on the model
+    from app.sqlite_store import SqliteTimestampList
+    store = SqliteTimestampList(filename, video)
+    try:
+        cursor = store.connection.execute(
+            "SELECT start_ms, end_ms FROM timestamps WHERE video = ? "
+            "ORDER BY start_ms, id", (store.video,))
+        for index, (start, end) in enumerate(cursor):
+            yield index, start, end
+    finally:
+        store.close()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Timing of the loop engine against a fake player on a virtual clock, so the
+numbers are the same on every run. Run from the repository root:
+
+    python -m benchmarks.bench_loop
+"""
+from app.loop import LoopController
+
+SECONDS = 120
+
+
+class FakePlayer():
+    """
+    Stands in for vlc.MediaPlayer. Time only moves on advance(). Like VLC,
+    the player reports its time every report_interval milliseconds through
+    time_changed, get_time() only changes with the reports, and a seek lands
+    seek_latency milliseconds after it is asked for (and is reported, even
+    while paused), and a paused player resumes resume_latency milliseconds
+    after it is asked to. How far past a
+    loop's end the media really played is recorded at each seek.
+    """
+    def __init__(self, length, report_interval=250, seek_latency=30,
+                 rate=1.0, resume_latency=0):
+        self.length = length
+        self.report_interval = report_interval
+        self.seek_latency = seek_latency
+        self.resume_latency = resume_latency
+        self.rate = rate
+        self.media = object()
+        self.time = 0.0
+        self.reported = 0
+        self.clock = 0
+        self.playing = False
+        self.muted = False
+        self._resume = None
+        self.time_changed = None
+        self.timers = []
+        self.seeks = []
+        self._seek = None
+        self._peak = 0.0
+
+    def play(self):
+        if not self.playing and self.resume_latency:
+            self._resume = self.clock + self.resume_latency
+        else:
+            self.playing = True
+
+    def pause(self):
+        if self.playing:
+            self.seeks.append(self._peak)
+        self.playing = False
+        self._resume = None
+
+    def set_pause(self, pause):
+        if pause:
+            self.pause()
+        else:
+            self.play()
+
+    def stop(self):
+        self.pause()
+        self.time = 0.0
+
+    def audio_get_mute(self):
+        return self.muted
+
+    def audio_set_mute(self, muted):
+        self.muted = muted
+
+    def get_time(self):
+        return self.reported
+
+    def set_time(self, time):
+        self._seek = (self.clock + self.seek_latency, time)
+
+    def set_position(self, fraction):
+        self.set_time(int(fraction * self.length))
+
+    def get_rate(self):
+        return self.rate
+
+    def set_rate(self, rate):
+        self.rate = rate
+
+    def get_media(self):
+        return self.media
+
+    def set_media(self, media):
+        self.media = media
+        self.time = 0.0
+
+    def advance(self, milliseconds):
+        for _ in range(milliseconds):
+            self.step()
+
+    def step(self):
+        """
+        Let a millisecond pass
+        """
+        self.clock += 1
+        if self._resume is not None and self._resume <= self.clock:
+            self._resume = None
+            self.playing = True
+        if self.playing and self.time < self.length:
+            self.time += self.rate
+            self._peak = max(self._peak, self.time)
+        if self._seek is not None and self._seek[0] <= self.clock:
+            if self.playing:
+                self.seeks.append(self._peak)
+            self.time = self._peak = self._seek[1]
+            self._seek = None
+            if not self.playing:
+                self.reported = int(self.time)
+                if self.time_changed is not None:
+                    self.time_changed()
+        if self.playing and self.clock % self.report_interval == 0:
+            self.reported = int(self.time)
+            if self.time_changed is not None:
+                self.time_changed()
+        for timer in self.timers:
+            timer.fire_if_due(self.clock)
+
+
+class FakeTimer():
+    """
+    One-shot timer on the fake player's clock
+    """
+    def __init__(self, player, callback):
+        self.player = player
+        self.callback = callback
+        self.deadline = None
+        player.timers.append(self)
+
+    def start(self, milliseconds):
+        self.deadline = self.player.clock + milliseconds
+
+    def stop(self):
+        self.deadline = None
+
+    def fire_if_due(self, clock):
+        if self.deadline is not None and self.deadline <= clock:
+            self.deadline = None
+            self.callback()
+
+
+def run_loop(start, end, report_interval, seek_latency, rate=1.0,
+             predictive=True, gapless=False, resume_latency=5):
+    """
+    Loop start to end for SECONDS of virtual time
+    :return: (how far past end each pass really went, as the controller
+    measured it), in milliseconds, and how long the restarts took
+    """
+    players = [FakePlayer(10 * 60 * 1000, report_interval, seek_latency,
+                          rate, resume_latency) for _ in range(2)]
+    player, standby = players
+    # Both players record where they stopped in the same list
+    standby.seeks = player.seeks
+    controller = LoopController(player, clock=lambda: player.clock,
+                                standby=standby)
+    if predictive:
+        controller.timer = FakeTimer(player, controller.boundary)
+    for fake in players:
+        fake.time_changed = lambda fake=fake: (
+            controller.time_changed if controller.player is fake
+            else controller.standby_time_changed)()
+    controller.set_media(player.media, player.length)
+    controller.set_range(start, end)
+    controller.set_gapless(gapless)
+    controller.run()
+    del player.seeks[:]
+    for _ in range(SECONDS * 1000 // controller.TICK):
+        for _ in range(controller.TICK):
+            for fake in players:
+                fake.step()
+        controller.tick()
+    # The first pass runs before the seek latency is known
+    return [peak - end for peak in player.seeks[3:]], \
+        list(controller.overshoots)[2:], list(controller.gaps)[2:]
+
+
+def _summary(values):
+    return "mean {:.1f} ms, max {:.1f} ms".format(
+        sum(values) / len(values), max(values))
+
+
+def bench_overshoot():
+    for predictive in (False, True):
+        for report_interval in (50, 250):
+            for rate in (0.5, 1.0, 2.0):
+                overshoots, measured, _ = run_loop(
+                    1000, 3000, report_interval, 30, rate, predictive)
+                print("{}, report every {} ms, rate {}: overshoot {}; "
+                      "measured {}".format(
+                          "predicted" if predictive else "event driven",
+                          report_interval, rate, _summary(overshoots),
+                          _summary(measured) if measured else "none"))
+
+
+def bench_gapless():
+    """
+    Seeking back on a long-GOP file against swapping to a paused player
+    """
+    for gapless in (False, True):
+        for seek_latency in (30, 300):
+            overshoots, _, gaps = run_loop(1000, 3000, 250, seek_latency,
+                                           gapless=gapless)
+            print("{}, seek takes {} ms: gap {}; overshoot {}".format(
+                "gapless" if gapless else "seeking", seek_latency,
+                _summary(gaps), _summary(overshoots)))
+
+
+def main():
+    bench_overshoot()
+    bench_gapless()
+
+
+if __name__ == '__main__':
+    main()
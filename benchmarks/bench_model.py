@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+Micro-benchmarks for the timestamp data layer. Run from the repository root:
+
+    python -m benchmarks.bench_model
+"""
+import json
+import timeit
+import tracemalloc
+
+from app.formats import decode_binary
+from app.model import Timestamp, TimestampDelta, TimestampList
+
+ROWS = 100000
+
+
+def _entries(count):
+    return [
+        {
+            "start_time": TimestampDelta.string_from_int(i * 1000 + 1),
+            "end_time": TimestampDelta.string_from_int(i * 1000 + 500),
+            "description": "loop {}".format(i % 100)
+        }
+        for i in range(count)
+    ]
+
+
+def bench_memory_per_row():
+    entries = _entries(ROWS)
+
+    tracemalloc.start()
+    objects = [Timestamp(e["start_time"], e["end_time"], e["description"])
+               for e in entries]
+    object_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+
+    tracemalloc.start()
+    timestamp_list = TimestampList(entries)
+    list_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del timestamp_list
+
+    print("memory per row: Timestamp objects {:.1f} B, "
+          "TimestampList {:.1f} B".format(object_bytes / ROWS,
+                                          list_bytes / ROWS))
+
+
+def bench_sort_keys():
+    timestamp_list = TimestampList(_entries(ROWS))
+    seconds = timeit.timeit(lambda: sorted(timestamp_list.start_times),
+                            number=10) / 10
+    print("sort {} start times: {:.2f} ms".format(ROWS, seconds * 1000))
+
+
+def _time(function, number=5):
+    return timeit.timeit(function, number=number) / number * 1000
+
+
+def bench_formats():
+    timestamp_list = TimestampList(_entries(ROWS))
+    json_content = timestamp_list.to_json()
+    binary_content = timestamp_list.to_binary()
+    print("size: JSON {} KiB, binary {} KiB".format(
+        len(json_content) // 1024, len(binary_content) // 1024))
+    print("save: JSON {:.1f} ms, binary {:.1f} ms".format(
+        _time(timestamp_list.to_json), _time(timestamp_list.to_binary)))
+    print("load: JSON {:.1f} ms, binary {:.1f} ms".format(
+        _time(lambda: TimestampList(json.loads(json_content))),
+        _time(lambda: TimestampList.from_columns(
+            *decode_binary(binary_content)))))
+
+
+def bench_time_values():
+    entries = _entries(ROWS)
+    time_strings = [entry["start_time"] for entry in entries]
+    print("parse {} times: from_string {:.1f} ms, parse_many {:.1f} ms".format(
+        ROWS,
+        _time(lambda: [TimestampDelta.from_string(time_string)
+                       for time_string in time_strings]),
+        _time(lambda: TimestampDelta.parse_many(time_strings))))
+    values = TimestampDelta.parse_many(time_strings)
+    repainted = values[:1000]
+    print("format {} times: format_many {:.1f} ms, "
+          "repaint of 1000 cached {:.2f} ms".format(
+              ROWS,
+              _time(lambda: TimestampDelta.format_many(values)),
+              _time(lambda: [str(TimestampDelta(milliseconds=value))
+                             for value in repainted])))
+
+
+def main():
+    bench_time_values()
+    bench_memory_per_row()
+    bench_sort_keys()
+    bench_formats()
+
+
+if __name__ == '__main__':
+    main()
@@ -2,6 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import os
+import sqlite3
 import sys
 import traceback
 
@@ -9,11 +10,20 @@ import qtawesome as qta
 from PyQt5 import uic
 from PyQt5.QtWidgets import QApplication, QFileDialog, QMainWindow, \
     QMessageBox, QDataWidgetMapper
-from PyQt5.QtGui import QCursor
-from PyQt5.QtCore import QDir, QTimer, Qt, QModelIndex, QSortFilterProxyModel
+from PyQt5.QtGui import QCursor, QKeySequence
+from PyQt5.QtCore import QDir, QTimer, Qt, QModelIndex
 
 from lib import vlc
-from app.model import TimestampModel, ToggleButtonModel, TimestampDelta
+from app.formats import FORMAT_SQLITE
+from app.importers import IMPORTERS, import_file
+from app.keyframes import KeyframeIndexer, cache_filename
+from app.validator import PARSE_ERROR, validate
+from app.library import LibraryScanner, MediaLibrary, default_filename
+from app.loop import LoopController
+from gui.player_events import MediaParser, PlayerEvents
+from gui.widgets import VideoFrame
+from app.model import TimestampModel, ToggleButtonModel, TimestampDelta, \
+    SearchProxyModel
 
 
 class MainWindow(QMainWindow):
@@ -26,31 +36,64 @@ class MainWindow(QMainWindow):
 
         self.timestamp_filename = None
         self.video_filename = None
-        self.media_start_time = None
-        self.media_end_time = None
-        self.restart_needed = False
-        self.timer_period = 100
         self.is_full_screen = False
-        self.media_started_playing = False
-        self.media_is_playing = False
         self.original_geometry = None
         self.mute = False
+        # Parsing the video, while it is
+        self.media_parser = None
+        # Keyframe index of the video, once read
+        self.keyframes = None
+        self.snap_to_keyframes = False
+
+        library_filename = default_filename()
+        self.library = MediaLibrary(library_filename)
+        # Catch up with whatever changed on disk since the last run
+        self.library_scanner = LibraryScanner(library_filename, self)
+        self.library_scanner.start()
+        self.keyframe_indexer = KeyframeIndexer(self)
+        self.keyframe_indexer.indexed.connect(self._keyframes_indexed)
+        self.keyframe_indexer.indexFailed.connect(
+            lambda filename, err: filename == self.video_filename and
+            self.ui.statusBar().showMessage(
+                "No keyframe index: " + err, 2000))
 
         self.timestamp_model = TimestampModel(None, self)
-        self.proxy_model = QSortFilterProxyModel(self)
-        self.ui.list_timestamp.setModel(self.timestamp_model)
+        # (signal, slot) pairs tying the open timestamp model and its saver
+        # to the window, undone before another file is opened
+        self._model_connections = []
+        self.proxy_model = SearchProxyModel(self)
+        self.proxy_model.setSourceModel(self.timestamp_model)
+        self.proxy_model.dataChanged.connect(self.update_slider_highlight)
+        self.proxy_model.rowsMoved.connect(self._sync_mapper)
+        self.proxy_model.layoutChanged.connect(self._sync_mapper)
+        self.ui.entry_search.textChanged.connect(
+            self.proxy_model.setSearchText)
+        self.ui.list_timestamp.setModel(self.proxy_model)
+        self.ui.list_timestamp.selectionModel().selectionChanged.connect(
+            self.timestamp_selection_changed)
         self.ui.list_timestamp.doubleClicked.connect(
             lambda event: self.ui.list_timestamp.indexAt(event.pos()).isValid()
             and self.run()
         )
 
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_ui)
-        self.timer.timeout.connect(self.timer_handler)
-        self.timer.start(self.timer_period)
-
         self.vlc_instance = vlc.Instance()
-        self.media_player = self.vlc_instance.media_player_new()
+        # One player per video surface; the second stands by for gapless
+        # looping
+        self.media_players = [self.vlc_instance.media_player_new()
+                              for _ in range(VideoFrame.SURFACES)]
+        # Fires at the predicted end of the loop
+        self.loop_timer = QTimer(self)
+        self.loop_timer.setSingleShot(True)
+        self.loop_timer.setTimerType(Qt.PreciseTimer)
+        self.loop = LoopController(self.media_players[0], self.loop_timer,
+                                   standby=self.media_players[1])
+        self.loop_timer.timeout.connect(self.loop.boundary)
+        self.loop.swapped.connect(
+            lambda player: self.ui.frame_video.show_surface(
+                self.media_players.index(player)))
+        self.loop.gap_measured.connect(
+            lambda gap: self.ui.statusBar().showMessage(
+                "Looped back in {:.0f} ms".format(gap), 2000))
         # if sys.platform == "darwin":  # for MacOS
         #     self.ui.frame_video = QMacCocoaViewContainer(0)
 
@@ -82,6 +125,8 @@ class MainWindow(QMainWindow):
         )
         self.ui.button_play_pause.setModel(self.play_pause_model)
         self.ui.button_play_pause.clicked.connect(self.play_pause)
+        self.loop.playing_changed.connect(
+            lambda playing: self.play_pause_model.setState(not playing))
 
         self.mute_model = ToggleButtonModel(None, self)
         self.mute_model.setStateMap(
@@ -144,58 +189,74 @@ class MainWindow(QMainWindow):
         # Mapper between the table and the entry detail
         self.mapper = QDataWidgetMapper()
         self.mapper.setSubmitPolicy(QDataWidgetMapper.ManualSubmit)
+        self.mapper.setModel(self.proxy_model)
+        self.mapper.addMapping(self.ui.entry_start_time, 0)
+        self.mapper.addMapping(self.ui.entry_end_time, 1)
+        self.mapper.addMapping(self.ui.entry_description, 2)
         self.ui.button_save.clicked.connect(self.mapper.submit)
 
         # Set up default volume
         self.set_volume(self.ui.slider_volume.value())
 
-        self.vlc_events = self.media_player.event_manager()
-        self.vlc_events.event_attach(
-            vlc.EventType.MediaPlayerTimeChanged, self.media_time_change_handler
-        )
-
-        # Let our application handle mouse and key input instead of VLC
-        self.media_player.video_set_mouse_input(False)
-        self.media_player.video_set_key_input(False)
+        # Nothing is polled: the UI follows the events of whichever player
+        # is playing
+        self.player_events = []
+        for player in self.media_players:
+            events = PlayerEvents(player, self)
+            events.timeChanged.connect(
+                lambda media_time, reported_at, player=player:
+                self.media_time_change_handler(player, media_time,
+                                               reported_at))
+            events.positionChanged.connect(
+                lambda position, player=player:
+                player is self.media_player and self.update_ui(position))
+            events.endReached.connect(
+                lambda player=player:
+                player is self.media_player and self.media_end_handler())
+            self.player_events.append(events)
+
+            # Let our application handle mouse and key input instead of VLC
+            player.video_set_mouse_input(False)
+            player.video_set_key_input(False)
 
         self.ui.show()
 
 
+    @property
+    def media_player(self):
+        """
+        The player playing; the players swap roles in gapless looping
+        """
+        return self.loop.player
+
     def add_entry(self):
         if not self.timestamp_filename:
             self._show_error("You haven't chosen a timestamp file yet")
-        row_num = self.timestamp_model.rowCount()
-        self.timestamp_model.insertRow(row_num)
-        start_cell = self.timestamp_model.index(row_num, 0)
-        end_cell = self.timestamp_model.index(row_num, 1)
-        self.timestamp_model.setData(start_cell, TimestampDelta.from_string(""))
-        self.timestamp_model.setData(end_cell, TimestampDelta.from_string(""))
+        # The new row has no description, it would not show up in a search
+        self.ui.entry_search.clear()
+        self.timestamp_model.insertRow(self.timestamp_model.rowCount())
+        self._select_blank_row()
 
     def remove_entry(self):
         if not self.timestamp_filename:
             self._show_error("You haven't chosen a timestamp file yet")
-        selected = self.ui.list_timestamp.selectionModel().selectedIndexes()
+        selected = self.ui.list_timestamp.selectionModel().selectedRows()
         if len(selected) == 0:
             return
-        self.proxy_model.removeRow(selected[0].row()) and self.mapper.submit()
+        self.timestamp_model.removeRowsAt(
+            [self.proxy_model.mapToSource(index).row() for index in selected]
+        ) and self.mapper.submit()
 
 
     def set_media_position(self, position):
-        percentage = position / 10000.0
-        self.media_player.set_position(percentage)
-        absolute_position = percentage * \
-            self.media_player.get_media().get_duration()
-        if absolute_position > self.media_end_time:
-            self.media_end_time = -1
+        self.loop.seek(position / 10000.0)
 
     def set_mark(self, start_time=None, end_time=None):
         if len(self.ui.list_timestamp.selectedIndexes()) == 0:
-            blankRowIndex = self.timestamp_model.blankRowIndex()
-            if not blankRowIndex.isValid():
+            if not self.timestamp_model.blankRowIndex().isValid():
                 self.add_entry()
             else:
-                index = self.proxy_model.mapFromSource(blankRowIndex)
-                self.ui.list_timestamp.selectRow(index.row())
+                self._select_blank_row()
         selectedIndexes = self.ui.list_timestamp.selectedIndexes()
         if start_time:
             self.proxy_model.setData(selectedIndexes[0],
@@ -206,33 +267,16 @@ class MainWindow(QMainWindow):
                                      TimestampDelta.string_from_int(
                                          end_time))
 
-    def update_ui(self):
+    def update_ui(self, position):
         self.ui.slider_progress.blockSignals(True)
-        self.ui.slider_progress.setValue(
-            self.media_player.get_position() * 10000
-        )
-        # When the video finishes
+        self.ui.slider_progress.setValue(int(position * 10000))
         self.ui.slider_progress.blockSignals(False)
-        if self.media_started_playing and \
-           self.media_player.get_media().get_state() == vlc.State.Ended:
-            self.play_pause_model.setState(True)
-            # Apparently we need to reset the media, otherwise the player
-            # won't play at all
-            self.media_player.set_media(self.media_player.get_media())
-            self.set_volume(self.ui.slider_volume.value())
-            self.media_is_playing = False
-            self.media_started_playing = False
-            self.run()
+        self.update_active_loop()
 
-    def timer_handler(self):
-        """
-        This is a workaround, because for some reason we can't call set_time()
-        inside the MediaPlayerTimeChanged handler (as the video just stops
-        playing)
-        """
-        if self.restart_needed:
-            self.media_player.set_time(self.media_start_time)
-            self.restart_needed = False
+    def media_end_handler(self):
+        if self.loop.started:
+            self.loop.media_ended()
+            self.set_volume(self.ui.slider_volume.value())
 
     def key_handler(self, event):
         if event.key() == Qt.Key_Escape and self.is_full_screen:
@@ -241,6 +285,23 @@ class MainWindow(QMainWindow):
             self.toggle_full_screen()
         if event.key() == Qt.Key_Space:
             self.play_pause()
+        if event.matches(QKeySequence.Undo):
+            self.timestamp_model.undo()
+        if event.matches(QKeySequence.Redo):
+            self.timestamp_model.redo()
+        if event.key() == Qt.Key_I and \
+           event.modifiers() & Qt.ControlModifier:
+            self.import_handler()
+        if event.key() == Qt.Key_G:
+            self.toggle_gapless()
+        if event.key() == Qt.Key_K:
+            self.toggle_snap_to_keyframes()
+        if event.key() == Qt.Key_N:
+            self.jump_to_loop(self.timestamp_model.nextLoopRow(
+                self.media_player.get_time()))
+        if event.key() == Qt.Key_P:
+            self.jump_to_loop(self.timestamp_model.previousLoopRow(
+                self.loop.previous_position()))
 
     def wheel_handler(self, event):
         self.modify_volume(1 if event.angleDelta().y() > 0 else -1)
@@ -256,11 +317,21 @@ class MainWindow(QMainWindow):
             new_volume = 0
         elif new_volume > 40:
             new_volume = 40
-        self.media_player.audio_set_volume(new_volume)
+        self.set_volume(new_volume)
         self.ui.slider_volume.setValue(self.media_player.audio_get_volume())
 
     def set_volume(self, new_volume):
-        self.media_player.audio_set_volume(new_volume)
+        for player in self.media_players:
+            player.audio_set_volume(new_volume)
+
+    def toggle_gapless(self):
+        """
+        Switch between seeking back to the start of the loop and swapping
+        to the player waiting there
+        """
+        self.loop.set_gapless(not self.loop.gapless)
+        self.ui.statusBar().showMessage(
+            "Gapless looping " + ("on" if self.loop.gapless else "off"), 2000)
 
     def speed_up_handler(self):
         self.modify_rate(0.1)
@@ -272,39 +343,83 @@ class MainWindow(QMainWindow):
         new_rate = self.media_player.get_rate() + delta_percent
         if new_rate < 0.2 or new_rate > 2.0:
             return
-        self.media_player.set_rate(new_rate)
+        self.loop.set_rate(new_rate)
+
+    def toggle_snap_to_keyframes(self):
+        """
+        Switch between starting loops where they are marked and at the
+        keyframe nearest to that, which needs no decoding to seek to
+        """
+        self.snap_to_keyframes = not self.snap_to_keyframes
+        self.ui.statusBar().showMessage(
+            "Snap loop start to keyframes " +
+            ("on" if self.snap_to_keyframes else "off"), 2000)
+        if self.loop.looping():
+            self.update_slider_highlight()
+
+    def _keyframes_indexed(self, filename, keyframes):
+        if filename != self.video_filename:
+            # Another video was opened since
+            return
+        self.keyframes = keyframes
+        self.timestamp_model.setKeyframes(keyframes)
+        self.ui.statusBar().showMessage(
+            "Indexed {} keyframes".format(len(keyframes)), 2000)
+
+    def _loop_start(self, start, end):
+        """
+        Where a loop marked from start to end starts playing
+        """
+        if not self.snap_to_keyframes or not self.keyframes:
+            return start
+        snapped = self.keyframes.nearest(start)
+        return snapped if not end or snapped <= end else start
+
+    def media_time_change_handler(self, player, media_time, reported_at):
+        """
+        Pass the player's report on to the loop controller, with the clock
+        when libvlc made it rather than when it got here
+        """
+        if player is not self.media_player:
+            self.loop.standby_time_changed(media_time, reported_at)
+            return
+        self.loop.time_changed(media_time, reported_at)
+        self.loop.tick()
 
-    def media_time_change_handler(self, _):
-        if self.media_end_time == -1:
+    def update_active_loop(self):
+        """
+        Highlight the row of the innermost loop under the playhead
+        """
+        if not self.loop.started:
+            self.timestamp_model.setActiveRow(-1)
             return
-        if self.media_player.get_time() > self.media_end_time:
-            self.restart_needed = True
+        rows = self.timestamp_model.loopRowsAt(self.loop.time())
+        self.timestamp_model.setActiveRow(rows[0] if rows else -1)
+
+    def jump_to_loop(self, row):
+        """
+        Select the loop at the given source row and start playing it
+        """
+        if row == -1:
+            return
+        index = self.proxy_model.mapFromSource(
+            self.timestamp_model.index(row, 0))
+        self.ui.list_timestamp.selectRow(index.row())
+        self.run()
 
     def update_slider_highlight(self):
         if self.ui.list_timestamp.selectionModel().hasSelection():
             selected_row = self.ui.list_timestamp.selectionModel(). \
                 selectedRows()[0]
-            self.media_start_time = self.ui.list_timestamp.model().data(
-                selected_row.model().index(selected_row.row(), 0),
-                Qt.UserRole
-            )
-            self.media_end_time = self.ui.list_timestamp.model().data(
-                selected_row.model().index(selected_row.row(), 1),
-                Qt.UserRole
-            )
-            duration = self.media_player.get_media().get_duration()
-            self.media_end_time = self.media_end_time \
-                if self.media_end_time != 0 else duration
-            if self.media_start_time > self.media_end_time:
-                raise ValueError("Start time cannot be later than end time")
-            if self.media_start_time > duration:
-                raise ValueError("Start time not within video duration")
-            if self.media_end_time > duration:
-                raise ValueError("End time not within video duration")
-            slider_start_pos = (self.media_start_time / duration) * \
+            start, end = [self.ui.list_timestamp.model().data(
+                selected_row.model().index(selected_row.row(), column),
+                Qt.UserRole) for column in (0, 1)]
+            self.loop.set_range(self._loop_start(start, end), end)
+            duration = self.loop.duration
+            slider_start_pos = (self.loop.start / duration) * \
                                (self.ui.slider_progress.maximum() -
                                 self.ui.slider_progress.minimum())
-            slider_end_pos = (self.media_end_time / duration) * \
+            slider_end_pos = (self.loop.end / duration) * \
                              (self.ui.slider_progress.maximum() -
                               self.ui.slider_progress.minimum())
             self.ui.slider_progress.setHighlight(
@@ -312,8 +427,7 @@ class MainWindow(QMainWindow):
             )
 
         else:
-            self.media_start_time = 0
-            self.media_end_time = -1
+            self.loop.clear_range()
 
 
     def run(self):
@@ -326,13 +440,12 @@ class MainWindow(QMainWindow):
         if self.video_filename is None:
             self._show_error("No video file chosen")
             return
+        if self.media_parser is not None:
+            self._show_error("The video is still loading")
+            return
         try:
             self.update_slider_highlight()
-            self.media_player.play()
-            self.media_player.set_time(self.media_start_time)
-            self.media_started_playing = True
-            self.media_is_playing = True
-            self.play_pause_model.setState(False)
+            self.loop.run()
         except Exception as ex:
             self._show_error(str(ex))
             print(traceback.format_exc())
@@ -340,15 +453,10 @@ class MainWindow(QMainWindow):
     def play_pause(self):
         """Toggle play/pause status
         """
-        if not self.media_started_playing:
+        if not self.loop.started:
             self.run()
             return
-        if self.media_is_playing:
-            self.media_player.pause()
-        else:
-            self.media_player.play()
-        self.media_is_playing = not self.media_is_playing
-        self.play_pause_model.setState(not self.media_is_playing)
+        self.loop.play_pause()
 
     def toggle_full_screen(self):
         if self.is_full_screen:
@@ -378,17 +486,67 @@ class MainWindow(QMainWindow):
         """
         tmp_name, _ = QFileDialog.getOpenFileName(
             self, "Choose Timestamp file", None,
-            "Timestamp File (*.tmsp);;All Files (*)"
+            "Timestamp File (*.tmsp);;Timestamp Database (*.db *.sqlite);;"
+            "All Files (*)"
         )
         if not tmp_name:
             return
         self.set_timestamp_filename(QDir.toNativeSeparators(tmp_name))
 
-    def _sort_model(self):
-        self.ui.list_timestamp.sortByColumn(0, Qt.AscendingOrder)
+    def import_handler(self):
+        """
+        Add the timestamps in subtitle, cue sheet, edit decision list or CSV
+        files to the open timestamp file
+        """
+        if self.timestamp_filename is None:
+            self._show_error("Open a timestamp file to import into first")
+            return
+        extensions = " ".join(
+            "*" + extension for _, importer_extensions in IMPORTERS.values()
+            for extension in importer_extensions)
+        filenames, _ = QFileDialog.getOpenFileNames(
+            self, "Import timestamps", None,
+            "Timestamp Sources ({});;All Files (*)".format(extensions)
+        )
+        skipped = []
+        imported = 0
+        for filename in filenames:
+            filename = QDir.toNativeSeparators(filename)
+            try:
+                imported += self.timestamp_model.importTimestamps(import_file(
+                    filename,
+                    report=lambda line_number, message, filename=filename:
+                    skipped.append("{}:{}: {}".format(
+                        os.path.basename(filename), line_number, message))
+                ))
+            except (OSError, ValueError) as err:
+                self._show_error("Cannot import {}: {}".format(filename, err))
+        if filenames:
+            self.ui.statusBar().showMessage(
+                "Imported {} timestamp(s)".format(imported), 2000)
+        if skipped:
+            self._show_error("\n".join(skipped[:20] + (
+                ["... and {} more".format(len(skipped) - 20)]
+                if len(skipped) > 20 else [])), "Skipped lines")
+
+    def _sync_mapper(self):
+        """
+        Edited rows move to keep the table in start time order; point the
+        detail editor at wherever the selected row ended up
+        """
+        selected = self.ui.list_timestamp.selectionModel().selectedRows()
+        if selected:
+            self.mapper.setCurrentModelIndex(selected[0])
 
-    def _select_blank_row(self, parent, start, end):
-        self.ui.list_timestamp.selectRow(start)
+    def _select_blank_row(self):
+        """
+        Select the row the user just added; rows loaded, reloaded or
+        imported leave the selection alone
+        """
+        index = self.proxy_model.mapFromSource(
+            self.timestamp_model.blankRowIndex())
+        if index.isValid():
+            self.ui.list_timestamp.selectRow(index.row())
 
     def set_timestamp_filename(self, filename):
         """
@@ -398,43 +556,69 @@ class MainWindow(QMainWindow):
             self._show_error("Cannot access timestamp file " + filename)
             return
 
+        # The old model is closed first: reopening the same file, it would
+        # otherwise remove the journal the new model has just started
+        self._disconnect_model()
+        self.timestamp_model.close()
         try:
-            self.timestamp_model = TimestampModel(filename, self)
-            self.timestamp_model.timeParseError.connect(
-                lambda err: self._show_error(err)
-            )
-            self.proxy_model.setSortRole(Qt.UserRole)
-            self.proxy_model.dataChanged.connect(self._sort_model)
-            self.proxy_model.dataChanged.connect(self.update_slider_highlight)
+            timestamp_model = TimestampModel(filename, self)
+        except (ValueError, KeyError, TypeError):
+            self._show_invalid_file(filename)
+            # Nothing may edit the closed model any more
+            self.timestamp_model = TimestampModel(None, self)
+            self.proxy_model.setSourceModel(self.timestamp_model)
+            self.timestamp_filename = None
+            self.ui.entry_timestamp.clear()
+            return
+        try:
+            timestamp_model.setKeyframes(self.keyframes)
+            self.timestamp_model = timestamp_model
+            self._connect_model([
+                (self.timestamp_model.timeParseError,
+                 lambda err: self._show_error(err)),
+                (self.timestamp_model.loadFailed,
+                 lambda err: self._show_invalid_file(filename)),
+                (self.timestamp_model.savingStarted, self._connect_saver),
+                (self.timestamp_model.fileReloaded,
+                 lambda: self.ui.statusBar().showMessage(
+                     "Timestamp file changed on disk, reloaded", 2000)),
+            ])
+            if self.timestamp_model.saver is not None:
+                # Small files are read completely while the model is created
+                self._connect_saver(self.timestamp_model.saver)
             self.proxy_model.setSourceModel(self.timestamp_model)
-            self.proxy_model.rowsInserted.connect(self._sort_model)
-            self.proxy_model.rowsInserted.connect(self._select_blank_row)
-            self.ui.list_timestamp.setModel(self.proxy_model)
 
             self.timestamp_filename = filename
             self.ui.entry_timestamp.setText(self.timestamp_filename)
 
-            self.mapper.setModel(self.proxy_model)
-            self.mapper.addMapping(self.ui.entry_start_time, 0)
-            self.mapper.addMapping(self.ui.entry_end_time, 1)
-            self.mapper.addMapping(self.ui.entry_description, 2)
-            self.ui.list_timestamp.selectionModel().selectionChanged.connect(
-                self.timestamp_selection_changed)
-            self._sort_model()
-
             directory = os.path.dirname(self.timestamp_filename)
-            basename = os.path.basename(self.timestamp_filename)
-            timestamp_name_without_ext = os.path.splitext(basename)[0]
-            for file_in_dir in os.listdir(directory):
-                current_filename = os.path.splitext(file_in_dir)[0]
-                found_video = (current_filename == timestamp_name_without_ext
-                               and file_in_dir != basename)
-                if found_video:
-                    found_video_file = os.path.join(directory, file_in_dir)
-                    self.set_video_filename(found_video_file)
-                    break
-        except ValueError as err:
-            self._show_error("Timestamp file is invalid")
+            if self.timestamp_model.file_format == FORMAT_SQLITE:
+                # A database is keyed by video, relative to where it lives
+                video_file = os.path.join(directory,
+                                          self.timestamp_model.list.video)
+                if os.path.isfile(video_file):
+                    self.set_video_filename(video_file)
+                return
+            try:
+                video_file = self.library.video_for(self.timestamp_filename)
+                if video_file is None or not os.path.isfile(video_file):
+                    # The directory is new to the library or changed since
+                    # it was last scanned
+                    if not self.library.covers(directory):
+                        self.library.add_root(directory)
+                    self.library.scan_directory(directory)
+                    video_file = self.library.video_for(
+                        self.timestamp_filename)
+            except sqlite3.Error as err:
+                # e.g. locked by the scanner for longer than the timeout;
+                # the video can still be opened by hand
+                self.ui.statusBar().showMessage(
+                    "Cannot look up the video: " + str(err), 2000)
+                video_file = None
+            if video_file is not None:
+                self.set_video_filename(video_file)
+        except (ValueError, KeyError, TypeError):
+            self._show_invalid_file(filename)
 
     def timestamp_selection_changed(self, selected, deselected):
         if len(selected) > 0:
@@ -457,33 +641,88 @@ class MainWindow(QMainWindow):
 
     def set_video_filename(self, filename):
         """
-        Set the video filename
+        Set the video filename. A video opened for the first time (or
+        changed since) is parsed in the background; the controls that need
+        its length wait for it.
         """
         if not os.path.isfile(filename):
             self._show_error("Cannot access video file " + filename)
             return
 
         self.video_filename = filename
+        self.keyframes = None
+        self.timestamp_model.setKeyframes(None)
+        self.ui.entry_video.setText(self.video_filename)
 
         media = self.vlc_instance.media_new(self.video_filename)
-        media.parse()
-        if not media.get_duration():
+        media_info = self.library.media_info(filename)
+        if media_info is not None:
+            self.media_parser = None
+            self._set_media_controls_enabled(True)
+            self._media_ready(media, *media_info)
+            return
+        self.media_parser = MediaParser(media, self)
+        self.media_parser.finished.connect(self._media_parsed)
+        self._set_media_controls_enabled(False)
+        self.ui.statusBar().showMessage(
+            "Loading {}...".format(os.path.basename(filename)))
+        self.media_parser.start()
+
+    def _media_parsed(self, parser):
+        parser.deleteLater()
+        if parser is not self.media_parser:
+            # Another video was opened since
+            return
+        self.media_parser = None
+        self._set_media_controls_enabled(True)
+        self.ui.statusBar().clearMessage()
+        if parser.duration:
+            try:
+                self.library.store_media_info(self.video_filename,
+                                              parser.duration, parser.tracks)
+            except (OSError, sqlite3.Error):
+                # Only means the video is parsed again next time
+                pass
+        self._media_ready(parser.media, parser.duration, parser.tracks)
+
+    def _media_ready(self, media, duration, tracks):
+        """
+        Start using a parsed media
+        :param duration: Its length in milliseconds, 0 if it cannot play
+        :param tracks: Dicts describing its tracks
+        """
+        if not duration:
             self._show_error("Cannot play this media file")
-            self.media_player.set_media(None)
+            self.loop.set_media(None, 0)
             self.video_filename = None
-        else:
-            self.media_player.set_media(media)
+            self.ui.entry_video.clear()
+            return
+        self.loop.set_media(media, duration)
+        for index, player in enumerate(self.media_players):
+            window = self.ui.frame_video.surface(index).winId()
             if sys.platform.startswith('linux'): # for Linux using the X Server
-                self.media_player.set_xwindow(self.ui.frame_video.winId())
+                player.set_xwindow(window)
             elif sys.platform == "win32": # for Windows
-                self.media_player.set_hwnd(self.ui.frame_video.winId())
+                player.set_hwnd(window)
             elif sys.platform == "darwin": # for MacOS
-                self.media_player.set_nsobject(self.ui.frame_video.winId())
-            self.ui.entry_video.setText(self.video_filename)
-            self.media_started_playing = False
-            self.media_is_playing = False
-            self.set_volume(self.ui.slider_volume.value())
-            self.play_pause_model.setState(True)
+                player.set_nsobject(window)
+        self.ui.frame_video.show_surface(
+            self.media_players.index(self.media_player))
+        self.keyframe_indexer.start(self.video_filename, cache_filename(
+            self.video_filename, self.timestamp_filename))
+        self.ui.entry_video.setToolTip(", ".join(
+            " ".join([track["type"], track["codec"]] + (
+                ["{}x{}".format(track["width"], track["height"])]
+                if "width" in track else []))
+            for track in tracks))
+        self.set_volume(self.ui.slider_volume.value())
+        self.play_pause_model.setState(True)
+
+    def _set_media_controls_enabled(self, enabled):
+        for control in (self.ui.button_run, self.ui.button_play_pause,
+                        self.ui.slider_progress, self.ui.button_mark_start,
+                        self.ui.button_mark_end):
+            control.setEnabled(enabled)
 
     def browse_video_handler(self):
         """
@@ -497,6 +736,63 @@ class MainWindow(QMainWindow):
             return
         self.set_video_filename(QDir.toNativeSeparators(tmp_name))
 
+    def _connect_model(self, connections):
+        for signal, slot in connections:
+            signal.connect(slot)
+        self._model_connections.extend(connections)
+
+    def _disconnect_model(self):
+        for signal, slot in self._model_connections:
+            signal.disconnect(slot)
+        self._model_connections = []
+
+    def _connect_saver(self, saver):
+        self._connect_model([
+            (saver.pendingWritesChanged, self.show_save_state),
+            (saver.saveFailed,
+             lambda err: self._show_error(
+                 "Cannot save timestamp file: " + err)),
+        ])
+
+    def show_save_state(self, pending):
+        if pending:
+            self.ui.statusBar().showMessage(
+                "Saving {} change(s)...".format(pending))
+        else:
+            self.ui.statusBar().showMessage("All changes saved", 2000)
+
+    def shutdown(self):
+        """
+        Flush everything that still needs to be written before the
+        application quits
+        """
+        for events in self.player_events:
+            events.detach()
+        self.timestamp_model.close()
+        self.library.close()
+
+    def _show_invalid_file(self, filename, limit=20):
+        """
+        Tell where a timestamp file that failed to load is broken, all of
+        it at once
+        """
+        problems = []
+        count = 0
+        try:
+            for problem in validate(filename):
+                if problem.kind != PARSE_ERROR:
+                    continue
+                count += 1
+                if len(problems) < limit:
+                    problems.append("Entry {}: {}".format(
+                        problem.index + 1, problem.message)
+                        if problem.index is not None else problem.message)
+        except OSError as err:
+            problems.append(str(err))
+        if count > limit:
+            problems.append("... and {} more".format(count - limit))
+        self._show_error("\n".join(["Timestamp file is invalid"] + problems))
+
     def _show_error(self, message, title="Error"):
         QMessageBox.warning(self, title, message)
 
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+from PyQt5.QtWidgets import QApplication
+
+from lib import vlc
+
+
+class PlayerEvents(QObject):
+    """
+    Brings the events of a VLC media player over to the Qt thread. libvlc
+    calls back from its own thread, where nothing but queueing the event
+    happens: a vlc.EventQueue keeps only the latest position and time, and
+    wakes this object up once per batch through a queued signal. All the
+    signals below are emitted in the Qt thread, so their receivers may
+    control the player (seek, for one) right away.
+
+    Position changes come about as often as frames are shown; they are
+    passed on at most once per display frame, the latest one winning.
+    """
+    positionChanged = pyqtSignal(float)
+    # Media time in milliseconds, and the monotonic clock in milliseconds
+    # when libvlc reported it
+    timeChanged = pyqtSignal(int, float)
+    playingChanged = pyqtSignal(bool)
+    endReached = pyqtSignal()
+    _wakeup = pyqtSignal()
+    EVENT_TYPES = (
+        vlc.EventType.MediaPlayerPositionChanged,
+        vlc.EventType.MediaPlayerTimeChanged,
+        vlc.EventType.MediaPlayerPlaying,
+        vlc.EventType.MediaPlayerPaused,
+        vlc.EventType.MediaPlayerStopped,
+        vlc.EventType.MediaPlayerEndReached,
+    )
+
+    def __init__(self, media_player, parent=None):
+        super(PlayerEvents, self).__init__(parent)
+        screen = QApplication.primaryScreen()
+        refresh_rate = screen.refreshRate() if screen is not None else 0
+        self._position = None
+        self._frame_timer = QTimer(self)
+        self._frame_timer.setSingleShot(True)
+        self._frame_timer.setInterval(
+            int(1000 / refresh_rate) if refresh_rate > 0 else 16)
+        self._frame_timer.timeout.connect(self._frame_ended)
+        self._wakeup.connect(self._dispatch)
+        self.queue = vlc.EventQueue(wakeup=self._wakeup.emit)
+        self._event_manager = media_player.event_manager()
+        self._event_manager.event_forward(self.queue, *self.EVENT_TYPES)
+
+    def _dispatch(self):
+        event_type = vlc.EventType
+        for event, received_at in self.queue.get_all():
+            if event.type == event_type.MediaPlayerPositionChanged:
+                self._position_received(event.u.new_position)
+            elif event.type == event_type.MediaPlayerTimeChanged:
+                self.timeChanged.emit(event.u.new_time, received_at * 1000)
+            elif event.type == event_type.MediaPlayerPlaying:
+                self.playingChanged.emit(True)
+            elif event.type in (event_type.MediaPlayerPaused,
+                                event_type.MediaPlayerStopped):
+                self.playingChanged.emit(False)
+            elif event.type == event_type.MediaPlayerEndReached:
+                self.endReached.emit()
+
+    def _position_received(self, position):
+        """
+        The first change in a frame goes out right away, the last one once
+        the frame is over
+        """
+        if self._frame_timer.isActive():
+            self._position = position
+            return
+        self._position = None
+        self.positionChanged.emit(position)
+        self._frame_timer.start()
+
+    def _frame_ended(self):
+        if self._position is not None:
+            position, self._position = self._position, None
+            self.positionChanged.emit(position)
+            self._frame_timer.start()
+
+    def detach(self):
+        for event_type in self.EVENT_TYPES:
+            self._event_manager.event_detach(event_type)
+
+
+class MediaParser(QObject):
+    """
+    Parses a media in libvlc's background thread instead of blocking the
+    Qt one. finished is emitted in the Qt thread, with this object, once
+    libvlc is done; duration and tracks are only known then, and
+    duration stays 0 if the media could not be parsed.
+    """
+    finished = pyqtSignal(QObject)
+    _wakeup = pyqtSignal()
+    # Milliseconds before libvlc gives up on a file
+    TIMEOUT = 10000
+    TRACK_TYPES = {
+        vlc.TrackType.audio: "audio",
+        vlc.TrackType.video: "video",
+        vlc.TrackType.text: "text",
+    }
+
+    def __init__(self, media, parent=None):
+        super(MediaParser, self).__init__(parent)
+        self.media = media
+        self.status = None
+        self.duration = 0
+        self.tracks = []
+        self._wakeup.connect(self._dispatch)
+        self.queue = vlc.EventQueue(wakeup=self._wakeup.emit)
+        self._event_manager = media.event_manager()
+
+    def start(self):
+        self._event_manager.event_forward(self.queue,
+                                          vlc.EventType.MediaParsedChanged)
+        if self.media.parse_with_options(vlc.MediaParseFlag.local,
+                                         self.TIMEOUT) == -1:
+            self._finish(vlc.MediaParsedStatus.failed.value)
+
+    def _dispatch(self):
+        for event, _ in self.queue.get_all():
+            if self.status is None:
+                self._finish(event.u.new_status)
+
+    def _finish(self, status):
+        self._event_manager.event_detach(vlc.EventType.MediaParsedChanged)
+        self.status = status
+        if status == vlc.MediaParsedStatus.done.value:
+            self.duration = max(0, self.media.get_duration())
+            self.tracks = [self._track(track)
+                           for track in self.media.tracks_get() or ()]
+        self.finished.emit(self)
+
+    @staticmethod
+    def _track(track):
+        """
+        What is kept of a track: its type, codec and, for sound and
+        pictures, their format
+        """
+        description = {
+            "type": MediaParser.TRACK_TYPES.get(track.type, "unknown"),
+            "codec": track.codec.to_bytes(4, "little").decode(
+                "ascii", "replace"),
+        }
+        if track.type == vlc.TrackType.video and track.video:
+            description["width"] = track.video.contents.width
+            description["height"] = track.video.contents.height
+        elif track.type == vlc.TrackType.audio and track.audio:
+            description["channels"] = track.audio.contents.channels
+            description["rate"] = track.audio.contents.rate
+        return description
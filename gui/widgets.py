@@ -2,19 +2,21 @@
 # -*- coding: utf-8 -*-
 
 from PyQt5.QtWidgets import QFrame, QSlider, QStyle, QStyleOptionSlider, \
-    QPlainTextEdit, QPushButton
+    QPlainTextEdit, QPushButton, QStackedLayout, QWidget
 from PyQt5.QtGui import QPalette, QColor, QWheelEvent, QKeyEvent, QPainter, \
     QPen
-from PyQt5.QtCore import pyqtSignal, QRect
+from PyQt5.QtCore import pyqtSignal, QRect, Qt
 
 
 class VideoFrame(QFrame):
     """
-    A frame used specifically for video/media purpose
+    A frame used specifically for video/media purpose. It holds a surface
+    per media player, one on top of the other, and shows one at a time.
     """
     doubleClicked = pyqtSignal()
     wheel = pyqtSignal(QWheelEvent)
     keyPressed = pyqtSignal(QKeyEvent)
+    SURFACES = 2
 
     def __init__(self, parent=None):
         QFrame.__init__(self, parent)
@@ -26,6 +28,21 @@ class VideoFrame(QFrame):
         self.setPalette(self.palette)
         self.setAutoFillBackground(True)
 
+        self.surfaces = QStackedLayout(self)
+        self.surfaces.setContentsMargins(0, 0, 0, 0)
+        for _ in range(self.SURFACES):
+            surface = QWidget(self)
+            # The players draw straight into it; input goes to the frame
+            surface.setAttribute(Qt.WA_NativeWindow)
+            surface.setAttribute(Qt.WA_TransparentForMouseEvents)
+            self.surfaces.addWidget(surface)
+
+    def surface(self, index):
+        return self.surfaces.widget(index)
+
+    def show_surface(self, index):
+        self.surfaces.setCurrentIndex(index)
+
     def mouseDoubleClickEvent(self, _):
         self.doubleClicked.emit()
 
@@ -44,6 +44,9 @@ from ctypes.util import find_library
 import os
 import sys
 import functools
+import threading
+import time
+from collections import deque
 
 # Used by EventManager in override.py
 from inspect import getargspec
@@ -628,13 +631,32 @@ See libvlc_media_parse_with_options.
     _enum_names_ = {
         0x00: 'local',
         0x01: 'network',
-        0x02: 'local',
-        0x04: 'network',
+        0x02: 'fetch_local',
+        0x04: 'fetch_network',
+        0x08: 'do_interact',
     }
-MediaParseFlag.local   = MediaParseFlag(0x00)
-MediaParseFlag.local   = MediaParseFlag(0x02)
-MediaParseFlag.network = MediaParseFlag(0x01)
-MediaParseFlag.network = MediaParseFlag(0x04)
+MediaParseFlag.do_interact   = MediaParseFlag(0x08)
+MediaParseFlag.fetch_local   = MediaParseFlag(0x02)
+MediaParseFlag.fetch_network = MediaParseFlag(0x04)
+MediaParseFlag.local         = MediaParseFlag(0x00)
+MediaParseFlag.network       = MediaParseFlag(0x01)
+
+class MediaParsedStatus(_Enum):
+    '''Parse status sent by libvlc_media_parse_with_options() or returned by
+libvlc_media_get_parsed_status()
+See libvlc_media_parse_with_options
+See libvlc_media_get_parsed_status.
+    '''
+    _enum_names_ = {
+        1: 'skipped',
+        2: 'failed',
+        3: 'timeout',
+        4: 'done',
+    }
+MediaParsedStatus.done    = MediaParsedStatus(4)
+MediaParsedStatus.failed  = MediaParsedStatus(2)
+MediaParsedStatus.skipped = MediaParsedStatus(1)
+MediaParsedStatus.timeout = MediaParsedStatus(3)
 
 class PlaybackMode(_Enum):
     '''Defines playback modes for playlist.
@@ -1264,6 +1286,25 @@ class MediaTrack(_Cstruct):
         ('description',        ctypes.c_char_p),
         ]
 
+    def copy(self):
+        """Copy the track, and what it points to, out of the array that
+        L{libvlc_media_tracks_release} frees.
+        """
+        track = MediaTrack.from_buffer_copy(self)
+        track.u = MediaTrackTracks()
+        if self.type == TrackType.audio and self.audio:
+            track.audio = ctypes.pointer(
+                AudioTrack.from_buffer_copy(self.audio.contents))
+        elif self.type == TrackType.video and self.video:
+            track.video = ctypes.pointer(
+                VideoTrack.from_buffer_copy(self.video.contents))
+        elif self.type == TrackType.text and self.subtitle:
+            track.subtitle = ctypes.pointer(
+                SubtitleTrack(self.subtitle.contents.encoding))
+        track.language = self.language
+        track.description = self.description
+        return track
+
 class PlaylistItem(_Cstruct):
     _fields_ = [
         ('id',   ctypes.c_int   ),
@@ -1484,6 +1525,87 @@ class EventManager(_Ctype):
             del self._callbacks[k] # remove, regardless of libvlc return value
             libvlc_event_detach(self, k, self._callback_handler, k)
 
+    def event_forward(self, queue, *eventtypes):
+        """Forward events of the given types to an L{EventQueue}.
+
+        @param queue: the queue to put the events in.
+        @param eventtypes: the event types to forward.
+        """
+        for eventtype in eventtypes:
+            self.event_attach(eventtype, queue.put)
+
+class EventQueue(object):
+    '''Thread-safe queue carrying events out of libvlc's event thread.
+
+    Events are copied as they are put, since libvlc frees them once the
+    callback returns, and stamped with the time they arrived. For the
+    coalesced event types, which libvlc sends many times a second, only
+    the latest event waits in the queue: a newer one takes its place
+    rather than queueing behind it. The queue is bounded; when full, the
+    oldest event is dropped. Merged and dropped events are counted.
+
+    The consumer is woken up through the wakeup callable (e.g. the emit
+    method of a queued Qt signal) when the queue stops being empty, and
+    takes everything at once with get_all().
+    '''
+
+    COALESCED = (EventType.MediaPlayerPositionChanged,
+                 EventType.MediaPlayerTimeChanged,
+                 EventType.MediaPlayerLengthChanged,
+                 EventType.MediaPlayerBuffering)
+
+    def __init__(self, maxsize=256, wakeup=None, coalesced=COALESCED):
+        self.maxsize = maxsize
+        self.wakeup = wakeup
+        self.coalesced = set(eventtype.value for eventtype in coalesced)
+        self.received = 0
+        self.merged = 0
+        self.dropped = 0
+        self._lock = threading.Lock()
+        # Slots of [event, time received], oldest first
+        self._events = deque()
+        # Slot of the pending event of each coalesced type
+        self._latest = {}
+        self._clock = getattr(time, 'monotonic', time.time)
+
+    def put(self, event):
+        """Queue a copy of event; called in libvlc's event thread.
+        """
+        slot = [Event.from_buffer_copy(event), self._clock()]
+        k = slot[0].type.value
+        with self._lock:
+            self.received += 1
+            pending = self._latest.get(k)
+            if pending is not None:
+                pending[:] = slot
+                self.merged += 1
+                return
+            if len(self._events) >= self.maxsize:
+                dropped = self._events.popleft()
+                if self._latest.get(dropped[0].type.value) is dropped:
+                    del self._latest[dropped[0].type.value]
+                self.dropped += 1
+            self._events.append(slot)
+            if k in self.coalesced:
+                self._latest[k] = slot
+            wake = len(self._events) == 1
+        if wake and self.wakeup is not None:
+            self.wakeup()
+
+    def get_all(self):
+        """Take every queued event.
+
+        @return: list of (event, time received), oldest first.
+        """
+        with self._lock:
+            events, self._events = self._events, deque()
+            self._latest = {}
+        return [tuple(slot) for slot in events]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._events)
+
 class Instance(_Ctype):
     '''Create a new Instance instance.
 
@@ -2070,13 +2192,21 @@ class Media(_Ctype):
         Note, you need to call L{parse}() or play the media at least once
         before calling this function.
         Not doing this will result in an empty array.
-        The result must be freed with L{tracks_release}.
+        The tracks are copies; the array libvlc allocated is released.
         @version: LibVLC 2.1.0 and later.
         """
         mediaTrack_pp = ctypes.POINTER(MediaTrack)()
-        n = libvlc_media_tracks_get(self, byref(mediaTrack_pp))
-        info = cast(ctypes.mediaTrack_pp, ctypes.POINTER(ctypes.POINTER(MediaTrack) * n))
-        return info
+        n = libvlc_media_tracks_get(self, ctypes.byref(mediaTrack_pp))
+        info = ctypes.cast(mediaTrack_pp, ctypes.POINTER(ctypes.POINTER(MediaTrack) * n))
+        try:
+            contents = info.contents
+        except ValueError:
+            # Media not parsed, no info.
+            return None
+        try:
+            return [track.contents.copy() for track in contents]
+        finally:
+            libvlc_media_tracks_release(mediaTrack_pp, n)
 
 
     
@@ -2245,7 +2375,7 @@ class Media(_Ctype):
         return libvlc_media_parse_async(self)
 
     
-    def parse_with_options(self, parse_flag):
+    def parse_with_options(self, parse_flag, timeout):
         '''Parse the media asynchronously with options.
         This fetches (local or network) art, meta data and/or tracks information.
         This method is the extended version of L{parse_async}().
@@ -2260,10 +2390,11 @@ class Media(_Ctype):
         See L{tracks_get}
         See libvlc_media_parse_flag_t.
         @param parse_flag: parse options:
+        @param timeout: maximum time allowed to preparse the media. If -1, the default "preparse-timeout" option will be used as a timeout. If 0, it will wait indefinitely. If > 0, the timeout will be used (in milliseconds).
         @return: -1 in case of error, 0 otherwise.
         @version: LibVLC 3.0.0 or later.
         '''
-        return libvlc_media_parse_with_options(self, parse_flag)
+        return libvlc_media_parse_with_options(self, parse_flag, timeout)
 
     
     def is_parsed(self):
@@ -4344,7 +4475,7 @@ def libvlc_media_parse_async(p_md):
                     None, Media)
     return f(p_md)
 
-def libvlc_media_parse_with_options(p_md, parse_flag):
+def libvlc_media_parse_with_options(p_md, parse_flag, timeout):
     '''Parse the media asynchronously with options.
     This fetches (local or network) art, meta data and/or tracks information.
     This method is the extended version of L{libvlc_media_parse_async}().
@@ -4360,13 +4491,14 @@ def libvlc_media_parse_with_options(p_md, parse_flag):
     See libvlc_media_parse_flag_t.
     @param p_md: media descriptor object.
     @param parse_flag: parse options:
+    @param timeout: maximum time allowed to preparse the media. If -1, the default "preparse-timeout" option will be used as a timeout. If 0, it will wait indefinitely. If > 0, the timeout will be used (in milliseconds).
     @return: -1 in case of error, 0 otherwise.
     @version: LibVLC 3.0.0 or later.
     '''
     f = _Cfunctions.get('libvlc_media_parse_with_options', None) or \
-        _Cfunction('libvlc_media_parse_with_options', ((1,), (1,),), None,
-                    ctypes.c_int, Media, MediaParseFlag)
-    return f(p_md, parse_flag)
+        _Cfunction('libvlc_media_parse_with_options', ((1,), (1,), (1,),), None,
+                    ctypes.c_int, Media, MediaParseFlag, ctypes.c_int)
+    return f(p_md, parse_flag, timeout)
 
 def libvlc_media_is_parsed(p_md):
     '''Get Parsed status for media descriptor object.
@@ -4,18 +4,246 @@
 """
 Program to loop videos based on timestamps in a text file
 """
+from array import array
 import argparse
 import os
 import sys
 
+from app.formats import FORMAT_BINARY, FORMAT_JSON, FORMAT_SQLITE, FORMATS, \
+    detect_format
+from app.importers import IMPORTERS, batches, import_file
+from app.journal import write_atomically
+from app.library import MediaLibrary, default_filename
+from app.model import TimestampDelta, TimestampList, read_timestamp_file
+from app.sqlite_store import SqliteTimestampList
+from app.validator import KINDS, validate
 from gui import MainWindow
 from PyQt5.QtWidgets import QApplication
 
 
+def convert(argv):
+    """
+    Convert a timestamp file between the JSON, binary and SQLite formats
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py convert",
+        description="Convert a timestamp file between the JSON, binary and "
+                    "SQLite formats."
+    )
+    parser.add_argument('input_filename', metavar='IN',
+                        help='the timestamp file to read')
+    parser.add_argument('output_filename', metavar='OUT',
+                        help='the timestamp file to write')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='the output format; defaults to binary for '
+                             'JSON input and to JSON otherwise')
+    parser.add_argument('--video', metavar='V',
+                        help='the video whose timestamps to read from or '
+                             'write to an SQLite database')
+    args = parser.parse_args(argv)
+    try:
+        timestamp_list, _, input_format = read_timestamp_file(
+            args.input_filename, args.video)
+        output_format = args.format or (
+            FORMAT_BINARY if input_format == FORMAT_JSON else FORMAT_JSON)
+        if output_format == FORMAT_SQLITE:
+            store = SqliteTimestampList(args.output_filename,
+                                        args.video or "")
+            try:
+                store.replace_all(timestamp_list)
+            finally:
+                store.close()
+        else:
+            write_atomically(args.output_filename,
+                             timestamp_list.serialize(output_format))
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+    return 0
+
+
+def library(argv):
+    """
+    Manage the library index that maps timestamp files to their videos
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py library",
+        description="Manage the index of timestamp files and their videos."
+    )
+    parser.add_argument('--index', metavar='DB',
+                        help='the library index to use')
+    actions = parser.add_subparsers(dest='action')
+    add_parser = actions.add_parser('add', help='add a root directory')
+    add_parser.add_argument('root', metavar='ROOT')
+    add_parser.add_argument('--recursive', action='store_true',
+                            help='index subdirectories too')
+    remove_parser = actions.add_parser('remove',
+                                       help='stop indexing a root directory')
+    remove_parser.add_argument('root', metavar='ROOT')
+    actions.add_parser('scan', help='bring the index up to date')
+    actions.add_parser('list', help='list the annotated videos')
+    args = parser.parse_args(argv)
+    if args.action is None:
+        parser.print_help()
+        return 2
+    media_library = MediaLibrary(args.index or default_filename())
+    try:
+        if args.action == 'add':
+            media_library.add_root(args.root, args.recursive)
+            media_library.scan([(os.path.abspath(args.root), args.recursive)])
+        elif args.action == 'remove':
+            media_library.remove_root(args.root)
+        elif args.action == 'scan':
+            print("{} file(s) changed".format(media_library.scan()))
+        else:
+            for timestamp_filename, video_filename in \
+                    media_library.annotated_videos():
+                print("{}\t{}".format(timestamp_filename, video_filename))
+    finally:
+        media_library.close()
+    return 0
+
+
+def import_timestamps(argv):
+    """
+    Import subtitle, cue sheet, edit decision list or CSV files into a
+    timestamp file
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py import",
+        description="Add the timestamps in subtitle, cue sheet, edit "
+                    "decision list or CSV files to a timestamp file, which "
+                    "is created if needed."
+    )
+    parser.add_argument('sources', metavar='SOURCE', nargs='+',
+                        help='the files to import')
+    parser.add_argument('output_filename', metavar='OUT',
+                        help='the timestamp file to add the timestamps to')
+    parser.add_argument('--from', dest='source_format',
+                        choices=sorted(IMPORTERS),
+                        help='the format of the sources; guessed from their '
+                             'extension by default')
+    parser.add_argument('--format', choices=FORMATS,
+                        help='the format of a new timestamp file; defaults '
+                             'to JSON')
+    parser.add_argument('--video', metavar='V',
+                        help='the video whose timestamps to add to in an '
+                             'SQLite database')
+    parser.add_argument('--fps', type=float, default=25,
+                        help='the frame rate of edit decision lists')
+    args = parser.parse_args(argv)
+    skipped = [0]
+
+    def timestamps():
+        for source in args.sources:
+            def report(line_number, message, source=source):
+                skipped[0] += 1
+                print("{}:{}: {}".format(source, line_number, message),
+                      file=sys.stderr)
+            for timestamp in import_file(source, args.source_format, report,
+                                         fps=args.fps):
+                yield timestamp
+
+    output_format = detect_format(args.output_filename) \
+        if os.path.exists(args.output_filename) \
+        else args.format or FORMAT_JSON
+    try:
+        if output_format == FORMAT_SQLITE:
+            # Written as they are read, a batch at a time
+            store = SqliteTimestampList(args.output_filename,
+                                        args.video or "")
+            try:
+                with store.bulk():
+                    for batch in batches(timestamps()):
+                        store.insert_many(batch)
+            finally:
+                store.close()
+        else:
+            # Only the columns are kept, and sorted once at the end
+            if os.path.exists(args.output_filename):
+                timestamp_list = read_timestamp_file(args.output_filename)[0]
+                start_times = timestamp_list.start_times
+                end_times = timestamp_list.end_times
+                descriptions = timestamp_list.descriptions
+            else:
+                start_times, end_times, descriptions = \
+                    array("q"), array("q"), []
+            for timestamp in timestamps():
+                start_times.append(timestamp.start_time.milliseconds)
+                end_times.append(timestamp.end_time.milliseconds)
+                descriptions.append(timestamp.description)
+            write_atomically(args.output_filename, TimestampList.from_columns(
+                start_times, end_times, descriptions
+            ).serialize(output_format))
+    except (OSError, ValueError) as err:
+        print(err, file=sys.stderr)
+        return 1
+    if skipped[0]:
+        print("{} line(s) skipped".format(skipped[0]), file=sys.stderr)
+    return 0
+
+
+def validate_file(argv):
+    """
+    Report everything that is wrong with a timestamp file
+    """
+    parser = argparse.ArgumentParser(
+        prog="main.py validate",
+        description="Check every entry of a timestamp file and report all "
+                    "parse errors, start times later than end times, "
+                    "overlapping entries and entries past the end of the "
+                    "video."
+    )
+    parser.add_argument('filename', metavar='F',
+                        help='the timestamp file to check')
+    parser.add_argument('--video', metavar='V',
+                        help='the video whose timestamps to check in an '
+                             'SQLite database')
+    parser.add_argument('--duration', metavar='T',
+                        help='the length of the video, as H:MM:SS.mmm')
+    parser.add_argument('--ignore', metavar='KIND', action='append',
+                        choices=KINDS, default=[],
+                        help='a kind of problem not to report; one of ' +
+                             ', '.join(KINDS))
+    args = parser.parse_args(argv)
+    try:
+        duration = TimestampDelta.from_string(args.duration) \
+            if args.duration else None
+    except (ValueError, IndexError):
+        parser.error("invalid duration " + args.duration)
+    found = 0
+    try:
+        for problem in validate(args.filename, args.video, duration):
+            if problem.kind in args.ignore:
+                continue
+            found += 1
+            where = "entry {}".format(problem.index + 1) \
+                if problem.index is not None else "file"
+            print("{}: {}: {}: {}".format(args.filename, where, problem.kind,
+                                          problem.message))
+    except OSError as err:
+        print(err, file=sys.stderr)
+        return 2
+    if found:
+        print("{} problem(s) found".format(found), file=sys.stderr)
+        return 1
+    return 0
+
+
+COMMANDS = {
+    "convert": convert,
+    "import": import_timestamps,
+    "library": library,
+    "validate": validate_file,
+}
+
+
 def main():
     """
     Main function for the program
     """
+    if len(sys.argv) > 1 and sys.argv[1] in COMMANDS:
+        sys.exit(COMMANDS[sys.argv[1]](sys.argv[2:]))
     parser = argparse.ArgumentParser(
         description="Loop a video between 2 points in time based on rules in "
                     "a text file."
@@ -29,6 +257,7 @@ def main():
     with open("gui/application.qss", "r") as theme_file:
         app.setStyleSheet(theme_file.read())
     main_window = MainWindow()
+    app.aboutToQuit.connect(main_window.shutdown)
 
     if args.timestamp_filename:
         timestamp_filename = os.path.abspath(args.timestamp_filename)
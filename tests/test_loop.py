@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+LoopController driven by the fake players of the loop benchmark, on their
+virtual clock, so every run sees the same reports. Run from the repository
+root:
+
+    python -m unittest discover tests
+"""
+import unittest
+
+from app.loop import LoopController
+from benchmarks.bench_loop import FakePlayer, FakeTimer
+
+LENGTH = 10 * 60 * 1000
+START = 1000
+END = 3000
+
+
+class LoopControllerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.player = FakePlayer(LENGTH, report_interval=250,
+                                 seek_latency=30, resume_latency=5)
+        self.standby = FakePlayer(LENGTH, report_interval=250,
+                                  seek_latency=30, resume_latency=5)
+        self.controller = LoopController(
+            self.player, clock=lambda: self.player.clock,
+            standby=self.standby)
+        for fake in (self.player, self.standby):
+            fake.time_changed = lambda fake=fake: (
+                self.controller.time_changed
+                if self.controller.player is fake
+                else self.controller.standby_time_changed)()
+        self.restarts = []
+        self.controller.restarted.connect(self.restarts.append)
+
+    def start(self, predictive=True, gapless=False):
+        if predictive:
+            self.controller.timer = FakeTimer(self.player,
+                                              self.controller.boundary)
+        self.controller.set_media(self.player.media, self.player.length)
+        self.controller.set_range(START, END)
+        self.controller.set_gapless(gapless)
+        self.controller.run()
+
+    def step(self, milliseconds):
+        for _ in range(milliseconds):
+            self.player.step()
+            self.standby.step()
+
+    def run_for(self, milliseconds):
+        """
+        Let time pass, ticking the controller like its owner does
+        """
+        for _ in range(milliseconds // LoopController.TICK):
+            self.step(LoopController.TICK)
+            self.controller.tick()
+
+    def test_restarts_at_the_end(self):
+        self.start()
+        self.run_for(END - START - LoopController.TICK)
+        self.assertEqual(self.restarts, [])
+        self.run_for(2 * LoopController.TICK)
+        self.assertEqual(self.restarts, [START])
+        self.run_for(10000)
+        self.assertEqual(self.controller.restarts, 6)
+        self.assertTrue(START <= self.player.time <= END)
+
+    def test_seeks_from_tick_without_a_timer(self):
+        self.start(predictive=False)
+        # The first report past the end
+        self.step(END - START + self.player.report_interval)
+        self.assertTrue(self.controller.restart_needed)
+        self.assertIsNone(self.player._seek)
+        self.assertEqual(self.restarts, [])
+        self.controller.tick()
+        self.assertFalse(self.controller.restart_needed)
+        self.assertEqual(self.player._seek[1], START)
+        self.assertEqual(self.restarts, [START])
+
+    def test_learns_the_seek_latency(self):
+        self.start()
+        self.assertEqual(self.controller.seek_latency, 0.0)
+        self.run_for(10000)
+        self.assertAlmostEqual(self.controller.seek_latency,
+                               self.player.seek_latency, delta=1)
+        self.assertEqual(list(self.controller.gaps)[-1],
+                         self.player.seek_latency)
+
+    def test_overshoot_is_bounded(self):
+        self.start()
+        self.run_for(20000)
+        # The first passes run before the seek latency is known
+        overshoots = [peak - END for peak in self.player.seeks[3:]]
+        self.assertTrue(overshoots)
+        for overshoot in overshoots:
+            self.assertTrue(0 <= overshoot <= LoopController.SEEK_SLACK)
+
+    def test_overshoot_without_a_timer_is_a_report_interval(self):
+        self.start(predictive=False)
+        self.run_for(20000)
+        overshoots = [peak - END for peak in self.player.seeks[3:]]
+        self.assertTrue(overshoots)
+        for overshoot in overshoots:
+            self.assertTrue(0 <= overshoot <= self.player.report_interval +
+                            LoopController.TICK)
+
+    def test_swaps_once_the_standby_reports_the_start(self):
+        swapped = []
+        self.controller.swapped.connect(swapped.append)
+        self.start(gapless=True)
+        self.assertEqual(self.controller._standby_state,
+                         LoopController.PREROLLING)
+        # Playing muted until its first report, then seeking while paused
+        self.step(self.standby.report_interval)
+        self.assertEqual(self.controller._standby_state,
+                         LoopController.CUEING)
+        self.assertFalse(self.standby.playing)
+        # A report from before the seek landed does not count
+        self.controller.standby_time_changed(START + 500)
+        self.assertEqual(self.controller._standby_state,
+                         LoopController.CUEING)
+        self.step(self.standby.seek_latency)
+        self.assertEqual(self.standby.get_time(), START)
+        self.assertEqual(self.controller._standby_state,
+                         LoopController.READY)
+
+        player, standby = self.player, self.standby
+        self.run_for(END - START)
+        self.assertEqual(swapped, [standby])
+        self.assertIs(self.controller.player, standby)
+        self.assertIs(self.controller.standby, player)
+        self.assertTrue(standby.playing)
+        self.assertFalse(player.playing)
+        self.assertTrue(player.muted)
+        # The player that was playing is cued for the next pass
+        self.run_for(LoopController.TICK)
+        self.assertEqual(player.time, START)
+        self.assertEqual(self.controller._standby_state,
+                         LoopController.READY)
+
+    def test_seeks_while_the_standby_is_not_ready(self):
+        swapped = []
+        self.controller.swapped.connect(swapped.append)
+        self.start(gapless=True)
+        # Reports that never reach the start keep it from swapping
+        self.standby.time_changed = lambda: None
+        self.run_for(END - START + LoopController.TICK)
+        self.assertEqual(self.restarts, [START])
+        self.assertEqual(swapped, [])
+        self.assertIs(self.controller.player, self.player)
+
+
+if __name__ == '__main__':
+    unittest.main()